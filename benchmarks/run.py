@@ -0,0 +1,207 @@
+"""
+Times each stage of form generation and conversion on synthetic shapes, and records the results as JSON so they can be
+compared between commits:
+
+    python -m benchmarks.run --out before.json
+    python -m benchmarks.run --out after.json --compare before.json
+"""
+from benchmarks.shapes import generate_shape, generate_form_input
+from shaclform.rdfhandling import RDFHandler
+from shaclform.rendering import get_environment, render_template
+from shaclform.form2rdf import Form2RDFController, CompiledMap
+from shaclform.generate_form import prepare_shape, sort_shape, assign_ids, link_paired_properties
+from rdflib import Graph
+from copy import deepcopy
+from statistics import median
+import argparse
+import datetime
+import platform
+import subprocess
+import json
+import time
+import sys
+import os
+
+# The shapes benchmarked, as the arguments given to generate_shape
+CASES = {
+    'flat': dict(properties=200),
+    'nested': dict(properties=50, depth=4),
+    'grouped': dict(properties=200, groups=10),
+    'paired': dict(properties=200, paired=100),
+    'options': dict(properties=20, options=5000),
+    'large': dict(properties=1000, depth=3, groups=20, paired=200, options=2000),
+}
+
+# Stages in the order they run
+STAGES = ['parse', 'get_shape', 'sort', 'ids', 'pairing', 'render', 'map', 'compile_map', 'convert']
+
+
+class FormRequest:
+    # Stands in for the request object received from the form
+    def __init__(self, form):
+        self.form = form
+
+
+def time_stage(function, repeat, setup=None):
+    """
+    :param function: Called with the result of setup, or with nothing if there is no setup
+    :param repeat: The number of times the stage is timed
+    :param setup: Called before each run, outside of the timing
+    :return: A dict of the fastest, median and mean times in seconds, and the result of the last run
+    """
+    times = list()
+    result = None
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': median(times), 'mean': sum(times) / len(times), 'repeat': repeat}, result
+
+
+def run_case(params, repeat=5):
+    """
+    Times each stage for the shape generated from params. The form is generated without an option threshold, so that
+    large sh:in lists are rendered into the form as they would be without option indexes
+    :param params: The arguments given to generate_shape
+    :param repeat: The number of times each stage is timed
+    :return: A dict of the timings of each stage, and counts describing the shape
+    """
+    stages = dict()
+    turtle = generate_shape(**params).serialize(format='turtle')
+
+    stages['parse'], graph = time_stage(lambda: Graph().parse(data=turtle, format='turtle'), repeat)
+    # A new handler each time, so nothing read by the previous run is reused
+    stages['get_shape'], shape = time_stage(lambda handler: handler.get_shape(), repeat,
+                                            setup=lambda: RDFHandler(graph))
+    rdf_handler = RDFHandler(graph)
+
+    def prepared(*steps):
+        # A copy of the shape with the given steps already applied
+        def setup():
+            copy = deepcopy(shape)
+            for step in steps:
+                step(copy)
+            return copy
+        return setup
+
+    stages['sort'], _ = time_stage(sort_shape, repeat, setup=prepared())
+    stages['ids'], _ = time_stage(assign_ids, repeat, setup=prepared(sort_shape))
+
+    def sorted_with_ids():
+        copy = prepared(sort_shape)()
+        return copy, assign_ids(copy)
+
+    stages['pairing'], _ = time_stage(lambda args: link_paired_properties(*args), repeat, setup=sorted_with_ids)
+    form_name, prepared_shape = prepare_shape(deepcopy(shape))
+
+    # Rendered properties are cleared from the cache each run, so the full render is timed
+    def clear_fragments():
+        if get_environment().fragment_cache is not None:
+            get_environment().fragment_cache.clear()
+        return prepared_shape
+
+    stages['render'], html = time_stage(lambda s: render_template(form_name, s), repeat, setup=clear_fragments)
+    stages['map'], map_graph = time_stage(lambda: rdf_handler.build_rdf_map(prepared_shape), repeat)
+    stages['compile_map'], compiled_map = time_stage(lambda: CompiledMap.from_graph(map_graph), repeat)
+    request = FormRequest(generate_form_input(compiled_map))
+    controller = Form2RDFController(base_uri='http://example.org/bench/')
+    stages['convert'], result = time_stage(lambda: controller.convert(request, compiled_map), repeat)
+
+    counts = {
+        'shape_triples': len(graph),
+        'properties': sum(1 for _ in iter_properties(prepared_shape)),
+        'form_bytes': len(html.encode('utf-8')),
+        'map_triples': len(map_graph),
+        'form_inputs': len(request.form),
+        'converted_triples': len(result)
+    }
+    return {'params': params, 'stages': stages, 'counts': counts}
+
+
+def iter_properties(shape):
+    # Every property in a prepared shape, including nested properties
+    def walk(prop):
+        yield prop
+        for p in prop.get('property', ()):
+            yield from walk(p)
+
+    for g in shape['groups']:
+        for prop in g['properties']:
+            yield from walk(prop)
+    for prop in shape['properties']:
+        yield from walk(prop)
+
+
+def get_commit():
+    # The commit being benchmarked, if this is a git checkout
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(cases, repeat=5):
+    """
+    :param cases: The names of the cases in CASES to run
+    :param repeat: The number of times each stage is timed
+    :return: The results, as written to JSON
+    """
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'cases': {name: run_case(CASES[name], repeat) for name in cases}
+    }
+
+
+def compare(results, baseline):
+    """
+    :param results: Results from run
+    :param baseline: Results from an earlier run, e.g. of another commit
+    :return: Lines comparing the median time of each stage, as a ratio of the baseline
+    """
+    lines = list()
+    for name, case in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        for stage in STAGES:
+            new = case['stages'].get(stage)
+            old = baseline['cases'][name]['stages'].get(stage)
+            if new is None or old is None or not old['median']:
+                continue
+            lines.append('{case:10} {stage:12} {old:10.5f}s -> {new:10.5f}s  x{ratio:.2f}'.format(
+                case=name, stage=stage, old=old['median'], new=new['median'], ratio=new['median'] / old['median']))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks form generation and conversion on synthetic shapes.')
+    parser.add_argument('cases', nargs='*', help='The cases to run. Defaults to all of them: ' + ', '.join(CASES))
+    parser.add_argument('--repeat', '-r', type=int, default=5, help='The number of times each stage is timed')
+    parser.add_argument('--out', '-o', default=None, help='Where the results are written as JSON')
+    parser.add_argument('--compare', '-c', default=None, help='Results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    cases = args.cases or list(CASES)
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error('Unknown cases: ' + ', '.join(unknown))
+    results = run(cases, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    for name, case in results['cases'].items():
+        print(name + ' ' + json.dumps(case['counts']))
+        for stage in STAGES:
+            print('    {stage:12} {median:10.5f}s'.format(stage=stage, median=case['stages'][stage]['median']))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\n'.join(compare(results, baseline)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
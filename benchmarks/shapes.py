@@ -0,0 +1,109 @@
+from rdflib import Graph, BNode, Literal, URIRef, RDF, RDFS, XSD
+from rdflib.collection import Collection
+
+SHACL = 'http://www.w3.org/ns/shacl#'
+EX = 'http://example.org/bench#'
+
+
+def sh(name):
+    return URIRef(SHACL + name)
+
+
+def generate_shape(properties=10, depth=0, groups=0, paired=0, options=0, composite_every=5, branching=2):
+    """
+    Generates a synthetic Shapes graph with a single Node Shape, ex:BenchShape
+    :param properties: The number of properties directly on the shape
+    :param depth: How deeply composite properties are nested. If 0, there are no composite properties
+    :param groups: The number of property groups. Properties are shared out between them in turn
+    :param paired: The number of properties given an sh:lessThan constraint on the next property
+    :param options: The length of an sh:in list given to the first property. If 0, there is no list
+    :param composite_every: Every nth property is a composite property, if depth is more than 0
+    :param branching: The number of literal properties at each level of a composite property
+    :return: The graph
+    """
+    g = Graph()
+    g.bind('sh', SHACL)
+    g.bind('ex', EX)
+    shape = URIRef(EX + 'BenchShape')
+    g.add((shape, RDF.type, sh('NodeShape')))
+    g.add((shape, sh('targetClass'), URIRef(EX + 'Thing')))
+
+    group_uris = list()
+    for i in range(groups):
+        group = URIRef(EX + 'Group' + str(i))
+        g.add((group, RDF.type, sh('PropertyGroup')))
+        g.add((group, RDFS.label, Literal('Group ' + str(i))))
+        g.add((group, sh('order'), Literal(i)))
+        group_uris.append(group)
+
+    for i in range(properties):
+        prop = BNode()
+        g.add((shape, sh('property'), prop))
+        g.add((prop, sh('path'), URIRef(EX + 'p' + str(i))))
+        g.add((prop, sh('name'), Literal('Property ' + str(i))))
+        g.add((prop, sh('order'), Literal(i)))
+        if group_uris:
+            g.add((prop, sh('group'), group_uris[i % len(group_uris)]))
+        if i < paired and i + 1 < properties:
+            g.add((prop, sh('lessThan'), URIRef(EX + 'p' + str(i + 1))))
+        if i == 0 and options:
+            head = BNode()
+            Collection(g, head, [Literal('Option ' + str(n)) for n in range(options)])
+            g.add((prop, sh('in'), head))
+            g.add((prop, sh('nodeKind'), sh('Literal')))
+        elif depth and i % composite_every == composite_every - 1:
+            add_composite(g, prop, 'p' + str(i), depth, branching)
+        else:
+            add_literal(g, prop)
+    return g
+
+
+def add_literal(g, prop):
+    g.add((prop, sh('nodeKind'), sh('Literal')))
+    g.add((prop, sh('datatype'), XSD.string))
+    g.add((prop, sh('minCount'), Literal(1)))
+    g.add((prop, sh('maxCount'), Literal(3)))
+
+
+def add_composite(g, prop, name, depth, branching):
+    # A blank node property with branching literal properties, and another composite property until depth runs out
+    g.add((prop, sh('nodeKind'), sh('BlankNodeOrIRI')))
+    for n in range(branching):
+        nested = BNode()
+        g.add((prop, sh('property'), nested))
+        g.add((nested, sh('path'), URIRef(EX + name + '-' + str(n))))
+        g.add((nested, sh('order'), Literal(n)))
+        add_literal(g, nested)
+    if depth > 1:
+        nested = BNode()
+        g.add((prop, sh('property'), nested))
+        g.add((nested, sh('path'), URIRef(EX + name + '-' + str(branching))))
+        g.add((nested, sh('order'), Literal(branching)))
+        add_composite(g, nested, name + '-' + str(branching), depth - 1, branching)
+
+
+def generate_form_input(compiled_map):
+    """
+    Fills in one entry for every property in a compiled map, choosing a new blank node for composite properties
+    :param compiled_map: The CompiledMap of the form
+    :return: The submitted form data, as a dict of input names to values
+    """
+    form = dict()
+
+    def add_entry(entry, name):
+        if entry.children:
+            form['NodeKind ' + name] = 'BlankNode'
+            for child in entry.children:
+                add_entry(child, name + ':' + child.local_id + '-0')
+        elif entry.node_kind == 'IRI':
+            form[name] = '<' + EX + 'value>'
+        elif entry.datatype == XSD.boolean:
+            form[name] = 'on'
+        else:
+            if entry.node_kind != 'Literal':
+                form['NodeKind ' + name] = 'Literal'
+            form[name] = 'Value of ' + entry.property_id
+
+    for e in compiled_map.entries:
+        add_entry(e, e.local_id + '-0')
+    return form
@@ -1,2 +1,6 @@
-from shaclform.generate_form import generate_form
-from shaclform.form2rdf import Form2RDFController
\ No newline at end of file
+from shaclform.generate_form import generate_form, generate_forms, build_form, FormArtifacts
+from shaclform.form2rdf import FormConverter, Form2RDFController, CompiledMap, load_map, write_compiled_map
+from shaclform.rdfhandling.registry import ShapeRegistry
+from shaclform.instrumentation import Instrumentation
+from shaclform.async_convert import AsyncFormConverter
+from shaclform.store import StoreSink, load_submissions
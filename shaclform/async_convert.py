@@ -0,0 +1,280 @@
+from shaclform.form2rdf import FormConverter, CompiledMap, TripleList, nt_line
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from rdflib import Graph, ConjunctiveGraph
+from rdflib.term import URIRef
+import asyncio
+import os
+
+# The number of submissions which can wait to be converted before submitting another waits for room
+QUEUE_SIZE = 100
+
+# Each worker process converts with this converter, built once when the process starts
+_process_converter = None
+
+
+def convert_submission(converter, form_input, root_node=None):
+    """
+    Converts one submission into a list of triples, which can be sent back from a worker process
+    :param converter: The FormConverter for the form
+    :param form_input: The submitted form data
+    :param root_node: The URI of the node the submission describes. Minted if not provided
+    :return: A tuple of the root node and the list of triples
+    """
+    root_node = URIRef(root_node) if root_node else converter.mint_root_node(form_input)
+    triples = TripleList()
+    converter.add_submission(form_input, root_node, triples)
+    return root_node, triples
+
+
+def _init_process(map_json, base_uri, node_factory, validate):
+    global _process_converter
+    _process_converter = FormConverter(CompiledMap.from_json(map_json), base_uri, node_factory, validate=validate)
+
+
+def _convert_in_process(form_input, root_node):
+    return convert_submission(_process_converter, form_input, root_node)
+
+
+class AsyncFormConverter:
+    """
+    Converts submissions from asyncio code without blocking the event loop. Conversions run in a pool of threads or
+    processes. Submissions wait in a bounded queue for a free worker, so when the pool falls behind, callers wait for
+    room in the queue instead of the backlog growing without limit.
+    Each converted submission is also written to the sink, if one is given.
+
+        async with AsyncFormConverter('map.ttl', base_uri='http://example.org/ex#') as converter:
+            graph = await converter.convert(request.form)
+    """
+    def __init__(self, rdf_map, base_uri=None, node_factory=None, executor='thread', workers=None,
+                 queue_size=QUEUE_SIZE, timeout=None, sink=None, instrumentation=None, validate=False):
+        """
+        :param rdf_map: The path of the RDF map generated alongside the form, or an already compiled map
+        :param base_uri: Root nodes are minted as this URI followed by a UUID
+        :param node_factory: A callable taking the submitted form data and returning the URI of its root node. Must be
+                             defined at the top level of a module if executor is 'process', so it can be pickled
+        :param executor: 'thread' to convert in a pool of threads sharing one FormConverter, or 'process' to convert in
+                         a pool of processes, which avoids the GIL at the cost of sending each submission and its
+                         triples between processes
+        :param workers: The number of threads or processes. Defaults to the number of CPUs
+        :param queue_size: The number of submissions which can wait for a worker
+        :param timeout: The default number of seconds a conversion can take, including waiting in the queue. None for
+                        no limit. A submission which times out once a worker has started on it is still converted and
+                        written to the sink, as the worker can't be interrupted
+        :param sink: Where converted submissions are written, e.g. a FileSink, QueueSink, GraphSink or StoreSink
+        :param instrumentation: An Instrumentation, passed to the FormConverter. Conversions in worker processes aren't
+                                recorded
+        :param validate: If True, submissions are validated as they are converted, as in FormConverter. Converting a
+                         submission which doesn't conform raises ValidationError, and nothing is written to the sink
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError('executor must be \'thread\' or \'process\', not ' + str(executor))
+        self.converter = FormConverter(rdf_map, base_uri, node_factory, instrumentation, validate)
+        self.executor_type = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.sink = sink
+        self._executor = None
+        self._queue = None
+        self._tasks = list()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        # Starts the pool and the tasks which hand submissions from the queue to it
+        if self._executor is not None:
+            return
+        if self.executor_type == 'process':
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_process,
+                initargs=(self.converter.rdf_map.to_json(), self.converter.base_uri, self.converter.node_factory,
+                          self.converter.validator is not None))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        """
+        Waits for every queued submission to be converted, then stops the pool and closes the sink
+        :return:
+        """
+        if self._executor is None:
+            return
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks)
+        self._tasks = list()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        if self.sink is not None:
+            # Sinks which aren't only used from asyncio, such as StoreSink, close synchronously
+            closed = self.sink.close()
+            if asyncio.iscoroutine(closed):
+                await closed
+
+    async def submit(self, form_input, root_node=None):
+        """
+        Queues a submission to be converted, waiting for room in the queue if it is full
+        :param form_input: The submitted form data, mapping input names to values, like request.form
+        :param root_node: The URI of the node the submission describes. Minted if not provided
+        :return: A future which is resolved with the root node and list of triples once the submission is converted
+                 and written to the sink
+        """
+        if self._executor is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((form_input, root_node, future))
+        return future
+
+    async def convert(self, form_input, root_node=None, timeout=None):
+        """
+        :param form_input: The submitted form data, mapping input names to values, like request.form
+        :param root_node: The URI of the node the submission describes. Minted if not provided
+        :param timeout: The number of seconds the conversion can take, including waiting for room in the queue.
+                        Defaults to the converter's timeout. Raises asyncio.TimeoutError if it takes longer
+        :return: An RDF graph containing the data submitted to the form
+        """
+        root_node, triples = await self.convert_triples(form_input, root_node, timeout)
+        graph = self.converter.rdf_map.new_graph()
+        graph.addN((s, p, o, graph) for (s, p, o) in triples)
+        return graph
+
+    async def convert_triples(self, form_input, root_node=None, timeout=None):
+        """
+        As convert, but returns a tuple of the root node and the list of triples instead of building a graph
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(self._submit_and_wait(form_input, root_node), timeout)
+
+    async def _submit_and_wait(self, form_input, root_node):
+        return await (await self.submit(form_input, root_node))
+
+    async def convert_many(self, form_inputs, timeout=None):
+        """
+        Converts many submissions, keeping the pool busy. Submissions are queued as room is made for them, and only the
+        root node of each is kept once it is converted, so an iterable of any length can be converted
+        :param form_inputs: An iterable or async iterable of submitted form data
+        :param timeout: The number of seconds each conversion can take once it has been queued. Defaults to the
+                        converter's timeout
+        :return: The root node of each submission, in order
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        async def root_node_of(future):
+            # The triples are dropped as soon as the conversion finishes
+            root_node, triples = await asyncio.wait_for(future, timeout)
+            return root_node
+
+        tasks = list()
+        try:
+            if hasattr(form_inputs, '__aiter__'):
+                async for form_input in form_inputs:
+                    tasks.append(asyncio.ensure_future(root_node_of(await self.submit(form_input))))
+            else:
+                for form_input in form_inputs:
+                    tasks.append(asyncio.ensure_future(root_node_of(await self.submit(form_input))))
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _work(self):
+        # Hands queued submissions to the pool one at a time, then writes each result to the sink
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            form_input, root_node, future = item
+            if future.done():
+                # Timed out or cancelled while queued
+                continue
+            try:
+                if self.executor_type == 'process':
+                    result = await loop.run_in_executor(self._executor, _convert_in_process, form_input, root_node)
+                else:
+                    result = await loop.run_in_executor(self._executor, convert_submission, self.converter,
+                                                        form_input, root_node)
+                if self.sink is not None:
+                    await self.sink.write(*result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+
+class FileSink:
+    """
+    Writes converted submissions to a file as N-Triples, or as N-Quads in a named graph if a context is given.
+    Writing is done in a thread so the event loop isn't blocked by the disk. Streams can't be written to by two threads
+    at once, so submissions are written one at a time.
+    """
+    def __init__(self, destination, context=None):
+        """
+        :param destination: A path, or a file-like object opened for writing text
+        :param context: If provided, the output is N-Quads with every triple in this named graph
+        """
+        self.stream = open(destination, 'w') if isinstance(destination, str) else destination
+        self.close_stream = isinstance(destination, str)
+        self.context = URIRef(context) if context else None
+        self.count = 0
+        self._lock = asyncio.Lock()
+
+    async def write(self, root_node, triples):
+        text = ''.join(nt_line(t, self.context) for t in triples)
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(None, self.stream.write, text)
+        self.count += len(triples)
+
+    async def close(self):
+        if self.close_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class QueueSink:
+    """
+    Puts each converted submission on an asyncio.Queue as a tuple of its root node and triples, to be consumed by
+    another task. If the queue is bounded, conversion waits for the consumer to keep up.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def write(self, root_node, triples):
+        await self.queue.put((root_node, triples))
+
+    async def close(self):
+        pass
+
+
+class GraphSink:
+    """
+    Adds converted submissions to a graph held in memory, standing in for a triple store. Each submission can be put
+    in a named graph of its own, named by its root node.
+    """
+    def __init__(self, graph=None, named_graphs=False):
+        """
+        :param graph: The graph submissions are added to. Must be a ConjunctiveGraph if named_graphs is True. A new
+                      graph is created if not provided
+        :param named_graphs: If True, each submission is added to a named graph with the URI of its root node
+        """
+        if graph is None:
+            graph = ConjunctiveGraph() if named_graphs else Graph()
+        self.graph = graph
+        self.named_graphs = named_graphs
+
+    async def write(self, root_node, triples):
+        context = self.graph.get_context(root_node) if self.named_graphs else self.graph
+        context.addN((s, p, o, context) for (s, p, o) in triples)
+
+    async def close(self):
+        pass
@@ -1,91 +1,563 @@
 from rdflib import Graph, RDF, XSD
 from rdflib.util import guess_format
 from rdflib.term import Literal, URIRef, BNode
+from shaclform.instrumentation import get_instrumentation
+from shaclform.validation import Validator, ValidationError
+from functools import lru_cache
 import uuid
+import json
+import os
 import re
 
+# Number of compiled RDF maps kept in memory by load_map
+MAP_CACHE_SIZE = 32
 
-class Form2RDFController:
-    def __init__(self, base_uri=None, root_node=None):
-        self.base_uri = base_uri
-        self.root_node = URIRef(root_node) if root_node else None
-        if not base_uri and not root_node:
-            raise ValueError('base_uri or root_node must be provided.')
-        self.form_input = None
-        self.rdf_map = None
-        self.rdf_result = None
-        self.root_node_class = None
+# Identifies compiled maps written as JSON. The version changes whenever the layout of the JSON changes
+MAP_FORMAT = 'shaclform-map'
+MAP_FORMAT_VERSION = 3
 
-    def convert(self, form_input, map_filename):
-        self.form_input = form_input.form
-        # Get map and result RDF graphs ready
-        self.rdf_map = Graph()
-        self.rdf_map.parse(map_filename, format=guess_format(map_filename))
-        self.rdf_result = Graph()
-        self.rdf_result.namespace_manager = self.rdf_map.namespace_manager
+
+class MapEntry:
+    """
+    A single property from an RDF map, with the placeholder arguments already parsed out.
+    Blank node properties hold the entries for their nested properties in children.
+    """
+    __slots__ = ('property_id', 'local_id', 'predicate', 'node_kind', 'datatype', 'children')
+
+    def __init__(self, property_id, predicate, node_kind, datatype=None, children=()):
+        self.property_id = property_id
+        # Nested properties are identified in the form by the last part of their ID
+        self.local_id = property_id.split(':')[-1]
+        self.predicate = predicate
+        self.node_kind = node_kind
+        self.datatype = datatype
+        self.children = tuple(children)
+
+
+class CompiledMap:
+    """
+    A flat conversion plan built from an RDF map.
+    Holds everything FormConverter needs, so the map only has to be parsed once no matter how many submissions
+    are converted with it. Maps compiled when the form is generated also hold the validation table of the shape,
+    see shaclform.validation.
+    """
+    def __init__(self, root_node_class, entries, namespaces=(), validation=None):
+        self.root_node_class = root_node_class
+        self.entries = tuple(entries)
+        self.namespaces = tuple(namespaces)
+        self.validation = validation
+        self._validator = None
+
+    def new_graph(self):
+        # An empty graph with the map's namespaces bound. Each graph gets its own namespace manager, as serializing
+        # a graph can bind new prefixes to it
+        g = Graph()
+        for prefix, namespace in self.namespaces:
+            g.bind(prefix, namespace)
+        return g
+
+    @property
+    def validator(self):
+        # The validation table compiled for checking submissions, or None if the map doesn't have one
+        if self._validator is None and self.validation is not None:
+            self._validator = Validator(self.validation)
+        return self._validator
+
+    @classmethod
+    def from_graph(cls, rdf_map, source='RDF map', validation=None):
+        """
+        :param rdf_map: A Graph containing an RDF map created by RDFHandler.create_rdf_map
+        :param source: Describes where the map came from, used in error messages
+        :param validation: The validation table of the shape, as built by build_validation_table. The RDF map doesn't
+                           hold the constraints, so without it submissions can't be validated
+        :return: The compiled map
+        """
+        root_node = Literal('placeholder node_uri')
         # Find node class
-        for possible_root_node_class in self.rdf_map.objects(Literal('placeholder node_uri'), URIRef(RDF.type)):
+        root_node_class = None
+        for possible_root_node_class in rdf_map.objects(root_node, RDF.type):
             if 'placeholder' not in possible_root_node_class:
-                self.root_node_class = possible_root_node_class
-        if self.root_node_class is None:
-            raise Exception('No root node class specified in ' + map_filename)
+                root_node_class = possible_root_node_class
+        if root_node_class is None:
+            raise Exception('No root node class specified in ' + str(source))
+        entries = [cls.compile_entry(rdf_map, predicate, obj)
+                   for (predicate, obj) in rdf_map.predicate_objects(root_node) if 'placeholder' in obj]
+        # Entries are kept in form order so that the map compiles the same way however the graph is stored
+        entries.sort(key=lambda e: int(e.local_id))
+        return cls(root_node_class, entries, rdf_map.namespaces(), validation)
+
+    @classmethod
+    def from_json(cls, text, source='compiled map'):
+        """
+        :param text: A compiled map written by to_json
+        :param source: Describes where the map came from, used in error messages
+        :return: The compiled map
+        """
+        data = json.loads(text)
+        if not isinstance(data, dict) or data.get('format') != MAP_FORMAT:
+            raise ValueError('Not a compiled map: ' + str(source))
+        if data.get('version') != MAP_FORMAT_VERSION:
+            raise ValueError('Compiled map ' + str(source) + ' has version ' + str(data.get('version')) +
+                             ', expected ' + str(MAP_FORMAT_VERSION))
+
+        def read_entry(entry):
+            property_id, predicate, node_kind, datatype, children = entry
+            return MapEntry(property_id, URIRef(predicate), node_kind, URIRef(datatype) if datatype else None,
+                            [read_entry(c) for c in children])
+
+        return cls(URIRef(data['root_node_class']), [read_entry(e) for e in data['entries']],
+                   [(prefix, URIRef(namespace)) for prefix, namespace in data['namespaces']], data['validation'])
+
+    def to_json(self):
+        """
+        :return: The map as compact JSON, which can be read back with from_json much faster than the Turtle map can be
+                 parsed. Each entry is a list of its property ID, predicate, node kind, datatype and nested entries.
+                 The validation table is included as it is, or as null if there isn't one
+        """
+        def write_entry(entry):
+            return [entry.property_id, str(entry.predicate), entry.node_kind,
+                    str(entry.datatype) if entry.datatype is not None else None,
+                    [write_entry(c) for c in entry.children]]
+
+        data = {
+            'format': MAP_FORMAT,
+            'version': MAP_FORMAT_VERSION,
+            'root_node_class': str(self.root_node_class),
+            'namespaces': [[prefix, str(namespace)] for prefix, namespace in sorted(self.namespaces)],
+            'entries': [write_entry(e) for e in self.entries],
+            'validation': self.validation
+        }
+        return json.dumps(data, separators=(',', ':'))
+
+    @classmethod
+    def compile_entry(cls, rdf_map, predicate, obj):
+        # Recursive
+        m = re.search(r'nodeKind=(\w+)', obj)
+        if m is None:
+            raise ValueError('No nodeKind option provided: ' + obj)
+        node_kind = m.group(1)
+        m = re.search('datatype=([^ ]*)', obj)
+        datatype = URIRef(m.group(1)) if m else None
+        children = sorted((cls.compile_entry(rdf_map, p, o) for (p, o) in rdf_map.predicate_objects(obj)),
+                          key=lambda e: int(e.local_id))
+        return MapEntry(str(obj).split(' ')[-1], predicate, node_kind, datatype, children)
+
+
+def load_map(map_filename):
+    """
+    Compiles the RDF map at the given path. If a compiled map written by write_compiled_map sits next to it and is up
+    to date, that is read instead of parsing the Turtle. Compiled maps are cached by path and modification time, so
+    a map is only read again after it changes.
+    :param map_filename: Path of the RDF map generated alongside the form, or of its compiled map
+    :return: The compiled map
+    """
+    path = os.path.abspath(map_filename)
+    compiled_path = compiled_map_path(path)
+    if compiled_path != path and os.path.isfile(compiled_path) and \
+            (not os.path.exists(path) or os.path.getmtime(compiled_path) >= os.path.getmtime(path)):
+        try:
+            return _load_map(compiled_path, os.path.getmtime(compiled_path))
+        except ValueError:
+            # Written by a different version, fall back to the Turtle map
+            if not os.path.exists(path):
+                raise
+    return _load_map(path, os.path.getmtime(path))
+
+
+@lru_cache(maxsize=MAP_CACHE_SIZE)
+def _load_map(path, mtime):
+    # mtime is part of the cache key so that an edited map is not served from the cache
+    if path.endswith('.json'):
+        with open(path) as f:
+            return CompiledMap.from_json(f.read(), path)
+    rdf_map = Graph()
+    rdf_map.parse(path, format=guess_format(path))
+    return CompiledMap.from_graph(rdf_map, path)
+
+
+def compiled_map_path(map_filename):
+    # The compiled map for an RDF map is kept next to it, e.g. map.ttl -> map.json
+    return os.path.splitext(map_filename)[0] + '.json'
+
+
+def write_compiled_map(compiled_map, map_filename):
+    """
+    Writes a compiled map next to the RDF map it was compiled from, where load_map will find it
+    :param compiled_map: The compiled map
+    :param map_filename: Path of the RDF map
+    :return: The path the compiled map was written to
+    """
+    path = compiled_map_path(map_filename)
+    with open(path, 'w') as f:
+        f.write(compiled_map.to_json())
+    return path
+
+
+class FormEntry:
+    """
+    The inputs submitted for one copy of a property. Entries for nested properties are held in children, indexed by
+    the nested property's ID and then by copy number.
+    """
+    __slots__ = ('value', 'node_kind', 'unchecked', 'children')
+
+    def __init__(self):
+        self.value = None
+        self.node_kind = None
+        self.unchecked = None
+        self.children = dict()
+
+
+class FormIndex:
+    """
+    Indexes submitted form data by property ID and copy number, so that conversion only visits entries which were
+    actually submitted.
+
+    Input names have the form '<property ID>-<copy number>', with nested properties appended after a ':' (for example
+    '3-0:1-2'). Node kind selections and unchecked checkboxes use the same names with the prefixes 'NodeKind ' and
+    'Unchecked '. Custom properties are named '<field> CustomProperty-<copy number>'.
+    """
+    entry_name = re.compile(r'(?:(NodeKind|Unchecked) )?(\d+-\d+(?::\d+-\d+)*)$')
+    custom_property_name = re.compile(r'(Predicate|Object Type|Object) CustomProperty-(\d+)$')
+
+    def __init__(self, form_input):
+        # Property ID -> copy number -> FormEntry
+        self.entries = dict()
+        # Copy number -> field -> value
+        self.custom_properties = dict()
+        for name, value in form_input.items():
+            m = self.entry_name.match(name)
+            if m:
+                self.add_entry(m.group(2), m.group(1), value)
+                continue
+            m = self.custom_property_name.match(name)
+            if m:
+                self.custom_properties.setdefault(int(m.group(2)), dict())[m.group(1)] = value
+
+    def add_entry(self, entry_id, prefix, value):
+        entries = self.entries
+        entry = None
+        for part in entry_id.split(':'):
+            property_id, copy_id = part.split('-')
+            if entry is not None:
+                entries = entry.children
+            copies = entries.setdefault(property_id, dict())
+            entry = copies.get(int(copy_id))
+            if entry is None:
+                entry = copies[int(copy_id)] = FormEntry()
+        if prefix == 'NodeKind':
+            entry.node_kind = value
+        elif prefix == 'Unchecked':
+            entry.unchecked = value
+        else:
+            entry.value = value
+
+
+class TripleList(list):
+    """
+    A list of triples which can be used in place of a Graph as the destination of a conversion.
+    """
+    add = list.append
+
+
+# Characters which are escaped in N-Triples string literals
+NT_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+
+def nt_term(term):
+    # A term as it is written in N-Triples
+    if isinstance(term, Literal):
+        text = '"' + str(term).translate(NT_ESCAPES) + '"'
+        if term.language:
+            return text + '@' + term.language
+        if term.datatype:
+            return text + '^^<' + str(term.datatype) + '>'
+        return text
+    if isinstance(term, BNode):
+        return '_:' + str(term)
+    return '<' + str(term) + '>'
+
+
+def nt_line(triple, context=None):
+    """
+    :param triple: A triple of rdflib terms
+    :param context: If provided, the line is written as N-Quads with the triple in this named graph
+    :return: The triple as a line of N-Triples, or N-Quads if a context is given
+    """
+    s, p, o = triple
+    if context is None:
+        return nt_term(s) + ' ' + nt_term(p) + ' ' + nt_term(o) + ' .\n'
+    return nt_term(s) + ' ' + nt_term(p) + ' ' + nt_term(o) + ' ' + nt_term(context) + ' .\n'
+
+
+class NTriplesSink:
+    """
+    Writes triples to a file-like object as N-Triples lines as soon as they are added. If a context is given, lines
+    are written as N-Quads in that named graph instead.
+    Can be used in place of a Graph as the destination of a conversion.
+    """
+    def __init__(self, stream, context=None):
+        self.stream = stream
+        self.context = URIRef(context) if context else None
+        self.count = 0
+
+    def add(self, triple):
+        self.stream.write(nt_line(triple, self.context))
+        self.count += 1
+
+
+class CountingSink:
+    """
+    Passes triples on to another destination, counting them as they go.
+    """
+    def __init__(self, destination):
+        self.destination = destination
+        self.count = 0
+
+    def add(self, triple):
+        self.destination.add(triple)
+        self.count += 1
+
+
+class ConversionContext:
+    """
+    Everything about the submission being converted: its indexed form data, where its triples are added, the number
+    of map entries looked up for it, and the values converted for each property if it is to be validated. A context is
+    created for each submission, so converting never changes the FormConverter doing it.
+    """
+    __slots__ = ('form_index', 'destination', 'entries_probed', 'values')
+
+    def __init__(self, form_input, destination, collect_values=False):
+        """
+        :param form_input: The submitted form data
+        :param destination: Where the triples are added. Anything with an add method taking a triple, such as a Graph
+        :param collect_values: If True, the values added for each property are collected in values, by subject and
+                               property ID
+        """
+        self.form_index = FormIndex(form_input)
+        self.destination = destination
+        self.entries_probed = 0
+        self.values = dict() if collect_values else None
+
+    def add(self, subject, map_entry, obj):
+        self.destination.add((subject, map_entry.predicate, obj))
+        if self.values is not None:
+            self.values.setdefault((subject, map_entry.property_id), []).append(obj)
+
+
+class FormConverter:
+    """
+    Converts submissions made with one form into RDF, using the form's compiled map.
+    A converter can't be changed once it is built. Each submission is converted with its own ConversionContext, so one
+    converter can be shared by every thread of a web server, converting submissions at the same time without locking.
+    """
+    __slots__ = ('rdf_map', 'base_uri', 'node_factory', 'instrumentation', 'validator')
+
+    def __init__(self, rdf_map, base_uri=None, node_factory=None, instrumentation=None, validate=False):
+        """
+        :param rdf_map: The path of the RDF map generated alongside the form, or an already compiled map
+        :param base_uri: Root nodes are minted as this URI followed by a UUID
+        :param node_factory: A callable taking the submitted form data and returning the URI of its root node. Replaces
+                             the default base_uri + UUID minting
+        :param instrumentation: An Instrumentation which records the time spent indexing and converting submissions,
+                                and counts the entries probed and triples emitted. It is shared by every thread using
+                                the converter
+        :param validate: If True, every submission is checked against the constraints of the shape as it is converted,
+                         and ValidationError is raised for one which doesn't conform. Nothing is added to the
+                         destination for it. The map must have been compiled when the form was generated, so it holds
+                         the shape's validation table
+        """
+        instrumentation = get_instrumentation(instrumentation)
+        if not isinstance(rdf_map, CompiledMap):
+            with instrumentation.stage('load_map'):
+                rdf_map = load_map(rdf_map)
+        validator = None
+        if validate:
+            validator = rdf_map.validator
+            if validator is None:
+                raise ValueError('The map has no validation table. Generate the form again to write one.')
+        object.__setattr__(self, 'validator', validator)
+        object.__setattr__(self, 'rdf_map', rdf_map)
+        object.__setattr__(self, 'base_uri', base_uri)
+        object.__setattr__(self, 'node_factory', node_factory)
+        object.__setattr__(self, 'instrumentation', instrumentation)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FormConverter can\'t be changed once it is built')
+
+    def __delattr__(self, name):
+        raise AttributeError('FormConverter can\'t be changed once it is built')
+
+    def convert(self, form_input, root_node=None):
+        """
+        :param form_input: The submitted form data, mapping input names to values, like request.form
+        :param root_node: The URI of the node the submission describes. Minted if not provided
+        :return: An RDF graph containing the data submitted to the form
+        """
+        # Get result RDF graph ready
+        rdf_result = self.rdf_map.new_graph()
         # Use provided URI or generate unique URI of the new node
-        if not self.root_node:
-            self.root_node = URIRef(self.base_uri + str(uuid.uuid4()))
-        self.rdf_result.add((self.root_node, RDF.type, self.root_node_class))
-        # Go through each property and search for entries submitted in the form
-        for (subject, property_predicate, property_obj) in self.rdf_map:
-            if str(subject) == 'placeholder node_uri' and 'placeholder' in property_obj:
-                self.add_entries_for_property(self.root_node, property_predicate, property_obj)
-        # Also get any custom properties submitted in the form
-        self.add_custom_property_entries(self.root_node)
-        return self.rdf_result
-
-    def add_entries_for_property(self, subject, predicate, obj, root_id=None):
+        root_node = URIRef(root_node) if root_node else self.mint_root_node(form_input)
+        self.add_submission(form_input, root_node, rdf_result)
+        return rdf_result
+
+    def convert_many(self, form_inputs, graph=None):
+        """
+        Converts many submissions into one graph
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :param graph: The graph the results are added to. A new graph is created if not provided
+        :return: The graph containing the data from every submission
+        """
+        if graph is None:
+            graph = self.rdf_map.new_graph()
+        for root_node, triples in self.iter_convert(form_inputs):
+            graph.addN((s, p, o, graph) for (s, p, o) in triples)
+        return graph
+
+    def iter_convert(self, form_inputs):
+        """
+        Converts many submissions, one at a time
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :return: Yields a tuple of the root node and a list of triples for each submission
+        """
+        for form_input in form_inputs:
+            root_node = self.mint_root_node(form_input)
+            triples = TripleList()
+            self.add_submission(form_input, root_node, triples)
+            yield root_node, triples
+
+    def iter_triples(self, form_inputs):
+        """
+        Converts many submissions without building a graph. Only the triples of the submission being converted are held
+        in memory.
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :return: Yields every triple produced from the submissions
+        """
+        for root_node, triples in self.iter_convert(form_inputs):
+            yield from triples
+
+    def write_ntriples(self, form_inputs, stream, context=None):
+        """
+        Converts many submissions, writing the results straight to a file-like object as N-Triples. Lines are written as
+        they are produced, so memory use doesn't grow with the number of submissions.
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :param stream: A file-like object opened for writing text
+        :param context: If provided, the output is N-Quads with every triple in this named graph
+        :return: The number of triples written
         """
+        sink = NTriplesSink(stream, context)
+        for form_input in form_inputs:
+            self.add_submission(form_input, self.mint_root_node(form_input), sink)
+        return sink.count
+
+    def mint_root_node(self, form_input):
+        if self.node_factory:
+            return URIRef(self.node_factory(form_input))
+        if not self.base_uri:
+            raise ValueError('base_uri or node_factory must be provided to mint root nodes.')
+        return URIRef(self.base_uri + str(uuid.uuid4()))
+
+    def validate(self, form_input):
+        """
+        Checks a submission against the constraints of the shape without adding it anywhere
+        :param form_input: The submitted form data, mapping input names to values, like request.form
+        :return: A list of every Violation found. Empty if the submission conforms
+        """
+        validator = self.validator or self.rdf_map.validator
+        if validator is None:
+            raise ValueError('The map has no validation table. Generate the form again to write one.')
+        root_node = BNode()
+        context = self.convert_into(form_input, root_node, TripleList(), collect_values=True)
+        return self.check(validator, root_node, context)
+
+    def validate_many(self, form_inputs):
+        """
+        Checks many submissions against the constraints of the shape in one pass, without adding them anywhere
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :return: Yields a list of the violations found in each submission, in order
+        """
+        for form_input in form_inputs:
+            yield self.validate(form_input)
+
+    def add_submission(self, form_input, root_node, destination):
+        """
+        :param form_input: The submitted form data
+        :param root_node: The node the submitted data describes
+        :param destination: Where the triples are added. Anything with an add method taking a triple, such as a Graph
+        :return: The ConversionContext the submission was converted with
+        """
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            destination = CountingSink(destination)
+        if self.validator is None:
+            context = self.convert_into(form_input, root_node, destination)
+        else:
+            # Held back until the submission is known to conform, so nothing is added for one which doesn't
+            triples = TripleList()
+            context = self.convert_into(form_input, root_node, triples, collect_values=True)
+            violations = self.check(self.validator, root_node, context)
+            if violations:
+                raise ValidationError(violations)
+            for triple in triples:
+                destination.add(triple)
+        if instrumentation.enabled:
+            instrumentation.count('submissions')
+            instrumentation.count('triples_emitted', destination.count)
+        return context
+
+    def convert_into(self, form_input, root_node, destination, collect_values=False):
+        # Converts a submission, adding its triples to the destination
+        instrumentation = self.instrumentation
+        with instrumentation.stage('index_form'):
+            context = ConversionContext(form_input, destination, collect_values)
+        with instrumentation.stage('convert'):
+            destination.add((root_node, RDF.type, self.rdf_map.root_node_class))
+            # Go through each property and add the entries submitted in the form
+            context.entries_probed += len(self.rdf_map.entries)
+            for map_entry in self.rdf_map.entries:
+                entries = context.form_index.entries.get(map_entry.local_id)
+                if entries:
+                    self.add_entries_for_property(context, root_node, map_entry, entries)
+            # Also get any custom properties submitted in the form
+            self.add_custom_property_entries(context, root_node)
+        instrumentation.count('entries_probed', context.entries_probed)
+        return context
+
+    def check(self, validator, root_node, context):
+        # The violations of the shape's constraints in a converted submission
+        with self.instrumentation.stage('validate'):
+            violations = validator.validate(root_node, context.values)
+        self.instrumentation.count('violations', len(violations))
+        return violations
+
+    def add_entries_for_property(self, context, subject, map_entry, entries):
+        """
+        :param context: The ConversionContext of the submission
         :param subject: The subject this property will be attached to. It will be the root node unless this is a nested
                         property
-        :param predicate: The predicate of the property
-        :param obj: The object of the property. Can be a literal/IRI or a blank node leading to nested properties
-        :param root_id: Provides a starting point for building nested property IDs used to get an entry in the form
-        :return:
-        """
-        if not root_id:
-            root_id = obj.split(' ')[-1]
-        copy_id = 0
+        :param map_entry: The MapEntry for this property. Holds the predicate, permitted nodeKind and datatype, and the
+                          entries for any nested properties
+        :param entries: The FormEntry for each copy of this property submitted in the form, indexed by copy number
+        :return: True if any entry was added
+        """
         found_at_least_one_entry = False
-        # Cycles through entries by ID until no more entries are found
-        while True:
-            # Every entry for this property shares a root_id, and has a different copy_id
-            entry_id = root_id + '-' + str(copy_id)
-            m = re.search('nodeKind=(\w+)', obj)
-            if m is None:
-                raise ValueError('No nodeKind option provided: ' + obj)
-            permitted_node_kind = m.group().split('=')[1]
-            node_kind_selection = self.get_node_kind_selection(permitted_node_kind, entry_id)
+        # Copy numbers may have gaps if entries were removed from the form, so go through whichever were submitted
+        for copy_id in sorted(entries):
+            entry = entries[copy_id]
+            node_kind_selection = self.get_node_kind_selection(map_entry.node_kind, entry)
             if node_kind_selection == 'BlankNode':
-                if self.add_blank_node_entry(subject, predicate, obj, entry_id):
-                    found_at_least_one_entry = True
-                    copy_id += 1
-                else:
-                    break
+                added = self.add_blank_node_entry(context, subject, map_entry, entry)
             elif node_kind_selection == 'IRI':
-                if self.add_iri_entry(subject, predicate, entry_id):
-                    found_at_least_one_entry = True
-                    copy_id += 1
-                else:
-                    break
+                added = self.add_iri_entry(context, subject, map_entry, entry)
             elif node_kind_selection == 'Literal':
-                if self.add_literal_entry(subject, predicate, obj, entry_id):
-                    found_at_least_one_entry = True
-                    copy_id += 1
-                else:
-                    break
+                added = self.add_literal_entry(context, subject, map_entry, entry)
             else:
-                break
+                added = False
+            if added:
+                found_at_least_one_entry = True
         return found_at_least_one_entry
 
-    def get_node_kind_selection(self, permitted_node_kind, entry_id):
+    @staticmethod
+    def get_node_kind_selection(permitted_node_kind, entry):
         # Selection isn't necessary if the nodeKind is specified as one of these
         if permitted_node_kind in ['Literal', 'IRI', 'BlankNode']:
             return permitted_node_kind
@@ -95,8 +567,7 @@ class Form2RDFController:
         # Get the options that the user can select from
         node_kind_options = permitted_node_kind.split('Or')
         # Get user selection for node kind for this entry
-        node_kind_id = 'NodeKind ' + entry_id
-        node_kind_selection = self.form_input.get(node_kind_id)
+        node_kind_selection = entry.node_kind
         if not node_kind_selection:
             return None
         # Check the user selected one of the options
@@ -104,67 +575,59 @@ class Form2RDFController:
             raise ValueError('Not valid nodeKind selection: ' + node_kind_selection)
         return node_kind_selection
 
-    def add_literal_entry(self, subject, predicate, obj, entry_id):
-        entry = self.form_input.get(entry_id)
-        m = re.search('datatype=[^ ]*', obj)
-        if m is None:
-            datatype = None
-        else:
-            datatype = m.group().split('=')[1]
+    @staticmethod
+    def add_literal_entry(context, subject, map_entry, entry):
+        datatype = map_entry.datatype
         if datatype == XSD.boolean:
             # Unchecked checkboxes in a form aren't submitted with the form
             # Form has been altered to submit hidden field with prefix 'Unchecked ' if a checkbox isn't checked
             # Normal entry -> True
-            if entry:
-                self.rdf_result.add((subject, predicate, Literal(True, datatype=XSD.boolean)))
+            if entry.value:
+                context.add(subject, map_entry, Literal(True, datatype=XSD.boolean))
                 return True
             # Entry with prefix 'Unchecked ' -> False
-            elif self.form_input.get('Unchecked ' + entry_id):
-                self.rdf_result.add((subject, predicate, Literal(False, datatype=XSD.boolean)))
+            elif entry.unchecked:
+                context.add(subject, map_entry, Literal(False, datatype=XSD.boolean))
                 return True
             # Neither -> No value
             else:
                 return False
-        elif entry:
-            self.rdf_result.add((subject, predicate, Literal(entry, datatype=datatype)))
+        elif entry.value:
+            context.add(subject, map_entry, Literal(entry.value, datatype=datatype))
             return True
         return False
 
-    def add_iri_entry(self, subject, predicate, entry_id):
-        entry = self.form_input.get(entry_id)
-        if entry:
-            self.rdf_result.add((subject, predicate, URIRef(self.validate_iri(entry))))
+    def add_iri_entry(self, context, subject, map_entry, entry):
+        if entry.value:
+            context.add(subject, map_entry, URIRef(self.validate_iri(entry.value)))
             return True
         else:
             return False
 
-    def add_blank_node_entry(self, subject, predicate, obj, entry_id):
+    def add_blank_node_entry(self, context, subject, map_entry, entry):
         node = BNode()
-        included_properties = list(self.rdf_map.predicate_objects(obj))
         found_entry = False
-        for p in included_properties:
-            nested_property_id = entry_id + ':' + p[1].split(':')[-1]
-            found_entry_for_property = self.add_entries_for_property(node, p[0], p[1], nested_property_id)
-            if found_entry_for_property:
+        context.entries_probed += len(map_entry.children)
+        for nested_entry in map_entry.children:
+            nested_entries = entry.children.get(nested_entry.local_id)
+            if nested_entries and self.add_entries_for_property(context, node, nested_entry, nested_entries):
                 found_entry = True
         if found_entry:
-            self.rdf_result.add((subject, predicate, node))
+            context.add(subject, map_entry, node)
             return True
         else:
             return False
 
-    def add_custom_property_entries(self, root_node):
-        copy_id = 0
-        # Cycles through entries by ID until no more entries are found
-        while True:
-            predicate_id = 'Predicate CustomProperty-' + str(copy_id)
-            predicate = self.form_input.get(predicate_id)
-            type_selection_id = 'Object Type CustomProperty-' + str(copy_id)
-            type_selection = self.form_input.get(type_selection_id)
-            obj_id = 'Object CustomProperty-' + str(copy_id)
-            obj = self.form_input.get(obj_id)
+    def add_custom_property_entries(self, context, root_node):
+        custom_properties = context.form_index.custom_properties
+        # Copy numbers may have gaps if entries were removed from the form, so go through whichever were submitted
+        for copy_id in sorted(custom_properties):
+            fields = custom_properties[copy_id]
+            predicate = fields.get('Predicate')
+            type_selection = fields.get('Object Type')
+            obj = fields.get('Object')
             if predicate is None or type_selection is None or obj is None:
-                break
+                continue
             predicate = URIRef(self.validate_iri(predicate))
             if type_selection == 'IRI':
                 obj = URIRef(self.validate_iri(obj))
@@ -173,8 +636,7 @@ class Form2RDFController:
                     obj = Literal(obj, datatype=XSD.boolean)
             else:
                 obj = Literal(obj, datatype=XSD.string)
-            self.rdf_result.add((root_node, predicate, obj))
-            copy_id += 1
+            context.destination.add((root_node, predicate, obj))
 
     @staticmethod
     def validate_iri(iri):
@@ -188,3 +650,96 @@ class Form2RDFController:
             if char in iri:  # Invalid URI
                 raise ValueError('Invalid URI: ' + iri)
         return iri
+
+
+class Form2RDFController:
+    """
+    Converts submissions with whichever map is given to each call. Each call is handed to a FormConverter for its map,
+    so the controller holds nothing about the submissions it converts and can be shared between threads too.
+    Where every submission uses the same map, build a FormConverter for it once instead.
+    """
+    def __init__(self, base_uri=None, root_node=None, node_factory=None, instrumentation=None):
+        """
+        :param base_uri: Root nodes are minted as this URI followed by a UUID
+        :param root_node: A fixed URI to use as the root node
+        :param node_factory: A callable taking the submitted form data and returning the URI of its root node. Replaces
+                             the default base_uri + UUID minting
+        :param instrumentation: An Instrumentation which records the time spent loading maps, indexing and converting
+                                submissions, and counts the entries probed and triples emitted
+        """
+        self.instrumentation = get_instrumentation(instrumentation)
+        self.base_uri = base_uri
+        self.root_node = URIRef(root_node) if root_node else None
+        self.node_factory = node_factory
+        if not base_uri and not root_node and not node_factory:
+            raise ValueError('base_uri, root_node or node_factory must be provided.')
+
+    def convert(self, form_input, map_filename):
+        """
+        :param form_input: The request received from the form
+        :param map_filename: The path of the RDF map generated alongside the form, or an already compiled map
+        :return: An RDF graph containing the data submitted to the form. The root node is the controller's root_node if
+                 it has one, otherwise a new one is minted for each submission
+        """
+        return self.get_converter(map_filename).convert(form_input.form, self.root_node)
+
+    def convert_many(self, form_inputs, map_filename, graph=None):
+        """
+        Converts many submissions made with the same form into one graph. The map is only loaded once.
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :param map_filename: The path of the RDF map generated alongside the form, or an already compiled map
+        :param graph: The graph the results are added to. A new graph is created if not provided
+        :return: The graph containing the data from every submission
+        """
+        self.check_can_mint()
+        return self.get_converter(map_filename).convert_many(form_inputs, graph)
+
+    def iter_convert(self, form_inputs, map_filename):
+        """
+        Converts many submissions made with the same form, one at a time. The map is only loaded once.
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :param map_filename: The path of the RDF map generated alongside the form, or an already compiled map
+        :return: Yields a tuple of the root node and a list of triples for each submission
+        """
+        self.check_can_mint()
+        yield from self.get_converter(map_filename).iter_convert(form_inputs)
+
+    def iter_triples(self, form_inputs, map_filename):
+        """
+        Converts many submissions made with the same form without building a graph. Only the triples of the submission
+        being converted are held in memory.
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :param map_filename: The path of the RDF map generated alongside the form, or an already compiled map
+        :return: Yields every triple produced from the submissions
+        """
+        self.check_can_mint()
+        yield from self.get_converter(map_filename).iter_triples(form_inputs)
+
+    def write_ntriples(self, form_inputs, map_filename, stream, context=None):
+        """
+        Converts many submissions made with the same form, writing the results straight to a file-like object as
+        N-Triples. Lines are written as they are produced, so memory use doesn't grow with the number of submissions.
+        :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+        :param map_filename: The path of the RDF map generated alongside the form, or an already compiled map
+        :param stream: A file-like object opened for writing text
+        :param context: If provided, the output is N-Quads with every triple in this named graph
+        :return: The number of triples written
+        """
+        self.check_can_mint()
+        return self.get_converter(map_filename).write_ntriples(form_inputs, stream, context)
+
+    def check_can_mint(self):
+        # A fixed root node can't be used for more than one submission
+        if not self.base_uri and not self.node_factory:
+            raise ValueError('base_uri or node_factory must be provided to convert more than one submission.')
+
+    def get_converter(self, map_filename):
+        """
+        :param map_filename: The path of the RDF map generated alongside the form, or an already compiled map
+        :return: A FormConverter for the map, minting root nodes as this controller does
+        """
+        return FormConverter(map_filename, self.base_uri, self.node_factory, self.instrumentation)
+
+    # Kept so that existing code calling it through the controller still works. get_node_kind_selection has moved to
+    # FormConverter, as it now reads the selection from an entry of the submission being converted
+    validate_iri = staticmethod(FormConverter.validate_iri)
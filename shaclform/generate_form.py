@@ -1,31 +1,436 @@
 from shaclform.rdfhandling import RDFHandler
+from shaclform.rdfhandling.registry import ShapeRegistry
+from rdflib.term import URIRef
 import sys
-from shaclform.rendering import render_template
+from shaclform.rendering import render_template, stream_template, get_template_fingerprint
+from shaclform.form2rdf import CompiledMap, compiled_map_path, write_compiled_map, MAP_FORMAT_VERSION
+from shaclform.options import OptionIndex
+from shaclform.instrumentation import Instrumentation, get_instrumentation, profile
+from shaclform.validation import build_validation_table
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from warnings import warn
+import argparse
+import json
+import time
 import os
 import re
 
+# The outcome of generating the form for one shape in build_forms. error is None if it succeeded. stages holds the
+# timings and counts of each stage, as returned by Instrumentation.to_dict
+FormBuildResult = namedtuple('FormBuildResult', ['shape_uri', 'form_destination', 'map_destination', 'seconds',
+                                                 'error', 'skipped', 'stages'], defaults=[False, None])
+
+# A form generated in memory by build_form. compiled_map can be passed straight to FormConverter. options holds
+# the option index of each large sh:in list, by key, or None if not given
+FormArtifacts = namedtuple('FormArtifacts', ['html', 'map_graph', 'compiled_map', 'options'], defaults=[None])
+
+# The URL forms fetch the options of large sh:in lists from, followed by the key of the list's option index. Relative
+# to the page the form is on
+OPTIONS_URL = 'options'
+
+# Records what each form built by build_forms depended on, so unchanged forms can be skipped on the next build
+MANIFEST_NAME = '.shaclform-manifest.json'
+MANIFEST_VERSION = 1
+# A form is only skipped if these parts of its record are unchanged since it was built
+MANIFEST_KEYS = ['fingerprint', 'form', 'option_threshold', 'options_url', 'map_format']
+
+# Each worker process in build_forms loads the shapes once, into this handler
+_worker_handler = None
+_worker_options_url = OPTIONS_URL
+
 
 def generate_form(shape, form_destination='../miniflask/view/templates/form_contents.html',
-                  map_destination='../miniflask/map.ttl'):
+                  map_destination='../miniflask/map.ttl', option_threshold=None, options_destination=None,
+                  options_url=OPTIONS_URL, instrumentation=None):
     """
     :param shape: An RDF Graph or a file-like object that can be read.
     :param form_destination: Where the HTML file containing the form should be placed
     :param map_destination: Where the Turtle file containing the Shape RDF map should be placed
+    :param option_threshold: sh:in lists with more items than this are written to an option index, which the form
+                             searches as the user types, instead of being included in the form. The options must then
+                             be served at options_url. If None, every list is included in the form
+    :param options_destination: The directory option indexes are written to. Defaults to 'options' next to the form
+    :param options_url: The URL the form fetches options from, followed by the key of the list's option index. See
+                        shaclform.options.create_app
+    :param instrumentation: An Instrumentation which records the time spent in each stage
     :return:
     """
+    instrumentation = get_instrumentation(instrumentation)
     # Get shape
-    rdf_handler = RDFHandler(shape)
+    rdf_handler = RDFHandler(shape, option_threshold=option_threshold, instrumentation=instrumentation)
     shape = rdf_handler.get_shape()
 
     # Check that the file contained a shape
     if not shape:
         raise Exception('No shape provided.')
 
+    write_form(rdf_handler, shape, form_destination, map_destination, options_destination, options_url,
+               instrumentation)
+
+
+def build_form(shape, shape_uri=None, stream=False, option_threshold=None, options_url=OPTIONS_URL,
+               instrumentation=None):
+    """
+    Generates the form and map for a shape in memory, without writing anything to disk
+    :param shape: An RDF Graph or a file-like object that can be read.
+    :param shape_uri: The URI of the Node Shape to generate the form for. If not provided, the root shape is found
+                      automatically
+    :param stream: If True, the HTML is an iterator of chunks which are rendered as they are read, e.g. to be used as
+                   the body of an HTTP response
+    :param option_threshold: sh:in lists with more items than this are put in an option index, as in generate_form
+    :param options_url: The URL the form fetches options from
+    :param instrumentation: An Instrumentation which records the time spent in each stage. Rendering isn't timed if
+                            the HTML is streamed
+    :return: A FormArtifacts holding the HTML of the form, the RDF map as a Graph, the compiled map, and the option
+             indexes
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    rdf_handler = RDFHandler(shape, option_threshold=option_threshold, instrumentation=instrumentation)
+    shape = rdf_handler.get_shape(shape_uri)
+
+    # Check that the file contained a shape
+    if not shape:
+        raise Exception('No shape provided.')
+
+    html, map_graph, options, validation = render_form(rdf_handler, shape, stream, options_url, instrumentation)
+    with instrumentation.stage('compile_map'):
+        compiled_map = CompiledMap.from_graph(map_graph, validation=validation)
+    return FormArtifacts(html, map_graph, compiled_map, options)
+
+
+def generate_forms(shapes, destination, option_threshold=None, options_url=OPTIONS_URL,
+                   instrumentation=None):
+    """
+    Generates a form and map for every root shape in a Shapes Graph. The form and map for each shape are named after
+    the shape, e.g. http://example.org/ex#PersonShape -> PersonShape.html and PersonShape.ttl
+    :param shapes: An RDF Graph or a file-like object that can be read.
+    :param destination: The directory the forms and maps are placed in. Option indexes are placed in its 'options'
+                        directory
+    :param option_threshold: sh:in lists with more items than this are put in an option index, as in generate_form
+    :param options_url: The URL the forms fetch options from
+    :param instrumentation: An Instrumentation which records the time spent in each stage, totalled over every shape
+    :return: A dict mapping the URI of each shape to the paths of its form and map
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    rdf_handler = RDFHandler(shapes, option_threshold=option_threshold, instrumentation=instrumentation)
+    results = dict()
+    used_names = set()
+    for shape_uri, shape in rdf_handler.get_shapes():
+        name = shape_file_name(shape_uri, used_names)
+        form_destination = os.path.join(destination, name + '.html')
+        map_destination = os.path.join(destination, name + '.ttl')
+        write_form(rdf_handler, shape, form_destination, map_destination, options_url=options_url,
+                   instrumentation=instrumentation)
+        results[shape_uri] = (form_destination, map_destination)
+    return results
+
+
+def build_forms(directory, destination, jobs=None, cache_dir=None, incremental=False,
+                option_threshold=None, options_url=OPTIONS_URL, instrumentation=None):
+    """
+    Generates a form and map for every root shape in a directory of Shapes files, spread across a pool of processes.
+    Each worker loads the shapes once. A shape which can't be generated doesn't stop the others.
+    :param directory: A directory of Shapes files, loaded with ShapeRegistry
+    :param destination: The directory the forms and maps are placed in, named as in generate_forms
+    :param jobs: The number of worker processes. Defaults to the number of CPUs. If 1, no pool is used
+    :param cache_dir: Passed to ShapeRegistry, so that workers can load parsed files instead of parsing them again
+    :param incremental: If True, forms are only generated for shapes which changed since the last build into
+                        destination. Shapes are compared by fingerprint (see RDFHandler.get_fingerprint)
+    :param option_threshold: sh:in lists with more items than this are put in an option index, as in generate_form.
+                             Option indexes are placed in the 'options' directory of destination
+    :param options_url: The URL the forms fetch options from
+    :param instrumentation: An Instrumentation which the timings and counts of every shape built are added to,
+                            including those built in worker processes. Loading the shapes is timed as parse
+    :return: A list of FormBuildResult, one for each shape
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    with instrumentation.stage('parse'):
+        registry = ShapeRegistry(directory, cache_dir=cache_dir, ignore_errors=True, exclude=[destination, cache_dir])
+    # Files which couldn't be loaded are reported in place of their shapes
+    results = [FormBuildResult(path, None, None, 0.0, type(e).__name__ + ': ' + str(e))
+               for path, e in registry.errors.items()]
+    rdf_handler = registry.get_handler(indexed=True, option_threshold=option_threshold)
+    previous_manifest = read_manifest(destination) if incremental else dict()
+    manifest = dict()
+    used_names = set()
+    tasks = list()
+    # Sorted so that shapes are given the same file names every build
+    for shape_uri in sorted(rdf_handler.get_root_shape_uris()):
+        name = shape_file_name(shape_uri, used_names)
+        form_destination = os.path.join(destination, name + '.html')
+        map_destination = os.path.join(destination, name + '.ttl')
+        dependencies = rdf_handler.get_dependencies(shape_uri)
+        record = {
+            'form': form_destination,
+            'map': map_destination,
+            'fingerprint': rdf_handler.get_fingerprint(shape_uri, dependencies),
+            'dependencies': sorted(str(d) for d in dependencies if isinstance(d, URIRef)),
+            'sources': sorted(registry.get_source_files(dependencies)),
+            'option_threshold': option_threshold,
+            'options_url': options_url,
+            'map_format': MAP_FORMAT_VERSION
+        }
+        manifest[str(shape_uri)] = record
+        previous = previous_manifest.get(str(shape_uri))
+        if previous and all(previous.get(key) == record[key] for key in MANIFEST_KEYS) \
+                and os.path.isfile(form_destination) and os.path.isfile(map_destination) \
+                and os.path.isfile(compiled_map_path(map_destination)):
+            results.append(FormBuildResult(shape_uri, form_destination, map_destination, 0.0, None, skipped=True))
+        else:
+            tasks.append((shape_uri, form_destination, map_destination))
+    if jobs == 1 or not tasks:
+        built = [build_shape_form(rdf_handler, *task, options_url=options_url) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(directory, destination, cache_dir, option_threshold,
+                                           options_url)) as executor:
+            built = list(executor.map(build_shape_form_in_worker, *zip(*tasks)))
+    # Failed shapes are recorded without a fingerprint so they are tried again next build, keeping anything built for
+    # them before
+    for result in built:
+        if result.error:
+            previous = previous_manifest.get(str(result.shape_uri))
+            if previous:
+                manifest[str(result.shape_uri)] = dict(previous, fingerprint=None)
+            else:
+                del manifest[str(result.shape_uri)]
+        if result.stages:
+            instrumentation.merge(result.stages)
+    results.extend(built)
+    if incremental:
+        carry_forward_failed_sources(previous_manifest, manifest, registry.errors)
+        remove_stale_outputs(previous_manifest, manifest)
+        write_manifest(destination, manifest)
+    return results
+
+
+def read_manifest(destination):
+    # The shapes recorded by the last incremental build into destination. Empty if the templates have changed since
+    path = os.path.join(destination, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('templates') != get_template_fingerprint():
+        return dict()
+    return manifest['shapes']
+
+
+def write_manifest(destination, shapes):
+    os.makedirs(destination, exist_ok=True)
+    manifest = {'version': MANIFEST_VERSION, 'templates': get_template_fingerprint(), 'shapes': shapes}
+    with open(os.path.join(destination, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def carry_forward_failed_sources(previous_manifest, manifest, errors):
+    # Shapes missing from this build because a file they were read from couldn't be loaded may still exist, so they
+    # keep their records, and so their forms and maps, until the file can be loaded again. Unless another shape has
+    # since been given their file names
+    current_forms = set(record['form'] for record in manifest.values())
+    for shape_uri, record in previous_manifest.items():
+        if shape_uri not in manifest and record['form'] not in current_forms and \
+                any(source in errors for source in record['sources']):
+            manifest[shape_uri] = record
+
+
+def remove_stale_outputs(previous_manifest, manifest):
+    # Removes forms and maps built for shapes which no longer exist or have been renamed
+    current_outputs = set()
+    for record in manifest.values():
+        current_outputs.update([record['form'], record['map'], compiled_map_path(record['map'])])
+    for record in previous_manifest.values():
+        for path in [record['form'], record['map'], compiled_map_path(record['map'])]:
+            if path not in current_outputs and os.path.isfile(path):
+                os.remove(path)
+
+
+def init_worker(directory, destination, cache_dir, option_threshold=None, options_url=OPTIONS_URL):
+    global _worker_handler, _worker_options_url
+    registry = ShapeRegistry(directory, cache_dir=cache_dir, ignore_errors=True, exclude=[destination, cache_dir])
+    _worker_handler = registry.get_handler(indexed=True, option_threshold=option_threshold)
+    _worker_options_url = options_url
+
+
+def build_shape_form_in_worker(shape_uri, form_destination, map_destination):
+    return build_shape_form(_worker_handler, shape_uri, form_destination, map_destination, _worker_options_url)
+
+
+def build_shape_form(rdf_handler, shape_uri, form_destination, map_destination, options_url=OPTIONS_URL):
+    # Generates the form for one shape, timing it and each of its stages, and catching any error so it can be reported
+    # with the others
+    instrumentation = Instrumentation()
+    rdf_handler.instrumentation = instrumentation
+    start = time.perf_counter()
+    try:
+        for shape_uri, shape in rdf_handler.get_shapes([shape_uri]):
+            write_form(rdf_handler, shape, form_destination, map_destination, options_url=options_url,
+                       instrumentation=instrumentation)
+        error = None
+    except Exception as e:
+        error = type(e).__name__ + ': ' + str(e)
+    finally:
+        rdf_handler.instrumentation = get_instrumentation()
+    return FormBuildResult(shape_uri, form_destination, map_destination, time.perf_counter() - start, error,
+                           stages=instrumentation.to_dict())
+
+
+def shape_file_name(shape_uri, used_names):
+    # Names files after the last part of the shape's URI, adding a number if another shape already has that name
+    name = re.split('[#/]', str(shape_uri).rstrip('#/'))[-1] or 'Shape'
+    unique_name = name
+    number = 1
+    while unique_name in used_names:
+        number += 1
+        unique_name = name + '-' + str(number)
+    used_names.add(unique_name)
+    return unique_name
+
+
+def write_form(rdf_handler, shape, form_destination, map_destination, options_destination=None,
+               options_url=OPTIONS_URL, instrumentation=None):
+    """
+    Prepares an extracted shape for the form and writes its form and map
+    :param rdf_handler: The RDFHandler the shape was read with
+    :param shape: The shape, as returned by RDFHandler.get_shape
+    :param form_destination: Where the HTML file containing the form should be placed
+    :param map_destination: Where the Turtle file containing the Shape RDF map should be placed. The compiled map,
+                            holding the validation table of the shape, is written next to it with the extension .json
+    :param options_destination: The directory option indexes are written to. Defaults to 'options' next to the form
+    :param options_url: The URL the form fetches options from
+    :param instrumentation: An Instrumentation which records the time spent in each stage. As the form is written
+                            while it is rendered, writing it is timed as render
+    :return:
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    html, map_graph, options, validation = render_form(rdf_handler, shape, stream=True, options_url=options_url,
+                                                       instrumentation=instrumentation)
+
+    # Option indexes are written first, so they can be searched as soon as the form is
+    if options_destination is None:
+        options_destination = os.path.join(os.path.dirname(os.path.abspath(form_destination)), 'options')
+    with instrumentation.stage('write'):
+        for index in options.values():
+            index.save(options_destination)
+
+    # Put things into template. The form is written as it is rendered, so it is never held in memory all at once
+    os.makedirs(os.path.dirname(os.path.abspath(form_destination)), exist_ok=True)
+    with instrumentation.stage('render'):
+        write_chunks(form_destination, html)
+    if instrumentation.enabled:
+        instrumentation.count('form_bytes', os.path.getsize(form_destination))
+
+    # Create map for converting submitted data into RDF, along with its compiled form which is faster to load
+    with instrumentation.stage('compile_map'):
+        compiled_map = CompiledMap.from_graph(map_graph, map_destination, validation)
+    with instrumentation.stage('write'):
+        map_graph.serialize(destination=map_destination, format='turtle')
+        write_compiled_map(compiled_map, map_destination)
+
+
+def write_chunks(destination, chunks):
+    # Writes the chunks to a temporary file next to the destination, which only replaces it once every chunk has been
+    # written. A form which fails partway through rendering never replaces the last good one
+    temp_path = destination + '.tmp'
+    try:
+        with open(temp_path, 'w') as file:
+            file.writelines(chunks)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def render_form(rdf_handler, shape, stream=False, options_url=OPTIONS_URL, instrumentation=None):
+    """
+    Prepares an extracted shape for the form, then renders its form and builds its map
+    :param rdf_handler: The RDFHandler the shape was read with
+    :param shape: The shape, as returned by RDFHandler.get_shape
+    :param stream: If True, the HTML is returned as an iterator of chunks which are rendered as they are read
+    :param options_url: The URL the form fetches options from
+    :param instrumentation: An Instrumentation which records the time spent in each stage. Rendering is only timed if
+                            the HTML isn't streamed
+    :return: A tuple of the HTML of the form, the RDF map as a Graph, a dict of the option index of each large sh:in
+             list by key, and the validation table of the shape
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.count('shapes')
+    form_name, shape = prepare_shape(shape, instrumentation)
+    with instrumentation.stage('options'):
+        options = index_options(rdf_handler, shape, options_url)
+    if stream:
+        html = stream_template(form_name, shape)
+    else:
+        with instrumentation.stage('render'):
+            html = render_template(form_name, shape)
+    with instrumentation.stage('map'):
+        map_graph = rdf_handler.build_rdf_map(shape)
+        validation = build_validation_table(shape, options)
+    instrumentation.count('map_triples', len(map_graph))
+    return html, map_graph, options, validation
+
+
+def index_options(rdf_handler, shape, options_url=OPTIONS_URL):
+    """
+    Reads the sh:in lists which were too large to be read into their properties into option indexes. Each of those
+    properties is given the URL its options are fetched from, and the key of its option index as optionIndex
+    :param rdf_handler: The RDFHandler the shape was read with
+    :param shape: The prepared shape
+    :param options_url: The URL the form fetches options from
+    :return: A dict of the option indexes by key
+    """
+    indexes = dict()
+    # Lists shared by many properties are only read once
+    index_by_source = dict()
+
+    def add_options(prop):
+        if 'optionSource' in prop:
+            source = prop['optionSource']
+            if source not in index_by_source:
+                index = OptionIndex(rdf_handler.get_list(source))
+                index_by_source[source] = indexes.setdefault(index.key, index)
+            prop['optionIndex'] = index_by_source[source].key
+            prop['options'] = options_url.rstrip('/') + '/' + prop['optionIndex']
+            del prop['optionSource']
+        if 'property' in prop:
+            for p in prop['property']:
+                add_options(p)
+
+    for g in shape['groups']:
+        for prop in g['properties']:
+            add_options(prop)
+    for prop in shape['properties']:
+        add_options(prop)
+    return indexes
+
+
+def prepare_shape(shape, instrumentation=None):
+    """
+    Sorts the groups and properties of a shape, assigns every property an ID, and links pair constraints by ID
+    :param shape: The shape, as returned by RDFHandler.get_shape
+    :param instrumentation: An Instrumentation which records the time spent sorting, assigning IDs and pairing
+    :return: A tuple of the name of the form and the prepared shape
+    """
+    instrumentation = get_instrumentation(instrumentation)
     # Get a name for the form by cutting off part of the target class URI to find a more human readable name
     # Example: http://schema.org/Person -> Person
     form_name = shape['target_class'].rsplit('/', 1)[1] if 'target_class' in shape else 'Entry'
 
-    # Add ignored properties
+    add_ignored_properties(shape)
+    with instrumentation.stage('sort'):
+        sort_shape(shape)
+    with instrumentation.stage('ids'):
+        path_index = assign_ids(shape)
+    instrumentation.count('properties', sum(len(ids) for ids in path_index.values()))
+    with instrumentation.stage('pairing'):
+        link_paired_properties(shape, path_index)
+    return form_name, shape
+
+
+def add_ignored_properties(shape):
+    # Ignored properties of a closed shape are added as ungrouped properties, so they can still be entered
     if 'ignoredProperties' in shape:
         for ignored_property_path in shape['ignoredProperties']:
             ignored_property = {
@@ -36,6 +441,8 @@ def generate_form(shape, form_destination='../miniflask/view/templates/form_cont
             }
             shape['properties'].append(ignored_property)
 
+
+def sort_shape(shape):
     # Sort the groups
     shape['groups'] = sort_by_order(shape['groups'])
     # Sort properties in groups
@@ -48,32 +455,31 @@ def generate_form(shape, form_destination='../miniflask/view/templates/form_cont
     for prop in shape['properties']:
         sort_composite_property(prop)
 
-    # Assign every property a unique ID
+
+def assign_ids(shape):
+    # Assign every property a unique ID, recording the IDs given to each path
+    # Returns the path index, which maps each path to the IDs of the properties with that path
     next_id = 0
+    path_index = dict()
     for g in shape['groups']:
         for prop in g['properties']:
-            assign_id(prop, next_id)
+            assign_id(prop, next_id, path_index=path_index)
             next_id += 1
     for prop in shape['properties']:
-        assign_id(prop, next_id)
+        assign_id(prop, next_id, path_index=path_index)
         next_id += 1
+    return path_index
+
 
+def link_paired_properties(shape, path_index=None):
     # Link pair property constraints by ID
     for g in shape["groups"]:
         for prop in g["properties"]:
             for constraint in prop:
-                find_paired_properties(shape, prop, constraint)
+                find_paired_properties(shape, prop, constraint, path_index)
     for prop in shape["properties"]:
         for constraint in prop:
-            find_paired_properties(shape, prop, constraint)
-
-    # Put things into template
-    os.makedirs(os.path.dirname(os.path.abspath(form_destination)), exist_ok=True)
-    with open(form_destination, 'w') as file:
-        file.write(render_template(form_name, shape))
-
-    # Create map for converting submitted data into RDF
-    rdf_handler.create_rdf_map(shape, map_destination)
+            find_paired_properties(shape, prop, constraint, path_index)
 
 
 def sort_by_order(properties):
@@ -92,65 +498,132 @@ def sort_composite_property(prop):
             sort_composite_property(p)
 
 
-def assign_id(prop, next_id, parent_id=None):
+def assign_id(prop, next_id, parent_id=None, path_index=None):
     # Assigns the property an ID
     # Additionally, assigns an ID to any property within this property
+    # If a path index is provided, the ID is added to the list of IDs for the property's path
     if parent_id is not None:
         prop["id"] = str(parent_id) + ":" + str(next_id)
     else:
         prop["id"] = next_id
+    if path_index is not None and "path" in prop:
+        path_index.setdefault(prop["path"], []).append(prop["id"])
     if "property" in prop:
         next_internal_id = 0
         for p in prop["property"]:
-            assign_id(p, next_internal_id, parent_id=prop["id"])
+            assign_id(p, next_internal_id, parent_id=prop["id"], path_index=path_index)
             next_internal_id += 1
 
 
-def find_paired_properties(shape, prop, constraint):
-    # If the constraint is a pair property constraint, iterates through all the properties looking for the one that
-    # matches
+def index_paths(shape):
+    # Builds a path index, as assign_id does, from a shape which already has IDs
+    path_index = dict()
+
+    def add_property(prop):
+        path_index.setdefault(prop["path"], []).append(prop["id"])
+        if "property" in prop:
+            for p in prop["property"]:
+                add_property(p)
+
+    for g in shape["groups"]:
+        for p in g["properties"]:
+            add_property(p)
+    for p in shape["properties"]:
+        add_property(p)
+    return path_index
+
+
+def find_paired_properties(shape, prop, constraint, path_index=None):
+    # If the constraint is a pair property constraint, replaces the path it references with the ID of the property
+    # with that path
     # Additionally, looks for pair property constraints in the properties contained in this property using recursion
+    # The path index maps each path to the IDs of the properties with that path. It is built from the shape if not
+    # provided
     if constraint == "property":
         for p in prop[constraint]:
             for c in p:
-                find_paired_properties(shape, p, c)
+                find_paired_properties(shape, p, c, path_index)
     if constraint in ["equals", "disjoint", "lessThan", "lessThanOrEquals"]:
-        for g in shape["groups"]:
-            for p in g["properties"]:
-                result = check_property(p, prop[constraint])
-                if result is not None:
-                    prop[constraint] = result
-                    return
-        for p in shape["properties"]:
-            result = check_property(p, prop[constraint])
-            if result is not None:
-                prop[constraint] = result
-                return
-
-
-def check_property(prop, path):
-    # If the property path matches the path being searched for, return the property id
-    # Also searches the properties inside this property using recursion
-    if prop["path"] == path:
-        return prop["id"]
-    if "property" in prop:
-        for p in prop["property"]:
-            result = check_property(p, path)
-            if result is not None:
-                return result
+        if path_index is None:
+            path_index = index_paths(shape)
+        path = prop[constraint]
+        ids = path_index.get(path)
+        name = prop.get("name", prop.get("path"))
+        if not ids:
+            warn('Property "' + str(name) + '" has constraint "sh:' + constraint + '" with value "' + str(path) +
+                 '" which does not match the path of any property in the shape.')
+            return
+        if len(ids) > 1:
+            warn('Property "' + str(name) + '" has constraint "sh:' + constraint + '" with value "' + str(path) +
+                 '" which matches the path of more than one property. Using the first.')
+        prop[constraint] = ids[0]
 
 
-if __name__ == "__main__":
-    # File name passed as command-line argument
-    if len(sys.argv) < 2:
-        raise Exception('Usage - python main.py <SHACL file path> <optional: form destination> '
-                        '<optional: map destination')
-    file_path = sys.argv[1]
-    if not os.path.isfile(file_path):
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generates a form and RDF map from a SHACL Shapes file, or forms and maps for every shape in a '
+                    'directory of Shapes files.')
+    parser.add_argument('path', help='SHACL Shapes file, or directory of Shapes files')
+    parser.add_argument('form_destination', nargs='?', help='Where the form is placed (single file only)')
+    parser.add_argument('map_destination', nargs='?', help='Where the RDF map is placed (single file only)')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Number of worker processes used for a directory. Defaults to the number of CPUs')
+    parser.add_argument('--out', default='forms', help='Where forms and maps are placed for a directory')
+    parser.add_argument('--cache', default=None, help='Directory for caching parsed Shapes files between runs')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only generate forms for shapes which changed since the last build into --out')
+    parser.add_argument('--option-threshold', type=int, default=None,
+                        help='sh:in lists with more items than this are searched through an option index instead of '
+                             'being included in the form. The option indexes must be served at --options-url, e.g. '
+                             'with python -m shaclform.options. By default every list is included in the form')
+    parser.add_argument('--options-url', default=OPTIONS_URL, help='The URL forms fetch options from')
+    parser.add_argument('--profile', default=None,
+                        help='Profile the build with cProfile, dumping the statistics to this file. Only the main '
+                             'process is profiled, so use --jobs 1 for a directory')
+    parser.add_argument('--timings', action='store_true',
+                        help='Print the time spent in each stage, and counts of the work done, once finished')
+    args = parser.parse_args(argv)
+
+    instrumentation = Instrumentation() if args.timings else None
+    with profile(args.profile):
+        status = run(args, instrumentation)
+    if instrumentation:
+        print('\n'.join(instrumentation.report()), file=sys.stderr)
+    return status
+
+
+def run(args, instrumentation=None):
+    # Builds the forms asked for on the command line
+    if os.path.isdir(args.path):
+        results = build_forms(args.path, args.out, jobs=args.jobs, cache_dir=args.cache,
+                              incremental=args.incremental, option_threshold=args.option_threshold,
+                              options_url=args.options_url, instrumentation=instrumentation)
+        for result in results:
+            if result.skipped:
+                continue
+            if result.error:
+                print('FAILED {uri} ({seconds:.3f}s): {error}'.format(uri=result.shape_uri, seconds=result.seconds,
+                                                                      error=result.error), file=sys.stderr)
+            else:
+                print('{uri} -> {form} ({seconds:.3f}s)'.format(uri=result.shape_uri, form=result.form_destination,
+                                                               seconds=result.seconds))
+        failures = sum(1 for result in results if result.error)
+        skipped = sum(1 for result in results if result.skipped)
+        print('Generated {count} forms, {skipped} unchanged, {failures} failed.'.format(
+            count=len(results) - failures - skipped, skipped=skipped, failures=failures))
+        return 1 if failures else 0
+
+    if not os.path.isfile(args.path):
         raise Exception('File does not exist')
-    if len(sys.argv) >= 4:
-        with open(file_path) as f:
-            generate_form(f, sys.argv[2], sys.argv[3])
-    elif len(sys.argv) >= 2:
-        with open(file_path) as f:
-            generate_form(f)
+    with open(args.path) as f:
+        if args.map_destination:
+            generate_form(f, args.form_destination, args.map_destination, option_threshold=args.option_threshold,
+                          options_url=args.options_url, instrumentation=instrumentation)
+        else:
+            generate_form(f, option_threshold=args.option_threshold, options_url=args.options_url,
+                          instrumentation=instrumentation)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
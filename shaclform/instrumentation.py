@@ -0,0 +1,146 @@
+from contextlib import contextmanager
+import cProfile
+import threading
+import time
+
+
+class Instrumentation:
+    """
+    Collects how long each stage of form generation or conversion takes, and counts of the work done in them, e.g.
+    the triples read or the entries probed. Stages and counts are totalled by name across every use of the
+    instrumentation, so one instrumentation can be passed to many builds or conversions.
+
+    Stages recorded while generating a form:
+        parse, expand (sh:node expansion), get_shape, sort, ids, pairing, options, render, map, compile_map, write
+    Stages recorded while converting a submission:
+        load_map, index_form, convert, validate
+    Counts:
+        triples_read, shapes, properties, form_bytes (only when the form is written), map_triples, submissions,
+        entries_probed, triples_emitted, violations
+
+    A callback can be given to feed each measurement into a metrics system as it is recorded. Measurements can be
+    recorded from many threads at once, e.g. by a FormConverter shared between them.
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        """
+        :param callback: Called with ('stage', name, seconds) when a stage ends, and with ('count', name, amount) when
+                         something is counted
+        """
+        self.callback = callback
+        # Stage name -> total seconds, and the number of times the stage ran
+        self.timings = dict()
+        self.calls = dict()
+        # Count name -> total
+        self.counts = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.callback:
+            self.callback('stage', name, seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+        if self.callback:
+            self.callback('count', name, amount)
+
+    def merge(self, other):
+        """
+        Adds the timings and counts recorded by another instrumentation, e.g. in a worker process
+        :param other: An Instrumentation, or a dict as returned by to_dict
+        :return:
+        """
+        if isinstance(other, Instrumentation):
+            other = other.to_dict()
+        for name, seconds in other['timings'].items():
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + seconds
+                self.calls[name] = self.calls.get(name, 0) + other['calls'].get(name, 1)
+            if self.callback:
+                self.callback('stage', name, seconds)
+        for name, amount in other['counts'].items():
+            self.count(name, amount)
+
+    def to_dict(self):
+        with self._lock:
+            return {'timings': dict(self.timings), 'calls': dict(self.calls), 'counts': dict(self.counts)}
+
+    def report(self):
+        # Lines describing every stage and count, for printing
+        lines = ['{name:12} {seconds:10.5f}s  x{calls}'.format(name=name, seconds=seconds, calls=self.calls[name])
+                 for name, seconds in self.timings.items()]
+        lines.extend('{name:16} {amount}'.format(name=name, amount=amount) for name, amount in self.counts.items())
+        return lines
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Records nothing. Used whenever no instrumentation is given, so that instrumented code costs next to nothing.
+    """
+    enabled = False
+
+    def __init__(self):
+        super().__init__()
+        self._null_stage = _NullStage()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def merge(self, other):
+        pass
+
+
+class _NullStage:
+    # A reusable context manager which does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+def get_instrumentation(instrumentation=None):
+    # The instrumentation given, or one which records nothing
+    return NULL_INSTRUMENTATION if instrumentation is None else instrumentation
+
+
+@contextmanager
+def profile(destination=None):
+    """
+    Profiles the code run inside the block with cProfile
+    :param destination: Where the profile is dumped when the block ends, to be read with pstats or a viewer such as
+                        snakeviz. If None, nothing is profiled
+    :return:
+    """
+    if destination is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(destination)
@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+# A threshold suited to most forms, for those which move large sh:in lists out of the form into an option index. Option
+# indexes are only used when a threshold is given, as the form then needs somewhere to fetch the options from
+OPTION_THRESHOLD = 1000
+
+# Identifies option indexes written as JSON. The version changes whenever the layout of the JSON changes
+OPTIONS_FORMAT = 'shaclform-options'
+OPTIONS_FORMAT_VERSION = 1
+
+# The number of options returned by a search if no limit is given, and the most that can be asked for
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class OptionIndex:
+    """
+    The options of a large sh:in list, sorted so they can be searched by prefix without scanning every option.
+    Searches ignore case.
+    """
+    def __init__(self, options):
+        options = sorted(set(str(o) for o in options), key=lambda o: (o.casefold(), o))
+        self.options = options
+        self.folded = [o.casefold() for o in options]
+        self._key = None
+
+    @property
+    def key(self):
+        # Identifies the index by its options, so a list used by many properties or forms is only stored once
+        if self._key is None:
+            self._key = hashlib.sha256('\n'.join(self.options).encode('utf-8')).hexdigest()[:32]
+        return self._key
+
+    def search(self, prefix='', offset=0, limit=DEFAULT_LIMIT):
+        """
+        :param prefix: Only options starting with this are returned
+        :param offset: The number of matching options to skip, to page through the results
+        :param limit: The most options to return
+        :return: A dict of the matching options in order, and the total number of options matching the prefix
+        """
+        prefix = prefix.casefold()
+        start = bisect_left(self.folded, prefix)
+        end = bisect_left(self.folded, prefix + '\U0010ffff', start)
+        first = min(start + max(offset, 0), end)
+        return {'options': self.options[first:min(first + max(limit, 0), end)], 'total': end - start}
+
+    def to_json(self):
+        return json.dumps({'format': OPTIONS_FORMAT, 'version': OPTIONS_FORMAT_VERSION, 'options': self.options},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text, source='option index'):
+        data = json.loads(text)
+        if not isinstance(data, dict) or data.get('format') != OPTIONS_FORMAT:
+            raise ValueError('Not an option index: ' + str(source))
+        if data.get('version') != OPTIONS_FORMAT_VERSION:
+            raise ValueError('Option index ' + str(source) + ' has version ' + str(data.get('version')) +
+                             ', expected ' + str(OPTIONS_FORMAT_VERSION))
+        return cls(data['options'])
+
+    def save(self, directory):
+        """
+        Writes the index to <key>.json in the directory, unless it is already there
+        :param directory: The directory option indexes are kept in
+        :return: The path of the index
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.key + '.json')
+        if not os.path.isfile(path):
+            # Written to a temporary file first, so an interrupted build never leaves a truncated index behind
+            temp_path = path + '.tmp'
+            try:
+                with open(temp_path, 'w') as f:
+                    f.write(self.to_json())
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.isfile(temp_path):
+                    os.remove(temp_path)
+                raise
+        return path
+
+
+def create_app(directory):
+    """
+    A WSGI application which searches the option indexes in a directory. Requests are made to /<key>, with the query
+    parameters q (the prefix), offset and limit. Responds with JSON, as returned by OptionIndex.search.
+    Can be mounted in a web application at the options URL given to generate_form, or served locally with:
+        python -m shaclform.options <directory>
+    :param directory: The directory the option indexes were written to
+    :return: The WSGI application
+    """
+    indexes = dict()
+
+    def get_index(key):
+        path = os.path.join(directory, key + '.json')
+        mtime = os.path.getmtime(path)
+        if key not in indexes or indexes[key][0] != mtime:
+            with open(path) as f:
+                indexes[key] = (mtime, OptionIndex.from_json(f.read(), path))
+        return indexes[key][1]
+
+    def app(environ, start_response):
+        key = environ.get('PATH_INFO', '').strip('/')
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        try:
+            if not re.match(r'[0-9a-f]+$', key):
+                raise FileNotFoundError(key)
+            index = get_index(key)
+            offset = int(query.get('offset', ['0'])[0])
+            limit = min(int(query.get('limit', [str(DEFAULT_LIMIT)])[0]), MAX_LIMIT)
+        except (OSError, ValueError):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'No option index: ' + key.encode('utf-8')]
+        body = json.dumps(index.search(query.get('q', [''])[0], offset, limit)).encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve option indexes for forms generated from SHACL shapes.')
+    parser.add_argument('directory', help='The directory the option indexes were written to')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port, create_app(args.directory))
+    print('Serving option indexes from ' + args.directory + ' on http://' + args.host + ':' + str(args.port) + '/')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,27 @@
 from rdflib.graph import Graph
-from rdflib.term import URIRef, Literal
+from rdflib.term import URIRef, Literal, BNode
 from rdflib.util import guess_format
 from rdflib.collection import Collection
 from rdflib.namespace import RDF, RDFS
 from warnings import warn
+from copy import deepcopy
+from itertools import islice
+from shaclform.instrumentation import get_instrumentation
+import hashlib
+import sys
 import re
 
 SHACL = 'http://www.w3.org/ns/shacl#'
 
+# Constraint names for the SHACL predicates, so they don't have to be cut out of the predicate URI every time
+CONSTRAINT_NAMES = {URIRef(SHACL + name): name for name in [
+    'path', 'name', 'description', 'order', 'group', 'defaultValue', 'node', 'property', 'nodeKind', 'datatype',
+    'class', 'minCount', 'maxCount', 'minInclusive', 'minExclusive', 'maxInclusive', 'maxExclusive', 'minLength',
+    'maxLength', 'pattern', 'flags', 'languageIn', 'uniqueLang', 'in', 'hasValue', 'equals', 'disjoint', 'lessThan',
+    'lessThanOrEquals', 'closed', 'ignoredProperties', 'targetClass', 'qualifiedValueShape', 'qualifiedMinCount',
+    'qualifiedMaxCount'
+]}
+
 
 class RDFHandler:
     """
@@ -17,15 +31,124 @@ class RDFHandler:
         Target class
         Properties associated with the shape
     """
-    def __init__(self, shape):
+    def __init__(self, shape, indexed=False, option_threshold=None, instrumentation=None):
+        """
+        :param shape: An RDF Graph or a file-like object that can be read.
+        :param indexed: If True, every triple in the graph is read into an index by subject in one pass, and properties
+                        are read from the index instead of the graph. Faster for large Shapes graphs
+        :param option_threshold: sh:in lists with more items than this aren't read into the property. Instead, the head
+                                 of the list is given as the property's optionSource, so the options can be read later
+                                 with get_list. If None, every list is read
+        :param instrumentation: An Instrumentation which records the time spent parsing and expanding shapes
+        """
+        self.instrumentation = get_instrumentation(instrumentation)
         self.g = Graph()
-        if type(shape) is Graph:
+        if isinstance(shape, Graph):
             self.g = shape
         else:
-            self.g.parse(shape, format=guess_format(shape.name))
-        shape.close()
+            with self.instrumentation.stage('parse'):
+                self.g.parse(shape, format=guess_format(shape.name))
+            shape.close()
+        self.instrumentation.count('triples_read', len(self.g))
+        # Caches shared between shapes read from the graph
+        self._groups = None
+        self._properties = dict()
+        self._constraint_names = dict(CONSTRAINT_NAMES)
+        # Shapes expanded with their sh:node links, and the shapes being expanded or read, to catch cycles
+        self._expanded = dict()
+        self._expanding = set()
+        self._reading = set()
+        self.option_threshold = option_threshold
+        self._index = None
+        if indexed:
+            self._index = dict()
+            for (s, p, o) in self.g:
+                self._index.setdefault(s, []).append((p, o))
+
+    def predicate_objects(self, subject):
+        # Reads from the index if there is one, otherwise from the graph
+        if self._index is not None:
+            return list(self._index.get(subject, ()))
+        return list(self.g.predicate_objects(subject))
+
+    def get_list(self, head, limit=None):
+        # Reads an RDF list, or only its first items if a limit is given. Uses the index if there is one
+        if self._index is None:
+            return list(islice(Collection(self.g, head), limit))
+        items = list()
+        while head and head != RDF.nil and (limit is None or len(items) < limit):
+            first = rest = None
+            for (p, o) in self._index.get(head, ()):
+                if p == RDF.first:
+                    first = o
+                elif p == RDF.rest:
+                    rest = o
+            if first is not None:
+                items.append(first)
+            head = rest
+        return items
+
+    def expand_node(self, subject):
+        """
+        Reads the constraints of a shape along with those of every node it links to with sh:node, at all depths. The
+        graph isn't modified, and each shape is only expanded once.
+        :param subject: The URI or blank node of a shape
+        :return: A tuple of (predicate, object) pairs. The shape's own constraints come first, followed by those of
+                 each node in the order they are linked
+        """
+        expanded = self._expanded.get(subject)
+        if expanded is not None:
+            return expanded
+        if subject in self._expanding:
+            raise Exception('Recursion not allowed: shape ' + subject + ' links to itself through sh:node.')
+        if not self._expanding:
+            # Only the outermost expansion is timed, as it includes the nodes expanded inside it
+            with self.instrumentation.stage('expand'):
+                return self._expand_node(subject)
+        return self._expand_node(subject)
+
+    def _expand_node(self, subject):
+        self._expanding.add(subject)
+        try:
+            constraints = self.predicate_objects(subject)
+            seen = set(constraints)
+            for (p, o) in tuple(constraints):
+                if p == URIRef(SHACL + 'node'):
+                    for pair in self.expand_node(o):
+                        if pair not in seen:
+                            seen.add(pair)
+                            constraints.append(pair)
+        finally:
+            self._expanding.discard(subject)
+        expanded = tuple(constraints)
+        self._expanded[subject] = expanded
+        return expanded
+
+    @staticmethod
+    def constraint_value(constraints, predicate):
+        # The first object given for a predicate in a list of constraints, or None
+        for (p, o) in constraints:
+            if p == predicate:
+                return o
+        return None
+
+    def constraint_name(self, predicate):
+        # The name of the constraint given by a predicate, which is the last part of its URI
+        name = self._constraint_names.get(predicate)
+        if name is None:
+            name = sys.intern(str(predicate[max(predicate.rfind('#'), predicate.rfind('/')) + 1:]))
+            self._constraint_names[predicate] = name
+        return name
 
-    def get_shape(self):
+    def get_shape(self, shape_uri=None):
+        """
+        :param shape_uri: The URI of the Node Shape to read. If not provided, the root shape is found automatically
+        :return: A dict holding the target class, groups, and ungrouped properties of the shape
+        """
+        with self.instrumentation.stage('get_shape'):
+            return self.read_shape(shape_uri)
+
+    def read_shape(self, shape_uri=None):
         # Will hold the target class, groups, and ungrouped properties
         shape = dict()
 
@@ -40,36 +163,31 @@ class RDFHandler:
         Shapes and properties can reference other shapes using the sh:node predicate. Therefore, the root shape is the
         only shape that is not the object of a triple with a predicate of sh:node.
         """
-        shape_uris = list(self.g.subjects(URIRef(RDF.uri + 'type'), URIRef(SHACL + 'NodeShape')))
-        root_uri = None
-        if not shape_uris:
-            return None
-        for s in shape_uris:
-            if (None, URIRef(SHACL + 'node'), s) not in self.g:
-                root_uri = s
-                break
-        if not root_uri:
-            raise Exception('Recursion not allowed.')
+        if shape_uri is not None:
+            root_uri = URIRef(shape_uri)
+            if (root_uri, URIRef(RDF.uri + 'type'), URIRef(SHACL + 'NodeShape')) not in self.g:
+                raise Exception('No NodeShape with URI: ' + root_uri)
+        else:
+            root_uris = self.get_root_shape_uris()
+            if not root_uris:
+                return None
+            root_uri = root_uris[0]
 
         """
-        Add any nodes which may be attached to this root shape.
-        Does this by grabbing everything in that node and adding it to the root shape.
-        Nodes inside properties are handled in get_property
+        Read the constraints of the root shape, along with those of any nodes attached to it. Nodes are expanded
+        without modifying the graph. Nodes inside properties are handled in get_property
         """
-        nodes = self.g.objects(root_uri, URIRef(SHACL + 'node'))
-        for n in nodes:
-            for (p, o) in self.g.predicate_objects(n):
-                self.add_node(root_uri, p, o)
+        constraints = self.expand_node(root_uri)
 
         """
         Get the target class
         Node Shapes have 0-1 target classes. The target class is useful for naming the form.
         Looks for implicit class targets - a shape of type sh:NodeShape and rdfs:Class is a target class of itself.
         """
-        if (root_uri, URIRef(RDF.uri + 'type'), URIRef(RDFS.uri + 'Class')) in self.g:
+        if (URIRef(RDF.uri + 'type'), URIRef(RDFS.uri + 'Class')) in constraints:
             shape['target_class'] = root_uri
         else:
-            shape['target_class'] = self.g.value(root_uri, URIRef(SHACL + 'targetClass'), None)
+            shape['target_class'] = self.constraint_value(constraints, URIRef(SHACL + 'targetClass'))
         if not shape['target_class']:
             raise Exception('A target class must be specified for shape: ' + root_uri)
 
@@ -78,7 +196,7 @@ class RDFHandler:
         Shapes which are open allow the presence of properties not explicitly defined in the shape
         Shapes which are closed will only allow explicitly defined properties
         """
-        is_closed = self.g.value(root_uri, URIRef(SHACL + 'closed'), None)
+        is_closed = self.constraint_value(constraints, URIRef(SHACL + 'closed'))
         if is_closed is None:
             shape['closed'] = False
         else:
@@ -89,21 +207,20 @@ class RDFHandler:
         being closed and not being defined in their own property shape.
         """
         if 'closed' in shape and shape['closed'] is True:
-            ignored_properties = self.g.value(root_uri, URIRef(SHACL + 'ignoredProperties'))
+            ignored_properties = self.constraint_value(constraints, URIRef(SHACL + 'ignoredProperties'))
             if ignored_properties:
-                shape['ignoredProperties'] = [str(l) for l in list(Collection(self.g, ignored_properties))]
+                shape['ignoredProperties'] = [str(l) for l in self.get_list(ignored_properties)]
 
         """
         Get the groups
         Some properties belong to groups which determine how they are presented in the form.
         """
         shape['groups'] = list()
-        group_uris = self.g.subjects(URIRef(RDF.uri + 'type'), URIRef(SHACL + 'PropertyGroup'))
-        for g_uri in group_uris:
+        for g_uri, label, order in self.get_groups():
             group = dict()
             group['uri'] = g_uri
-            group['label'] = self.g.value(g_uri, URIRef(RDFS.uri + 'label'), None)
-            group['order'] = self.g.value(g_uri, URIRef(SHACL + 'order'), None)
+            group['label'] = label
+            group['order'] = order
             group['properties'] = list()
             shape['groups'].append(group)
 
@@ -114,9 +231,12 @@ class RDFHandler:
         Otherwise, place it in the list of ungrouped properties
         """
         shape['properties'] = list()
-        property_uris = list(self.g.objects(root_uri, URIRef(SHACL + 'property')))
+        property_uris = list()
+        for (p, o) in constraints:
+            if p == URIRef(SHACL + 'property') and o not in property_uris:
+                property_uris.append(o)
         for p_uri in property_uris:
-            prop = self.get_property(p_uri)
+            prop = self.get_shared_property(p_uri)
             # Place the property in the correct place
             group_uri = self.g.value(p_uri, URIRef(SHACL + 'group'), None)
             # Belongs to group
@@ -136,23 +256,123 @@ class RDFHandler:
                 shape['properties'].append(prop)
         return shape
 
+    def get_root_shape_uris(self):
+        """
+        Shapes and properties can reference other shapes using the sh:node predicate. Therefore, root shapes are the
+        Node Shapes that are not the object of a triple with a predicate of sh:node.
+        :return: A list of the URIs of every root shape in the graph
+        """
+        shape_uris = list(self.g.subjects(URIRef(RDF.uri + 'type'), URIRef(SHACL + 'NodeShape')))
+        root_uris = [s for s in shape_uris if (None, URIRef(SHACL + 'node'), s) not in self.g]
+        if shape_uris and not root_uris:
+            raise Exception('Recursion not allowed.')
+        return root_uris
+
+    def get_shapes(self, shape_uris=None):
+        """
+        Reads every root shape in the graph. Groups and named property shapes are only read from the graph once and are
+        shared between the shapes. Groups which aren't used by a shape are left out of it.
+        :param shape_uris: The URIs of the shapes to read. If not provided, every root shape is read, sorted by URI so
+                           that they are always read in the same order
+        :return: Yields a tuple of the URI and the shape for each root shape
+        """
+        if shape_uris is None:
+            shape_uris = sorted(self.get_root_shape_uris())
+        for root_uri in shape_uris:
+            shape = self.get_shape(root_uri)
+            shape['groups'] = [g for g in shape['groups'] if g['properties']]
+            yield root_uri, shape
+
+    def get_dependencies(self, shape_uri):
+        """
+        :param shape_uri: The URI of a Node Shape
+        :return: The set of subjects the shape is read from. That is, the shape itself and every blank node, property
+                 shape, node shape and group it references, directly or through the other subjects
+        """
+        followed = [URIRef(SHACL + 'property'), URIRef(SHACL + 'node'), URIRef(SHACL + 'group')]
+        dependencies = set()
+        to_visit = [URIRef(shape_uri)]
+        while to_visit:
+            subject = to_visit.pop()
+            if subject in dependencies:
+                continue
+            dependencies.add(subject)
+            for (p, o) in self.g.predicate_objects(subject):
+                if isinstance(o, BNode) or (isinstance(o, URIRef) and p in followed):
+                    to_visit.append(o)
+        return dependencies
+
+    def get_fingerprint(self, shape_uri, dependencies=None):
+        """
+        A hash of everything the shape is read from, which changes whenever the shape would be read differently.
+        Blank nodes are hashed by their contents, so the fingerprint doesn't depend on the labels given to them by the
+        parser.
+        :param shape_uri: The URI of a Node Shape
+        :param dependencies: The shape's dependencies, if they have already been found with get_dependencies
+        :return: The fingerprint as a hex string
+        """
+        if dependencies is None:
+            dependencies = self.get_dependencies(shape_uri)
+        digests = dict()
+
+        def digest(subject):
+            if subject not in digests:
+                # Guards against blank nodes which reference themselves
+                digests[subject] = ''
+                lines = sorted(p.n3() + ' ' + ('_:' + digest(o) if isinstance(o, BNode) else o.n3())
+                               for (p, o) in self.g.predicate_objects(subject))
+                digests[subject] = hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+            return digests[subject]
+
+        lines = sorted(s.n3() + ' ' + digest(s) for s in dependencies if not isinstance(s, BNode))
+        return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+    def get_groups(self):
+        # Every property group in the graph, as a tuple of URI, label and order. Only read from the graph once
+        if self._groups is None:
+            self._groups = list()
+            for g_uri in self.g.subjects(URIRef(RDF.uri + 'type'), URIRef(SHACL + 'PropertyGroup')):
+                self._groups.append((g_uri,
+                                     self.g.value(g_uri, URIRef(RDFS.uri + 'label'), None),
+                                     self.g.value(g_uri, URIRef(SHACL + 'order'), None)))
+        return self._groups
+
+    def get_shared_property(self, uri):
+        # Property shapes with a URI may be used by many shapes, so they are only read once. Each shape gets its own
+        # copy since the generator modifies them
+        if not isinstance(uri, URIRef):
+            return self.get_property(uri)
+        if uri not in self._properties:
+            self._properties[uri] = self.get_property(uri)
+        return deepcopy(self._properties[uri])
+
     def get_property(self, uri, path_required=True):
-        prop = dict()
-        c_uris = list(self.g.predicate_objects(uri))
+        # A property which holds itself through sh:node would be read forever
+        if uri in self._reading:
+            raise Exception('Recursion not allowed: property ' + uri + ' contains itself through sh:node.')
+        self._reading.add(uri)
+        try:
+            return self.read_property(uri, path_required)
+        finally:
+            self._reading.discard(uri)
 
-        # Link nodes
-        for c_uri in tuple(c_uris):
-            if re.split('[#/]', c_uri[0])[-1] == 'node':
-                c_uris.extend(self.g.predicate_objects(c_uri[1]))
+    def read_property(self, uri, path_required=True):
+        prop = dict()
+        # The constraints of the property, along with those of any nodes linked to it
+        c_uris = self.expand_node(uri)
 
         # Go through each constraint and convert/validate them as necessary
         for c_uri in c_uris:
-            name = re.split('[#/]', c_uri[0])[-1]
+            name = self.constraint_name(c_uri[0])
             value = c_uri[1]
 
             # Get list of values from constraints that supply a list
-            if name in ['in', 'languageIn']:
-                value = [str(l) for l in list(Collection(self.g, value))]
+            # Large sh:in lists are left in the graph, to be read into an option index when the form is generated
+            if name == 'in' and self.option_threshold is not None and \
+                    len(self.get_list(value, self.option_threshold + 1)) > self.option_threshold:
+                name = 'optionSource'
+            elif name in ['in', 'languageIn']:
+                value = [str(l) for l in self.get_list(value)]
             # Convert constraints which must be given as an int
             elif name in ['minCount', 'maxCount']:
                 try:
@@ -175,6 +395,8 @@ class RDFHandler:
             # Consolidate constraints which may be supplied in different ways
             # minInclusive and minExclusive can be simplified down to one attribute
             elif name in ['minInclusive', 'minExclusive', 'maxInclusive', 'maxExclusive']:
+                # The original bound is kept as well, as the simplified one is only right for integers
+                prop[name] = str(value)
                 if name == 'minInclusive':
                     name = 'min'
                     value = float(value)
@@ -261,15 +483,14 @@ class RDFHandler:
             warn(warning)
         return prop
 
-    def add_node(self, root_uri, predicate, obj):
-        # Adds the contents of the node to the root shape
-        # If the node contains a link to another node, use recursion to add nodes at all depths
-        if str(predicate) == SHACL + 'node':
-            for (p, o) in self.g.predicate_objects(obj):
-                self.add_node(root_uri, p, o)
-        self.g.add((root_uri, predicate, obj))
-
     def create_rdf_map(self, shape, destination):
+        self.build_rdf_map(shape).serialize(destination=destination, format='turtle')
+
+    def build_rdf_map(self, shape):
+        """
+        :param shape: A shape prepared for the form by generate_form, so that every property has an ID
+        :return: A Graph holding the RDF map used to convert data submitted to the form into RDF
+        """
         g = Graph()
         g.namespace_manager = self.g.namespace_manager
         g.bind('sh', SHACL)
@@ -281,7 +502,7 @@ class RDFHandler:
                 self.add_property_to_map(g, prop, Literal('placeholder node_uri'))
         for prop in shape['properties']:
             self.add_property_to_map(g, prop, Literal('placeholder node_uri'))
-        g.serialize(destination=destination, format='turtle')
+        return g
 
     def add_property_to_map(self, graph, prop, root):
         # Recursive
@@ -0,0 +1,116 @@
+from rdflib.graph import Graph, ConjunctiveGraph
+from rdflib.term import URIRef
+from rdflib.util import guess_format
+from shaclform.rdfhandling import RDFHandler
+import hashlib
+import pickle
+import os
+
+# Extensions of the files loaded from a directory. Anything else, such as forms generated into the directory, is skipped
+SHAPE_EXTENSIONS = ('.ttl', '.n3', '.nt', '.rdf', '.owl')
+
+
+class ShapeRegistry:
+    """
+    Loads a directory of SHACL Shapes files once and reads shapes from them.
+    Every file is loaded into its own named graph, and shapes are read from the union of all of them, so shapes may
+    reference shapes in other files.
+    Files are identified by a hash of their contents. A file is only parsed if its contents changed since it was last
+    loaded, and if a cache directory is given, parsed files are stored there so they are not parsed again after a
+    restart.
+    """
+    def __init__(self, directory=None, cache_dir=None, ignore_errors=False, exclude=()):
+        """
+        :param directory: A directory of Shapes files to load
+        :param cache_dir: Where parsed files are stored between runs. If not provided, nothing is stored
+        :param ignore_errors: If True, files in the directory which can't be loaded are skipped and recorded in errors
+        :param exclude: Directories inside directory which aren't loaded, e.g. where forms are generated to
+        """
+        self.graph = ConjunctiveGraph()
+        self.cache_dir = cache_dir
+        # Path -> hash of the contents last loaded from that path
+        self.file_hashes = dict()
+        # Path -> error for files which couldn't be loaded
+        self.errors = dict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        if directory:
+            self.load_directory(directory, ignore_errors, exclude)
+
+    def load_directory(self, directory, ignore_errors=False, exclude=()):
+        # Loads every Shapes file in the directory and its subdirectories, apart from the excluded directories
+        exclude = {os.path.abspath(path) for path in exclude if path}
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) not in exclude)
+            for name in sorted(files):
+                if not name.lower().endswith(SHAPE_EXTENSIONS):
+                    continue
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    self.load_file(path)
+                except Exception as e:
+                    if not ignore_errors:
+                        raise
+                    self.errors[path] = e
+
+    def load_file(self, path):
+        """
+        Loads a Shapes file into the registry, replacing anything previously loaded from the same path.
+        :param path: Path of the file
+        :return: True if the file was loaded, False if it was unchanged since it was last loaded
+        """
+        path = os.path.abspath(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        file_hash = hashlib.sha256(data).hexdigest()
+        if self.file_hashes.get(path) == file_hash:
+            return False
+        context = self.graph.get_context(URIRef('file://' + path))
+        context.remove((None, None, None))
+        triples, namespaces = self.read_parsed(path, data, file_hash)
+        context.addN((s, p, o, context) for (s, p, o) in triples)
+        for prefix, namespace in namespaces:
+            self.graph.bind(prefix, namespace)
+        self.file_hashes[path] = file_hash
+        return True
+
+    def read_parsed(self, path, data, file_hash):
+        # Reuse a file already loaded with the same contents, then try the cache directory, and only then parse
+        for other_path, other_hash in self.file_hashes.items():
+            if other_hash == file_hash:
+                other = self.graph.get_context(URIRef('file://' + other_path))
+                return list(other), []
+        cache_file = os.path.join(self.cache_dir, file_hash + '.pickle') if self.cache_dir else None
+        if cache_file and os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        g = Graph()
+        g.parse(data=data.decode('utf-8'), format=guess_format(path), publicID=URIRef('file://' + path))
+        parsed = (list(g), list(g.namespaces()))
+        if cache_file:
+            with open(cache_file, 'wb') as f:
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return parsed
+
+    def get_source_files(self, subjects):
+        """
+        :param subjects: Subjects in the registry's graph
+        :return: The set of paths of the files which contain triples about any of the subjects
+        """
+        paths = set()
+        for subject in subjects:
+            # contexts() only matches whole triples in rdflib's memory store, so the contexts are read from the quads
+            for s, p, o, context in self.graph.quads((subject, None, None)):
+                if str(context.identifier).startswith('file://'):
+                    paths.add(str(context.identifier)[len('file://'):])
+        return paths
+
+    def get_handler(self, indexed=False, option_threshold=None):
+        return RDFHandler(self.graph, indexed=indexed, option_threshold=option_threshold)
+
+    def get_shape(self, shape_uri=None):
+        """
+        :param shape_uri: The URI of the Node Shape to read. If not provided, the root shape is found automatically
+        :return: The shape, as returned by RDFHandler.get_shape
+        """
+        return self.get_handler().get_shape(shape_uri)
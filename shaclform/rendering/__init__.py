@@ -1,5 +1,11 @@
 import os
-from jinja2 import FileSystemLoader, Environment
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+from jinja2 import FileSystemLoader, ModuleLoader, Environment, FileSystemBytecodeCache
+
+TEMPLATE_DIR = os.path.dirname(__file__)
 
 URIs = {
     'NUMBER': [
@@ -23,8 +29,161 @@ URIs = {
 }
 
 
+# Shared by every render so templates are only compiled once per process
+_environment = None
+
+# Number of rendered property fragments kept by each environment
+FRAGMENT_CACHE_SIZE = 1024
+
+# Fragments are rendered with this in place of the property's ID, and the real ID is substituted in when the fragment
+# is used. Nested properties get IDs starting with it, so they are substituted too
+ID_TOKEN = '\x00id\x00'
+
+
+class FragmentCache:
+    """
+    Holds the HTML rendered for properties, keyed by their fingerprint. Once full, the least recently used fragments
+    are dropped. The shared environment's cache is used by every thread rendering forms, so it is locked.
+    """
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self.fragments = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self.fragments.get(key)
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.fragments.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self.fragments[key] = html
+            if len(self.fragments) > self.size:
+                self.fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.fragments.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def create_environment(bytecode_cache_dir=None, compiled_templates=None, fragment_cache_size=FRAGMENT_CACHE_SIZE):
+    """
+    :param bytecode_cache_dir: Where compiled template bytecode is stored so that it survives restarts. Defaults to a
+                               directory in the system's temporary directory
+    :param compiled_templates: A directory of templates precompiled with precompile_templates. If provided, templates
+                               are imported from there instead of being compiled
+    :param fragment_cache_size: The number of rendered properties kept for reuse. If 0, properties are always rendered
+    :return: A Jinja environment for rendering forms
+    """
+    if compiled_templates:
+        env = Environment(loader=ModuleLoader(compiled_templates))
+    else:
+        env = Environment(loader=FileSystemLoader(searchpath=TEMPLATE_DIR),
+                          bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir))
+    env.fragment_cache = FragmentCache(fragment_cache_size) if fragment_cache_size else None
+    env.globals['render_property'] = partial(render_property, env)
+    return env
+
+
+def configure(bytecode_cache_dir=None, compiled_templates=None, fragment_cache_size=FRAGMENT_CACHE_SIZE):
+    # Replaces the shared environment, e.g. to use precompiled templates
+    global _environment
+    _environment = create_environment(bytecode_cache_dir, compiled_templates, fragment_cache_size)
+    return _environment
+
+
+def get_environment():
+    global _environment
+    if _environment is None:
+        _environment = create_environment()
+    return _environment
+
+
+def precompile_templates(destination):
+    """
+    Compiles the form templates into Python modules, which can then be used with configure(compiled_templates=...)
+    :param destination: The directory the modules are written to
+    """
+    os.makedirs(destination, exist_ok=True)
+    env = Environment(loader=FileSystemLoader(searchpath=TEMPLATE_DIR))
+    # Only the templates, not the package's own modules or their bytecode
+    env.compile_templates(destination, extensions=['html'], zip=None)
+
+
+def get_template_fingerprint():
+    # A hash of the template sources, which changes whenever a template is edited
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(TEMPLATE_DIR, name), 'rb') as f:
+                digest.update(name.encode('utf-8') + b'\0' + f.read())
+    return digest.hexdigest()
+
+
 def render_template(form_name, shape):
-    loader = FileSystemLoader(searchpath=os.path.dirname(__file__))
-    env = Environment(loader=loader)
-    template = env.get_template('base.html')
+    template = get_environment().get_template('base.html')
     return template.render(form_name=form_name, shape=shape, URIs=URIs)
+
+
+def stream_template(form_name, shape):
+    # Renders the form in chunks as they are read, instead of building the whole form in memory first
+    template = get_environment().get_template('base.html')
+    return template.generate(form_name=form_name, shape=shape, URIs=URIs)
+
+
+def render_property(env, prop, disabled=False):
+    """
+    Renders a property with property.html. Properties which only differ by ID render the same apart from their IDs, so
+    each is rendered once with a placeholder ID and the real ID is substituted in every time it is used. This means
+    property shapes shared between shapes, or used many times in one shape, are only rendered once.
+    :param env: The environment to render with
+    :param prop: The property, with IDs assigned by generate_form
+    :param disabled: Whether the property's inputs are disabled
+    :return: The HTML of the property
+    """
+    template = env.get_template('property.html')
+    cache = env.fragment_cache
+    if cache is None or 'id' not in prop:
+        return template.render(property=prop, disabled=disabled, URIs=URIs)
+    key = (property_fingerprint(prop), bool(disabled))
+    html = cache.get(key)
+    if html is None:
+        html = template.render(property=with_id_token(prop), disabled=disabled, URIs=URIs)
+        cache.put(key, html)
+    return html.replace(ID_TOKEN, str(prop['id']))
+
+
+def property_fingerprint(prop):
+    # A hash of everything the property is rendered from except its ID. Nested properties keep the last part of their
+    # ID, since that is all they are given when the property is rendered with ID_TOKEN
+    def normalise(p, nested):
+        items = list()
+        for name, value in p.items():
+            if name == 'id':
+                if nested:
+                    items.append((name, str(value).rsplit(':', 1)[-1]))
+            elif name == 'property':
+                items.append((name, tuple(normalise(c, True) for c in value)))
+            else:
+                items.append((name, repr(value)))
+        return tuple(sorted(items))
+
+    return hashlib.sha1(repr(normalise(prop, False)).encode('utf-8')).hexdigest()
+
+
+def with_id_token(prop, prop_id=ID_TOKEN):
+    # A copy of the property with ID_TOKEN in place of its ID, as the start of the IDs of its nested properties
+    copy = dict(prop.items())
+    copy['id'] = prop_id
+    if 'property' in prop:
+        copy['property'] = [with_id_token(p, prop_id + ':' + str(p['id']).rsplit(':', 1)[-1]) for p in prop['property']]
+    return copy
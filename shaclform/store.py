@@ -0,0 +1,173 @@
+from rdflib import ConjunctiveGraph
+from rdflib.plugin import PluginException
+from rdflib.term import URIRef
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import asyncio
+import json
+import os
+
+# The number of submissions added to the store between commits
+COMMIT_SIZE = 1000
+
+# Identifies checkpoint files. The version changes whenever the layout of the JSON changes
+CHECKPOINT_FORMAT = 'shaclform-checkpoint'
+CHECKPOINT_VERSION = 1
+
+
+class StoreSink:
+    """
+    Writes converted submissions straight into an rdflib store, each submission in a named graph of its own named
+    after its root node. Submissions are committed in batches, and after each commit the number of submissions loaded
+    so far is saved to a checkpoint file, so an interrupted backfill can carry on from the last commit.
+
+    Any context aware rdflib store can be used. Stores kept on disk and runnable locally include:
+        StoreSink('Sleepycat', '/data/store')  # BerkeleyDB, needs bsddb3
+        StoreSink('SQLAlchemy', 'sqlite:////data/store.db')  # SQLite, needs rdflib-sqlalchemy
+    Can be used with load_submissions, or as the sink of an AsyncFormConverter. An AsyncFormConverter finishes
+    submissions out of order, so a count of them can't be used as a checkpoint. Instead, submissions already in the
+    store are found with contains.
+    """
+    def __init__(self, store='Sleepycat', configuration=None, identifier=None, commit_size=COMMIT_SIZE,
+                 checkpoint=None):
+        """
+        :param store: The name of the rdflib store plugin, or a Store
+        :param configuration: Passed to the store's open, e.g. the path of a Sleepycat store or the URL of a database.
+                              The store is created if it doesn't exist. If None, the store isn't opened
+        :param identifier: The identifier of the ConjunctiveGraph holding the named graphs
+        :param commit_size: The number of submissions added between commits
+        :param checkpoint: The path of a file recording how many submissions have been committed. If it exists, loading
+                           carries on from there. Only for use with load_submissions, which loads submissions in order
+        """
+        try:
+            self.graph = ConjunctiveGraph(store=store, identifier=identifier)
+        except (PluginException, ImportError):
+            raise ValueError('rdflib store "' + str(store) + '" is not available. Sleepycat needs bsddb3 and '
+                             'SQLAlchemy needs rdflib-sqlalchemy to be installed.')
+        if configuration is not None:
+            self.graph.open(configuration, create=True)
+        self.configuration = configuration
+        self.commit_size = commit_size
+        self.checkpoint = checkpoint
+        # The number of submissions loaded, including those loaded before the checkpoint was saved
+        self.position = read_checkpoint(checkpoint) if checkpoint else 0
+        self.pending = 0
+        # Submissions written from asyncio are added to the store by a thread of their own, one at a time
+        self._executor = None
+        self._lock = None
+
+    def add_submission(self, root_node, triples):
+        """
+        Adds a submission to a named graph of its own, committing if a batch is complete
+        :param root_node: The root node of the submission, which names its graph
+        :param triples: The triples converted from the submission
+        :return:
+        """
+        context = self.graph.get_context(root_node)
+        self.graph.addN((s, p, o, context) for (s, p, o) in triples)
+        self.position += 1
+        self.pending += 1
+        if self.pending >= self.commit_size:
+            self.commit()
+
+    async def write(self, root_node, triples):
+        # Lets the sink be used by AsyncFormConverter. Adding a submission, and committing a batch, is done in a thread
+        # so the event loop isn't blocked, and only one submission is added at a time
+        if self.checkpoint:
+            raise ValueError('A checkpoint counts submissions in the order they are loaded, which AsyncFormConverter '
+                             'doesn\'t keep. Use contains to find the submissions already stored instead.')
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.add_submission, root_node, triples)
+
+    def contains(self, root_node):
+        """
+        :param root_node: The root node of a submission
+        :return: Whether the submission is in the store. After a restart, only submissions which were committed are
+        """
+        context = self.graph.get_context(URIRef(root_node))
+        return next(iter(context.triples((None, None, None))), None) is not None
+
+    def commit(self):
+        # Commits the submissions added since the last commit, then records them in the checkpoint
+        self.graph.commit()
+        if self.checkpoint:
+            write_checkpoint(self.checkpoint, self.position)
+        self.pending = 0
+
+    def rollback(self):
+        # Discards the submissions added since the last commit, if the store supports transactions
+        self.graph.rollback()
+        self.position -= self.pending
+        self.pending = 0
+
+    def close(self):
+        # Commits anything still pending and closes the store
+        self._stop_executor()
+        if self.pending:
+            self.commit()
+        if self.configuration is not None:
+            self.graph.close(commit_pending_transaction=True)
+
+    def _stop_executor(self):
+        # Waits for the submissions being added from asyncio
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Only what was committed is kept, so the checkpoint matches the store
+            self._stop_executor()
+            self.rollback()
+            if self.configuration is not None:
+                self.graph.close()
+
+
+def read_checkpoint(path):
+    # The number of submissions recorded in a checkpoint file, or 0 if there isn't one yet
+    if not os.path.isfile(path):
+        return 0
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or data.get('format') != CHECKPOINT_FORMAT:
+        raise ValueError('Not a checkpoint: ' + str(path))
+    if data.get('version') != CHECKPOINT_VERSION:
+        raise ValueError('Checkpoint ' + str(path) + ' has version ' + str(data.get('version')) + ', expected ' +
+                         str(CHECKPOINT_VERSION))
+    return data['position']
+
+
+def write_checkpoint(path, position):
+    # Written to a temporary file and moved into place, so a checkpoint is never left half written
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'format': CHECKPOINT_FORMAT, 'version': CHECKPOINT_VERSION, 'position': position}, f)
+    os.replace(temp_path, path)
+
+
+def load_submissions(converter, form_inputs, sink):
+    """
+    Converts submissions straight into a store, without building a graph for each one. If the sink has a checkpoint,
+    submissions loaded by an earlier run are skipped, so form_inputs must give the submissions in the same order each
+    time. Submissions added after the last commit of an interrupted run are converted again; use a converter with a
+    node_factory giving the same root node each time so they land in the same named graph.
+    :param converter: The FormConverter for the form
+    :param form_inputs: An iterable of submitted form data. Each item maps input names to values, like request.form
+    :param sink: The StoreSink the submissions are written to. It is committed, but not closed, once every submission
+                 is loaded
+    :return: The number of submissions loaded by this call
+    """
+    start = sink.position
+    for root_node, triples in converter.iter_convert(islice(form_inputs, start, None)):
+        sink.add_submission(root_node, triples)
+    sink.commit()
+    return sink.position - start
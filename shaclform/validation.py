@@ -0,0 +1,349 @@
+from rdflib import XSD
+from rdflib.term import Literal, URIRef, BNode
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+import datetime
+import re
+
+# Constraints checked on the server, by their SHACL name. Pair constraints hold the ID of the property they compare to
+TABLE_CONSTRAINTS = ['minCount', 'maxCount', 'datatype', 'pattern', 'flags', 'in', 'minInclusive', 'minExclusive',
+                     'maxInclusive', 'maxExclusive', 'minLength', 'maxLength', 'equals', 'disjoint', 'lessThan',
+                     'lessThanOrEquals']
+PAIR_CONSTRAINTS = ['equals', 'disjoint', 'lessThan', 'lessThanOrEquals']
+# Bounds on values, and whether a value equal to the bound is allowed
+RANGE_CONSTRAINTS = {'minInclusive': True, 'minExclusive': False, 'maxInclusive': True, 'maxExclusive': False}
+
+# SHACL regular expression flags and their Python equivalents
+REGEX_FLAGS = {'i': re.IGNORECASE, 's': re.DOTALL, 'm': re.MULTILINE, 'x': re.VERBOSE}
+
+# A constraint a submission doesn't meet. focus_node is the node the property was entered for, and value is the
+# offending value, or None if the constraint applies to all of the property's values
+Violation = namedtuple('Violation', ['property_id', 'name', 'constraint', 'focus_node', 'value', 'message'])
+
+
+class ValidationError(ValueError):
+    """
+    Raised when a submission doesn't meet the constraints of its shape. Holds every Violation found.
+    """
+    def __init__(self, violations):
+        self.violations = list(violations)
+        messages = [v.message for v in self.violations[:3]]
+        if len(self.violations) > 3:
+            messages.append('and ' + str(len(self.violations) - 3) + ' more')
+        super().__init__('Submission does not conform to the shape: ' + '; '.join(messages))
+
+    def __reduce__(self):
+        # So the error can be sent back from a worker process with its violations
+        return type(self), (self.violations,)
+
+
+def build_validation_table(shape, option_indexes=None):
+    """
+    Flattens the constraints of a prepared shape into a table which can be stored with its compiled map.
+    Properties with no constraints are left out, unless they contain properties which have some, or a pair constraint
+    refers to them.
+    :param shape: A shape prepared by generate_form, so that every property has an ID and pair constraints hold IDs
+    :param option_indexes: The option indexes of the sh:in lists moved out of the form, by key. Their options are put
+                           in the table, so they are still checked
+    :return: A list of rows, one for each property, parents before the properties nested in them. Each row is a list of
+             the property ID, the ID of the property it is nested in or None, the property's name, and a dict of its
+             constraints
+    """
+    rows = list()
+    # The IDs of the properties pair constraints refer to, which are kept so their values can be compared
+    pair_targets = set()
+
+    def find_pair_targets(prop):
+        for name in PAIR_CONSTRAINTS:
+            if name in prop:
+                pair_targets.add(str(prop[name]))
+        for p in prop.get('property', ()):
+            find_pair_targets(p)
+
+    def add_property(prop, parent_id):
+        constraints = dict()
+        for name in TABLE_CONSTRAINTS:
+            if name not in prop:
+                continue
+            value = prop[name]
+            if name in ['minCount', 'maxCount', 'minLength', 'maxLength']:
+                value = int(value)
+            elif name == 'in':
+                value = list(value)
+            else:
+                value = str(value)
+            constraints[name] = value
+        if 'in' not in constraints and option_indexes and prop.get('optionIndex') in option_indexes:
+            constraints['in'] = list(option_indexes[prop['optionIndex']].options)
+        property_id = str(prop['id'])
+        position = len(rows)
+        rows.append([property_id, parent_id, str(prop.get('name', prop.get('path'))), constraints])
+        for p in prop.get('property', ()):
+            add_property(p, property_id)
+        # Nothing to check here or in any nested property
+        if not constraints and len(rows) == position + 1 and property_id not in pair_targets:
+            rows.pop()
+
+    properties = [prop for g in shape['groups'] for prop in g['properties']] + list(shape['properties'])
+    for prop in properties:
+        find_pair_targets(prop)
+    for prop in properties:
+        add_property(prop, None)
+    return rows
+
+
+# Lexical forms of the XSD datatypes which are checked
+INTEGER = re.compile(r'[+-]?\d+$')
+DECIMAL = re.compile(r'[+-]?(\d+(\.\d*)?|\.\d+)$')
+DOUBLE = re.compile(r'([+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?|[+-]?INF|NaN)$')
+DATE = re.compile(r'(\d{4}-\d{2}-\d{2})(Z|[+-]\d{2}:\d{2})?$')
+DATE_TIME = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?$')
+
+
+def parse_boolean(text):
+    if text in ('true', '1'):
+        return True
+    if text in ('false', '0'):
+        return False
+    raise ValueError(text)
+
+
+def parse_date(text):
+    # Any timezone is ignored
+    m = DATE.match(text)
+    if m is None:
+        raise ValueError(text)
+    return datetime.date.fromisoformat(m.group(1))
+
+
+def parse_date_time(text):
+    if not DATE_TIME.match(text):
+        raise ValueError(text)
+    return datetime.datetime.fromisoformat(text[:-1] + '+00:00' if text.endswith('Z') else text)
+
+
+def parse_decimal(text):
+    if not DECIMAL.match(text):
+        raise ValueError(text)
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        raise ValueError(text)
+
+
+def parse_integer(text):
+    if not INTEGER.match(text):
+        raise ValueError(text)
+    return int(text)
+
+
+def parse_double(text):
+    if not DOUBLE.match(text):
+        raise ValueError(text)
+    return float(text)
+
+
+# Reads the lexical form of a literal of each datatype into a Python value which can be compared with others. Raises
+# ValueError if the lexical form isn't valid for the datatype. Datatypes not listed here aren't checked
+DATATYPE_PARSERS = {
+    XSD.string: str,
+    XSD.boolean: parse_boolean,
+    XSD.integer: parse_integer,
+    XSD.int: parse_integer,
+    XSD.long: parse_integer,
+    XSD.short: parse_integer,
+    XSD.byte: parse_integer,
+    XSD.nonNegativeInteger: parse_integer,
+    XSD.positiveInteger: parse_integer,
+    XSD.negativeInteger: parse_integer,
+    XSD.nonPositiveInteger: parse_integer,
+    XSD.decimal: parse_decimal,
+    XSD.float: parse_double,
+    XSD.double: parse_double,
+    XSD.date: parse_date,
+    XSD.dateTime: parse_date_time,
+}
+
+
+class PropertyCheck:
+    """
+    One row of a validation table, compiled for checking: regular expressions are compiled, in lists are made into
+    sets, and the datatype is resolved to the function that reads and compares its values.
+    """
+    __slots__ = ('property_id', 'parent_id', 'name', 'min_count', 'max_count', 'datatype', 'parse', 'pattern',
+                 'options', 'bounds', 'min_length', 'max_length', 'pairs', 'checks_values')
+
+    def __init__(self, property_id, parent_id, name, constraints):
+        self.property_id = property_id
+        self.parent_id = parent_id
+        self.name = name
+        self.min_count = constraints.get('minCount')
+        self.max_count = constraints.get('maxCount')
+        self.datatype = constraints.get('datatype')
+        self.parse = DATATYPE_PARSERS.get(URIRef(self.datatype)) if self.datatype else None
+        self.pattern = None
+        if 'pattern' in constraints:
+            flags = 0
+            for flag in constraints.get('flags', ''):
+                flags |= REGEX_FLAGS.get(flag, 0)
+            self.pattern = re.compile(constraints['pattern'], flags)
+        self.options = frozenset(constraints['in']) if 'in' in constraints else None
+        # Each range constraint with its bound, read as the values are
+        self.bounds = tuple((name, self.read_bound(constraints[name])) for name in RANGE_CONSTRAINTS
+                            if name in constraints)
+        self.min_length = constraints.get('minLength')
+        self.max_length = constraints.get('maxLength')
+        self.pairs = tuple((name, constraints[name]) for name in PAIR_CONSTRAINTS if name in constraints)
+        # Whether there is anything to check for each value
+        self.checks_values = bool(self.bounds) or any(c is not None for c in [self.datatype, self.pattern, self.options,
+                                                                               self.min_length, self.max_length])
+
+    def read_bound(self, text):
+        bound = self.key(Literal(text))
+        if bound is None:
+            # e.g. a decimal bound on integer values
+            bound = parse_double(text)
+        return bound
+
+    def key(self, value):
+        # The value as something it can be compared with, or None if it can't be read
+        if self.parse is not None:
+            try:
+                return self.parse(str(value))
+            except ValueError:
+                return None
+        if isinstance(value, Literal):
+            try:
+                return parse_double(str(value))
+            except ValueError:
+                pass
+        return str(value)
+
+    def check_value(self, focus_node, value, violations):
+        text = str(value)
+        if self.datatype is not None:
+            if not isinstance(value, Literal) or (self.parse is not None and self.key(value) is None):
+                self.add(violations, 'datatype', focus_node, value, 'is not a valid ' + self.datatype)
+        if self.pattern is not None and not self.pattern.search(text):
+            self.add(violations, 'pattern', focus_node, value, 'does not match ' + self.pattern.pattern)
+        if self.options is not None and text not in self.options:
+            self.add(violations, 'in', focus_node, value, 'is not one of the allowed values')
+        if self.min_length is not None and len(text) < self.min_length:
+            self.add(violations, 'minLength', focus_node, value, 'is shorter than ' + str(self.min_length))
+        if self.max_length is not None and len(text) > self.max_length:
+            self.add(violations, 'maxLength', focus_node, value, 'is longer than ' + str(self.max_length))
+        if self.bounds:
+            key = self.key(value)
+            for name, bound in self.bounds:
+                inclusive = RANGE_CONSTRAINTS[name]
+                if name.startswith('min'):
+                    if not compare(bound, key, 'lessThanOrEquals' if inclusive else 'lessThan'):
+                        self.add(violations, name, focus_node, value,
+                                 'is not ' + ('at least ' if inclusive else 'greater than ') + str(bound))
+                elif not compare(key, bound, 'lessThanOrEquals' if inclusive else 'lessThan'):
+                    self.add(violations, name, focus_node, value,
+                             'is not ' + ('at most ' if inclusive else 'less than ') + str(bound))
+
+    def add(self, violations, constraint, focus_node, value, message):
+        subject = 'Property "' + self.name + '"' if value is None else \
+            'Value "' + str(value) + '" of property "' + self.name + '"'
+        violations.append(Violation(self.property_id, self.name, constraint, focus_node, value,
+                                    subject + ' ' + message))
+
+
+class Validator:
+    """
+    Checks converted submissions against a validation table built by build_validation_table. Compiled once per map,
+    and holds nothing about the submissions it checks, so it can be shared between threads.
+    Pair constraints compare the values of two properties on the same focus node, so each entry of a nested property
+    is compared on its own. Where the other property is nested elsewhere, e.g. a top level property referred to from a
+    nested one, its values are taken from the nearest node above the focus node that it is entered for.
+    """
+    def __init__(self, table):
+        self.checks = tuple(PropertyCheck(*row) for row in table)
+        self.checks_by_id = {c.property_id: c for c in self.checks}
+        self.has_pairs = any(c.pairs for c in self.checks)
+
+    def validate(self, root_node, values):
+        """
+        :param root_node: The root node of the submission
+        :param values: The values converted for each property, by (subject, property ID), as collected by FormConverter
+        :return: A list of every Violation found. Empty if the submission conforms
+        """
+        violations = list()
+        # The nodes the properties of each property are checked on. Top level properties are checked on the root node
+        focus_nodes = {None: (root_node,)}
+        for check in self.checks:
+            nodes = list()
+            for focus_node in focus_nodes.get(check.parent_id, ()):
+                property_values = values.get((focus_node, check.property_id), ())
+                count = len(property_values)
+                if check.min_count is not None and count < check.min_count:
+                    check.add(violations, 'minCount', focus_node, None,
+                              'has fewer than ' + str(check.min_count) + ' values')
+                if check.max_count is not None and count > check.max_count:
+                    check.add(violations, 'maxCount', focus_node, None,
+                              'has more than ' + str(check.max_count) + ' values')
+                for value in property_values:
+                    if check.checks_values:
+                        check.check_value(focus_node, value, violations)
+                    if isinstance(value, BNode):
+                        nodes.append(value)
+            focus_nodes[check.property_id] = nodes
+        if self.has_pairs:
+            self.check_pairs(values, focus_nodes, violations)
+        return violations
+
+    def check_pairs(self, values, focus_nodes, violations):
+        # The node each blank node was entered under
+        parents = dict()
+        for (subject, property_id), property_values in values.items():
+            for value in property_values:
+                if isinstance(value, BNode):
+                    parents[value] = subject
+        for check in self.checks:
+            for constraint, other_id in check.pairs:
+                other_check = self.checks_by_id.get(other_id)
+                if other_check is None:
+                    # The pair constraint didn't match a property when the form was generated
+                    continue
+                other_nodes = set(focus_nodes.get(other_check.parent_id, ()))
+                # Values of a property without a datatype are read as this property's values are
+                reader = other_check if other_check.parse is not None else check
+                for focus_node in focus_nodes.get(check.parent_id, ()):
+                    node = focus_node
+                    while node is not None and node not in other_nodes:
+                        node = parents.get(node)
+                    if node is None:
+                        continue
+                    own = values.get((focus_node, check.property_id), ())
+                    other = values.get((node, other_id), ())
+                    self.check_pair(check, constraint, other_check, reader, focus_node, own, other, violations)
+
+    @staticmethod
+    def check_pair(check, constraint, other_check, reader, focus_node, own, other, violations):
+        other_name = other_check.name
+        if constraint == 'equals':
+            if set(map(str, own)) != set(map(str, other)):
+                check.add(violations, 'equals', focus_node, None, 'does not equal "' + other_name + '"')
+        elif constraint == 'disjoint':
+            for value in set(map(str, own)) & set(map(str, other)):
+                check.add(violations, 'disjoint', focus_node, value, 'is also a value of "' + other_name + '"')
+        else:
+            other_keys = [reader.key(o) for o in other]
+            for value in own:
+                key = check.key(value)
+                if not all(compare(key, other_key, constraint) for other_key in other_keys):
+                    check.add(violations, constraint, focus_node, value,
+                              'is not ' + ('less than' if constraint == 'lessThan' else 'less than or equal to') +
+                              ' "' + other_name + '"')
+
+
+def compare(key, other_key, constraint):
+    # Values which can't be read or compared with each other fail the comparison
+    if key is None or other_key is None:
+        return False
+    try:
+        return key < other_key if constraint == 'lessThan' else key <= other_key
+    except TypeError:
+        return False
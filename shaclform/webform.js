@@ -20,73 +20,102 @@ jQuery.fn.setValue = function(value) {
     return this
 }
 
+// The fields of each property, by property ID, and the fields with a pair constraint on each property. Kept up to date
+// as entries are added and removed, so that pair constraints don't have to search the whole form for the fields they
+// compare with
+var fieldsByProperty = {};
+var dependentsByProperty = {};
+var pairConstraints = ['data-equalTo', 'data-notEqualTo', 'lessThan', 'data-lessThanEqual'];
+
+// Adds every field in the elements, including the elements themselves, to the index
+var indexFields = function(elements) {
+    $(elements).find('[data-property-id]').addBack('[data-property-id]').each(function() {
+        var id = $(this).attr('data-property-id');
+        (fieldsByProperty[id] = fieldsByProperty[id] || []).push(this);
+        for (var i = 0; i < pairConstraints.length; i++) {
+            var target = $(this).attr(pairConstraints[i]);
+            if (target !== undefined)
+                (dependentsByProperty[target] = dependentsByProperty[target] || []).push(this);
+        }
+    });
+};
+
+// Removes every field in the elements, including the elements themselves, from the index
+var unindexFields = function(elements) {
+    var remove = function(index, key, field) {
+        if (index[key] === undefined) return;
+        var position = index[key].indexOf(field);
+        if (position != -1) index[key].splice(position, 1);
+    };
+    $(elements).find('[data-property-id]').addBack('[data-property-id]').each(function() {
+        remove(fieldsByProperty, $(this).attr('data-property-id'), this);
+        for (var i = 0; i < pairConstraints.length; i++) {
+            var target = $(this).attr(pairConstraints[i]);
+            if (target !== undefined)
+                remove(dependentsByProperty, target, this);
+        }
+    });
+};
+
+// The first field of a property which isn't disabled, or an empty selection if there isn't one
+var getField = function(id) {
+    var fields = fieldsByProperty[id] || [];
+    for (var i = 0; i < fields.length; i++) {
+        if (!fields[i].disabled) return $(fields[i]);
+    }
+    return $();
+};
+
+// Compares a field with the field of the property its pair constraint refers to. Passes if there is no such field
+var checkPair = function(element, id, compare) {
+    var object = getField(id);
+    if (object.length == 0) return true;
+    return compare($(element).getValue(), object.getValue());
+};
+
+// Describes the property a pair constraint refers to in its error message
+var pairMessage = function(message, id) {
+    var object = getField(id);
+    var label = object.length ? object.attr('data-label') : $((fieldsByProperty[id] || [])[0]).attr('data-label');
+    return $.validator.format(message + ' {0} ({1})', label, object.getValue());
+};
+
 //Custom rules that can be used with any input type
 $.validator.addMethod('data-equalTo', function(value, element, params) {
-    var subject_value;
-    var object_value;
-    var object = $('[data-property-id=' + params + ']:not([disabled])');
-    if (object.length == 0) return true;
-    subject_value = $(element).getValue();
-    object_value = $(object).getValue();
-    if ($(element).attr('type') == 'checkbox')
-        return subject_value == object_value;
-    else
-        return this.optional(element) || subject_value == object_value;
+    var optional = $(element).attr('type') != 'checkbox' && this.optional(element);
+    return checkPair(element, params, function(subject_value, object_value) {
+        return optional || subject_value == object_value;
+    });
 }, function(params, element) {
-    return $.validator.format(
-        'Must be equal to {0} ({1})',
-        $('[data-property-id=' + $(element).attr('data-equalTo') + ']').attr('data-label'),
-        $('[data-property-id=' + $(element).attr('data-equalTo') + ']').getValue()
-    );
+    return pairMessage('Must be equal to', params);
 });
 $.validator.addMethod('data-notEqualTo', function(value, element, params) {
-    var subject_value;
-    var object_value;
-    var object = $('[data-property-id=' + params + ']:not([disabled])');
-    if (object.length == 0) return true;
-    subject_value = $(element).getValue();
-    object_value = $(object).getValue();
-    return this.optional(element) || subject_value != object_value;
+    var optional = this.optional(element);
+    return checkPair(element, params, function(subject_value, object_value) {
+        return optional || subject_value != object_value;
+    });
 }, function(params, element) {
-    return $.validator.format(
-        'Must not be equal to {0} ({1})',
-        $('[data-property-id=' + $(element).attr('data-notEqualTo') + ']').attr('data-label'),
-        $('[data-property-id=' + $(element).attr('data-notEqualTo') + ']').getValue()
-    );
+    return pairMessage('Must not be equal to', params);
 });
 $.validator.addMethod('lessThan', function(value, element, params) {
-    var subject_value;
-    var object_value;
-    var object = $('[data-property-id=' + params + ']:not([disabled])');
-    if (object.length == 0) return true;
-    subject_value = $(element).getValue();
-    object_value = $(object).getValue();
-    return this.optional(element) || subject_value < object_value;
+    var optional = this.optional(element);
+    return checkPair(element, params, function(subject_value, object_value) {
+        return optional || subject_value < object_value;
+    });
 }, function(params, element) {
-    return $.validator.format(
-        'Must be less than {0} ({1})',
-        $('[data-property-id=' + $(element).attr('lessThan') + ']').attr('data-label'),
-        $('[data-property-id=' + $(element).attr('lessThan') + ']').getValue()
-    );
+    return pairMessage('Must be less than', params);
 });
 $.validator.addMethod('data-lessThanEqual', function(value, element, params) {
-    var subject_value;
-    var object_value;
-    var object = $('[data-property-id=' + params + ']:not([disabled])');
-    if (object.length == 0) return true;
-    subject_value = $(element).getValue();
-    object_value = $(object).getValue();
-    return this.optional(element) || subject_value <= object_value;
+    var optional = this.optional(element);
+    return checkPair(element, params, function(subject_value, object_value) {
+        return optional || subject_value <= object_value;
+    });
 }, function(params, element) {
-    return $.validator.format(
-        'Must be less than or equal to {0} ({1})',
-        $('[data-property-id=' + $(element).attr('data-lessThanEqual') + ']').attr('data-label'),
-        $('[data-property-id=' + $(element).attr('data-lessThanEqual') + ']').getValue()
-    );
+    return pairMessage('Must be less than or equal to', params);
 } );
 
 // Used to automatically add custom rules to relevant elements. Disabled fields are not validated
-$('#shacl-form').validate({
+var validator = $('#shacl-form').validate({
     ignore: '[disabled]',
     'data-equalTo': '[data-equalTo]',
     'data-notEqualTo': '[data-notEqualTo]',
@@ -100,6 +129,19 @@ $('#shacl-form').validate({
     }
 });
 
+// The templates are indexed once. Entries are indexed as they are added
+indexFields($('#shacl-form'));
+
+// When a field changes, only the fields with a pair constraint on its property are validated again. Empty fields are
+// left until the user gets to them
+$('#shacl-form').on('input change', '[data-property-id]', function() {
+    var dependents = dependentsByProperty[$(this).attr('data-property-id')] || [];
+    for (var i = 0; i < dependents.length; i++) {
+        if (dependents[i] !== this && !dependents[i].disabled && $(dependents[i]).val() !== '')
+            validator.element(dependents[i]);
+    }
+});
+
 //Apply pattern constraint to input field
 var addPatternConstraint = function(element){
     var message = 'Must match pattern: /' +  $(element).attr('data-pattern') + '/'
@@ -111,6 +153,31 @@ var addPatternConstraint = function(element){
     });
 }
 
+// Properties with large sh:in lists don't include their options in the form. Instead, options starting with what has
+// been typed are fetched from the option index as the user types, and shown in the field's datalist. Each field is
+// given its own datalist the first time it is used, so its ID is unique however many entries and properties share the
+// same options
+var optionLists = 0;
+$('#shacl-form').on('input focus', '[data-options-url]', function() {
+    if (!$(this).attr('list')) {
+        var id = 'shacl-form-options-' + optionLists++;
+        $('<datalist>').attr('id', id).appendTo('#shacl-form');
+        $(this).attr('list', id);
+    }
+    var list = $(document.getElementById($(this).attr('list')));
+    var prefix = $(this).val();
+    if (list.attr('data-prefix') === prefix) return;
+    list.attr('data-prefix', prefix);
+    $.getJSON($(this).attr('data-options-url'), { q: prefix, limit: 50 }, function(result) {
+        // Ignore responses to earlier requests which arrive late
+        if (list.attr('data-prefix') !== prefix) return;
+        list.empty();
+        $.each(result.options, function(i, option) {
+            $('<option>').attr('value', option).appendTo(list);
+        });
+    });
+});
+
 // Adds and removes entries when buttons are clicked
 $('body').on('click', '.add-entry', function() {
     addEntry($(this).parent().children('.template').first())
@@ -175,6 +242,7 @@ var addEntry = function(template, prefill_value, prefill_nodeKind) {
 
     // Append our prepared copy of the template to the entries
     var last_entry = entries.append(template_copy.html());
+    indexFields(entries.children().slice(num_entries));
     num_entries++;
 
     // Apply prefill value if applicable
@@ -216,6 +284,7 @@ var removeEntry = function($template){
     // Removing a property means that the Add button can be enabled again
     $template.parent().children('.add-entry').removeAttr('disabled');
     // Remove the last entry
+    unindexFields(entries.children().last());
     entries.children().last().remove();
     num_entries--;
     // Disable Remove button if we reach the minimum number of entries
@@ -0,0 +1,155 @@
+import asyncio
+import io
+import time
+import weakref
+import pytest
+from rdflib import Graph, RDF, XSD
+from rdflib.term import Literal, URIRef
+from async_convert import AsyncFormConverter, FileSink, QueueSink, GraphSink
+from shaclform.form2rdf import load_map
+
+SCHEMA = 'http://schema.org/'
+EX = 'http://example.org/ex#'
+MAP = 'inputs/conversion/person_map.ttl'
+
+
+def name_node(form):
+    # Defined at the top level so it can be sent to worker processes
+    return EX + form['0-0']
+
+
+def test_convert():
+    async def run():
+        async with AsyncFormConverter(MAP, base_uri=EX, workers=2) as converter:
+            return await asyncio.gather(*(converter.convert({'0-0': 'Person' + str(i)}) for i in range(20)))
+
+    results = asyncio.run(run())
+    assert len(results) == 20
+    for i, result in enumerate(results):
+        assert Literal('Person' + str(i), datatype=XSD.string) in result.objects(None, URIRef(SCHEMA + 'givenName'))
+        assert len(list(result.subjects(RDF.type, URIRef(SCHEMA + 'Person')))) == 1
+
+
+def test_process_pool():
+    async def run():
+        async with AsyncFormConverter(load_map(MAP), node_factory=name_node, executor='process',
+                                      workers=2) as converter:
+            return await converter.convert({'0-0': 'Steve'})
+
+    result = asyncio.run(run())
+    assert (URIRef(EX + 'Steve'), URIRef(SCHEMA + 'givenName'), Literal('Steve', datatype=XSD.string)) in result
+
+
+def test_backpressure():
+    # Submitting waits while the queue is full
+    async def run():
+        slow_sink = QueueSink(asyncio.Queue(maxsize=1))
+        converter = AsyncFormConverter(MAP, base_uri=EX, workers=1, queue_size=1, sink=slow_sink)
+        await converter.start()
+        await converter.submit({'0-0': 'a'})
+        await converter.submit({'0-0': 'b'})
+        # The worker is stuck writing b to the full sink, and c fills the queue
+        await converter.submit({'0-0': 'c'})
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(converter.submit({'0-0': 'd'}), 0.2)
+        names = list()
+        while len(names) < 3:
+            root_node, triples = await slow_sink.queue.get()
+            names.extend(str(o) for (s, p, o) in triples if p == URIRef(SCHEMA + 'givenName'))
+        await converter.close()
+        return names
+
+    assert asyncio.run(run()) == ['a', 'b', 'c']
+
+
+def test_timeout():
+    def slow_node(form):
+        time.sleep(0.5)
+        return EX + 'slow'
+
+    async def run():
+        async with AsyncFormConverter(MAP, node_factory=slow_node, workers=1, timeout=0.05) as converter:
+            with pytest.raises(asyncio.TimeoutError):
+                await converter.convert({'0-0': 'Steve'})
+            # Other tasks on the loop keep running while the conversion is under way
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 0.3
+
+
+def test_sinks():
+    stream = io.StringIO()
+    graph_sink = GraphSink(named_graphs=True)
+
+    async def run():
+        async with AsyncFormConverter(MAP, node_factory=name_node, sink=FileSink(stream)) as converter:
+            await converter.convert_many([{'0-0': 'Steve'}, {'0-0': 'Terrence'}])
+        async with AsyncFormConverter(MAP, node_factory=name_node, sink=graph_sink) as converter:
+            return await converter.convert_many([{'0-0': 'Steve'}, {'0-0': 'Terrence'}])
+
+    root_nodes = asyncio.run(run())
+    assert root_nodes == [URIRef(EX + 'Steve'), URIRef(EX + 'Terrence')]
+    result = Graph()
+    result.parse(data=stream.getvalue(), format='nt')
+    assert len(result) == 4
+    assert len(graph_sink.graph.get_context(URIRef(EX + 'Terrence'))) == 2
+
+
+def test_convert_many_drops_triples():
+    # Only the root nodes of finished submissions are kept, not their triples
+    class RecordingSink:
+        def __init__(self):
+            self.triples = list()
+
+        async def write(self, root_node, triples):
+            self.triples.append(weakref.ref(triples))
+
+        async def close(self):
+            pass
+
+    sink = RecordingSink()
+    alive = list()
+
+    async def form_inputs():
+        for i in range(50):
+            yield {'0-0': 'Person' + str(i)}
+        await asyncio.sleep(0.1)
+        alive.append(sum(1 for ref in sink.triples if ref() is not None))
+
+    async def run():
+        async with AsyncFormConverter(MAP, base_uri=EX, workers=2, sink=sink) as converter:
+            return await converter.convert_many(form_inputs())
+
+    assert len(asyncio.run(run())) == 50
+    assert len(sink.triples) == 50
+    # Each worker may still hold the last result it handled
+    assert alive[0] <= 2
+
+
+def test_file_sink_writes_one_at_a_time():
+    class SlowStream(io.StringIO):
+        # Records whether a write started while another was still going
+        writing = False
+        overlapped = False
+
+        def write(self, text):
+            if self.writing:
+                self.overlapped = True
+            self.writing = True
+            time.sleep(0.001)
+            self.writing = False
+            return super().write(text)
+
+    stream = SlowStream()
+
+    async def run():
+        async with AsyncFormConverter(MAP, base_uri=EX, workers=4, sink=FileSink(stream)) as converter:
+            await converter.convert_many({'0-0': 'Person' + str(i)} for i in range(40))
+
+    asyncio.run(run())
+    assert not stream.overlapped
+    result = Graph()
+    result.parse(data=stream.getvalue(), format='nt')
+    assert len(result) == 80
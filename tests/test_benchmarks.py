@@ -0,0 +1,23 @@
+from benchmarks.run import run_case, compare, STAGES
+from benchmarks.shapes import generate_shape
+from rdfhandling import RDFHandler
+
+
+def test_generate_shape():
+    shape = RDFHandler(generate_shape(properties=10, depth=2, groups=2, paired=3, options=20)).get_shape()
+    assert [len(g['properties']) for g in shape['groups']] == [5, 5]
+    properties = {p['path']: p for g in shape['groups'] for p in g['properties']}
+    assert len(properties['http://example.org/bench#p0']['in']) == 20
+    assert properties['http://example.org/bench#p1']['lessThan'] == 'http://example.org/bench#p2'
+    composite = properties['http://example.org/bench#p4']
+    assert len(composite['property']) == 3
+    assert any('property' in p for p in composite['property'])
+
+
+def test_run_case():
+    # Every stage is timed, and the generated submission converts every property
+    result = run_case(dict(properties=10, depth=2, paired=3, options=20), repeat=1)
+    assert sorted(result['stages']) == sorted(STAGES)
+    counts = result['counts']
+    assert counts['converted_triples'] == counts['properties'] + 1
+    assert compare({'cases': {'small': result}}, {'cases': {'small': result}})[0].endswith('x1.00')
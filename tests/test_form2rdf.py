@@ -0,0 +1,244 @@
+import io
+import os
+import shutil
+import pytest
+from rdflib import Graph, RDF, XSD
+from rdflib.term import Literal, URIRef, BNode
+from form2rdf import FormConverter, Form2RDFController, CompiledMap, FormIndex, load_map, write_compiled_map, nt_line
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = 'http://schema.org/'
+EX = 'http://example.org/ex#'
+MAP = 'inputs/conversion/person_map.ttl'
+
+
+class FormRequest:
+    # Stands in for the request object received from the form
+    def __init__(self, form):
+        self.form = form
+
+
+def test_compiled_map():
+    rdf_map = load_map(MAP)
+    assert rdf_map.root_node_class == URIRef(SCHEMA + 'Person')
+    entries = {e.property_id: e for e in rdf_map.entries}
+    assert sorted(entries) == ['0', '1', '2', '3']
+    assert entries['0'].node_kind == 'Literal'
+    assert entries['0'].datatype == XSD.string
+    assert entries['1'].datatype is None
+    address = entries['3']
+    assert address.node_kind == 'BlankNodeOrIRI'
+    assert sorted((e.property_id, e.local_id) for e in address.children) == [('3:0', '0'), ('3:1', '1')]
+
+
+def test_load_map_cached():
+    assert load_map(MAP) is load_map(MAP)
+
+
+def test_compiled_map_json(tmp_path):
+    # A compiled map written next to the Turtle map is loaded in its place, unless it is out of date
+    path = str(tmp_path / 'map.ttl')
+    shutil.copy(MAP, path)
+    turtle_map = load_map(path)
+    json_path = write_compiled_map(turtle_map, path)
+    assert json_path == str(tmp_path / 'map.json')
+    os.utime(path, (0, 0))
+    json_map = load_map(path)
+    assert json_map is not turtle_map
+    assert json_map.to_json() == turtle_map.to_json()
+    assert json_map.root_node_class == URIRef(SCHEMA + 'Person')
+    assert dict(json_map.namespaces) == dict(turtle_map.namespaces)
+    # Turtle maps edited after the compiled map was written are parsed again
+    os.utime(json_path, (0, 0))
+    os.utime(path, (10, 10))
+    assert load_map(path).to_json() == turtle_map.to_json()
+    # Compiled maps from a different version are ignored
+    with open(json_path, 'w') as f:
+        f.write('{"format": "shaclform-map", "version": 0}')
+    os.utime(json_path, (20, 20))
+    assert load_map(path).to_json() == turtle_map.to_json()
+    with pytest.raises(ValueError):
+        load_map(json_path)
+
+
+def test_load_map_reloads_changed_file(tmp_path):
+    path = str(tmp_path / 'map.ttl')
+    shutil.copy(MAP, path)
+    first = load_map(path)
+    os.utime(path, (0, 0))
+    second = load_map(path)
+    assert second is not first
+    assert second.root_node_class == first.root_node_class
+
+
+def test_convert():
+    form = {'0-0': 'Steve', '1-0': '<http://example.org/ex#Terrence>', 'Unchecked 2-0': 'on',
+            'NodeKind 3-0': 'BlankNode', '3-0:0-0': '1 Main St', '3-0:1-0': '4000'}
+    controller = Form2RDFController(root_node='http://example.org/ex#Steve')
+    result = controller.convert(FormRequest(form), MAP)
+    node = URIRef(EX + 'Steve')
+    assert (node, RDF.type, URIRef(SCHEMA + 'Person')) in result
+    assert (node, URIRef(SCHEMA + 'givenName'), Literal('Steve', datatype=XSD.string)) in result
+    assert (node, URIRef(SCHEMA + 'knows'), URIRef(EX + 'Terrence')) in result
+    assert (node, URIRef(EX + 'likesCats'), Literal(False, datatype=XSD.boolean)) in result
+    address = result.value(node, URIRef(SCHEMA + 'address'))
+    assert isinstance(address, BNode)
+    assert (address, URIRef(SCHEMA + 'streetAddress'), Literal('1 Main St')) in result
+    assert (address, URIRef(SCHEMA + 'postalCode'), Literal('4000', datatype=XSD.integer)) in result
+
+
+def test_convert_compiled_map():
+    rdf_map = Graph()
+    rdf_map.parse(MAP, format='turtle')
+    compiled_map = CompiledMap.from_graph(rdf_map)
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    result = controller.convert(FormRequest({'0-0': 'Steve', '0-1': 'Terrence'}), compiled_map)
+    assert len(list(result.objects(None, URIRef(SCHEMA + 'givenName')))) == 2
+
+
+def test_convert_namespaces_not_shared():
+    # Prefixes bound while serializing one result don't show up in the next
+    converter = FormConverter(load_map(MAP), base_uri=EX)
+    first = converter.convert({'0-0': 'Steve'})
+    first.add((URIRef(EX + 'Steve'), URIRef('http://example.com/other#likes'), Literal('cats')))
+    first.serialize(format='turtle')
+    namespaces = dict(first.namespaces())
+    assert 'ns1' in namespaces
+    second = dict(converter.convert({'0-0': 'Terrence'}).namespaces())
+    assert 'ns1' not in second
+    assert set(dict(load_map(MAP).namespaces)) <= set(second)
+
+
+def test_convert_many():
+    forms = [{'0-0': 'Steve'}, {'0-0': 'Terrence'}, {'1-0': 'http://example.org/ex#Steve'}]
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    result = controller.convert_many(forms, MAP)
+    people = list(result.subjects(RDF.type, URIRef(SCHEMA + 'Person')))
+    assert len(people) == 3
+    assert len(list(result.objects(None, URIRef(SCHEMA + 'givenName')))) == 2
+
+
+def test_convert_many_into_graph():
+    graph = Graph()
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    result = controller.convert_many([{'0-0': 'Steve'}], load_map(MAP), graph=graph)
+    assert result is graph
+    assert len(graph) == 2
+
+
+def test_iter_convert_node_factory():
+    forms = [{'0-0': 'Steve'}, {'0-0': 'Terrence'}]
+    controller = Form2RDFController(node_factory=lambda form: EX + form['0-0'])
+    results = list(controller.iter_convert(forms, MAP))
+    assert [root_node for root_node, triples in results] == [URIRef(EX + 'Steve'), URIRef(EX + 'Terrence')]
+    root_node, triples = results[1]
+    assert (root_node, URIRef(SCHEMA + 'givenName'), Literal('Terrence', datatype=XSD.string)) in triples
+
+
+def test_iter_convert_fixed_root_node():
+    controller = Form2RDFController(root_node='http://example.org/ex#Steve')
+    with pytest.raises(ValueError):
+        list(controller.iter_convert([{'0-0': 'Steve'}], MAP))
+
+
+def test_iter_triples():
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    triples = list(controller.iter_triples([{'0-0': 'Steve'}, {'0-0': 'Terrence'}], MAP))
+    assert len(triples) == 4
+    assert all(len(t) == 3 for t in triples)
+
+
+def test_write_ntriples():
+    forms = [{'0-0': 'Steve\nJr'}, {'NodeKind 3-0': 'BlankNode', '3-0:0-0': '1 Main St'}]
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    stream = io.StringIO()
+    assert controller.write_ntriples(forms, MAP, stream) == 5
+    result = Graph()
+    result.parse(data=stream.getvalue(), format='nt')
+    assert len(result) == 5
+    assert Literal('Steve\nJr', datatype=XSD.string) in result.objects(None, URIRef(SCHEMA + 'givenName'))
+
+
+def test_write_nquads():
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    stream = io.StringIO()
+    controller.write_ntriples([{'0-0': 'Steve'}], MAP, stream, context='http://example.org/ex#import')
+    for line in stream.getvalue().splitlines():
+        assert line.endswith(' <http://example.org/ex#import> .')
+
+
+def test_nt_line():
+    # Lines read back as the same terms, whatever the literal holds
+    node = BNode()
+    triples = [(URIRef(EX + 'Steve'), URIRef(SCHEMA + 'description'), Literal('Says "hi"\r\nand \\ leaves')),
+               (node, URIRef(SCHEMA + 'name'), Literal('Étienne', lang='fr')),
+               (node, URIRef(SCHEMA + 'age'), Literal('42', datatype=XSD.integer))]
+    result = Graph()
+    result.parse(data=''.join(nt_line(t) for t in triples), format='nt')
+    assert len(result) == 3
+    assert (URIRef(EX + 'Steve'), URIRef(SCHEMA + 'description'), triples[0][2]) in result
+    assert set(result.objects(None, URIRef(SCHEMA + 'name'))) == {triples[1][2]}
+    assert set(result.objects(None, URIRef(SCHEMA + 'age'))) == {triples[2][2]}
+    assert nt_line(triples[2], URIRef(EX + 'import')).endswith(' <http://example.org/ex#import> .\n')
+
+
+def test_form_index():
+    index = FormIndex({'3-0:1-2': 'a', 'NodeKind 3-0': 'BlankNode', 'Unchecked 2-1': 'on', 'csrf_token': 'x',
+                       'Object Type CustomProperty-1': 'IRI', 'Object CustomProperty-1': 'ex:b'})
+    assert index.entries['3'][0].node_kind == 'BlankNode'
+    assert index.entries['3'][0].children['1'][2].value == 'a'
+    assert index.entries['2'][1].unchecked == 'on'
+    assert index.entries['2'][1].value is None
+    assert index.custom_properties == {1: {'Object Type': 'IRI', 'Object': 'ex:b'}}
+
+
+def test_convert_copy_gaps():
+    # Entries removed from the middle of the form leave gaps in the copy numbers
+    form = {'0-0': 'Steve', '0-2': 'Terrence', 'NodeKind 3-1': 'BlankNode', '3-1:0-3': '1 Main St',
+            'Predicate CustomProperty-1': 'http://example.org/ex#nickname', 'Object Type CustomProperty-1': 'String',
+            'Object CustomProperty-1': 'Stevo'}
+    controller = Form2RDFController(root_node='http://example.org/ex#Steve')
+    result = controller.convert(FormRequest(form), MAP)
+    node = URIRef(EX + 'Steve')
+    assert len(list(result.objects(node, URIRef(SCHEMA + 'givenName')))) == 2
+    address = result.value(node, URIRef(SCHEMA + 'address'))
+    assert (address, URIRef(SCHEMA + 'streetAddress'), Literal('1 Main St')) in result
+    assert (node, URIRef(EX + 'nickname'), Literal('Stevo', datatype=XSD.string)) in result
+
+
+def test_convert_mints_new_root_nodes():
+    # Each submission converted by a controller without a fixed root node gets a new one
+    controller = Form2RDFController(base_uri='http://example.org/ex#')
+    first = controller.convert(FormRequest({'0-0': 'Steve'}), MAP)
+    second = controller.convert(FormRequest({'0-0': 'Terrence'}), MAP)
+    assert set(first.subjects(RDF.type, None)).isdisjoint(second.subjects(RDF.type, None))
+
+
+def test_form_converter_immutable():
+    converter = FormConverter(MAP, base_uri='http://example.org/ex#')
+    assert converter.rdf_map is load_map(MAP)
+    with pytest.raises(AttributeError):
+        converter.base_uri = 'http://example.org/other#'
+    # Root nodes can't be minted without base_uri or node_factory
+    with pytest.raises(ValueError):
+        FormConverter(MAP).convert({'0-0': 'Steve'})
+    result = FormConverter(MAP).convert({'0-0': 'Steve'}, root_node=EX + 'Steve')
+    assert (URIRef(EX + 'Steve'), URIRef(SCHEMA + 'givenName'), Literal('Steve', datatype=XSD.string)) in result
+
+
+def test_form_converter_threads():
+    # One converter converts submissions from many threads at once
+    converter = FormConverter(MAP, node_factory=lambda form: EX + form['0-0'])
+    names = ['Person' + str(i) for i in range(200)]
+
+    def convert(name):
+        form = {'0-0': name, 'NodeKind 3-0': 'BlankNode', '3-0:0-0': name + ' St'}
+        return name, converter.convert(form)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for name, result in executor.map(convert, names):
+            node = URIRef(EX + name)
+            assert result.value(node, URIRef(SCHEMA + 'givenName')) == Literal(name, datatype=XSD.string)
+            address = result.value(node, URIRef(SCHEMA + 'address'))
+            assert result.value(address, URIRef(SCHEMA + 'streetAddress')) == Literal(name + ' St')
+            assert len(result) == 4
@@ -0,0 +1,75 @@
+import os
+import pstats
+import shutil
+from instrumentation import Instrumentation
+from generate_form import generate_form, build_forms, main
+from shaclform.form2rdf import Form2RDFController
+
+
+class FormRequest:
+    def __init__(self, form):
+        self.form = form
+
+
+def test_instrumentation():
+    events = list()
+    instrumentation = Instrumentation(callback=lambda *event: events.append(event))
+    with instrumentation.stage('render'):
+        pass
+    with instrumentation.stage('render'):
+        pass
+    instrumentation.count('properties', 3)
+    assert instrumentation.calls == {'render': 2}
+    assert instrumentation.counts == {'properties': 3}
+    assert [e[:2] for e in events] == [('stage', 'render'), ('stage', 'render'), ('count', 'properties')]
+    # Timings recorded elsewhere, e.g. in a worker process, are added to the totals
+    other = Instrumentation()
+    other.count('properties', 2)
+    other.add_time('render', 1.0)
+    instrumentation.merge(other.to_dict())
+    assert instrumentation.counts == {'properties': 5}
+    assert instrumentation.calls == {'render': 3}
+    assert instrumentation.timings['render'] >= 1.0
+
+
+def test_generate_form_stages(tmp_path):
+    instrumentation = Instrumentation()
+    with open('inputs/test_shape.ttl') as f:
+        generate_form(f, str(tmp_path / 'form.html'), str(tmp_path / 'map.ttl'), instrumentation=instrumentation)
+    assert set(instrumentation.timings) == {'parse', 'expand', 'get_shape', 'sort', 'ids', 'pairing', 'options',
+                                            'render', 'map', 'compile_map', 'write'}
+    assert instrumentation.counts['shapes'] == 1
+    assert instrumentation.counts['triples_read'] > 0
+    assert instrumentation.counts['properties'] > 0
+    assert instrumentation.counts['form_bytes'] == os.path.getsize(str(tmp_path / 'form.html'))
+
+
+def test_build_forms_stages(tmp_path):
+    shapes = tmp_path / 'shapes'
+    shutil.copytree('inputs/registry', str(shapes))
+    # Stages timed in worker processes are added up too
+    for jobs in [1, 2]:
+        instrumentation = Instrumentation()
+        results = build_forms(str(shapes), str(tmp_path / ('forms' + str(jobs))), jobs=jobs,
+                              instrumentation=instrumentation)
+        assert all(r.stages['counts']['shapes'] == 1 for r in results)
+        assert instrumentation.counts['shapes'] == len(results)
+        assert instrumentation.calls['render'] == len(results)
+
+
+def test_convert_counts():
+    instrumentation = Instrumentation()
+    controller = Form2RDFController(base_uri='http://example.org/ex#', instrumentation=instrumentation)
+    result = controller.convert(FormRequest({'0-0': 'Steve', '0-1': 'Stephen'}), 'inputs/conversion/person_map.ttl')
+    assert instrumentation.counts['submissions'] == 1
+    assert instrumentation.counts['triples_emitted'] == len(result)
+    assert instrumentation.counts['entries_probed'] >= 1
+    assert {'load_map', 'index_form', 'convert'} <= set(instrumentation.timings)
+
+
+def test_profile(tmp_path, capsys):
+    profile = str(tmp_path / 'build.prof')
+    assert main(['inputs/test_shape.ttl', str(tmp_path / 'form.html'), str(tmp_path / 'map.ttl'),
+                 '--profile', profile, '--timings']) == 0
+    assert pstats.Stats(profile).total_calls > 0
+    assert 'render' in capsys.readouterr().err
@@ -2,8 +2,13 @@ import os
 import pytest
 import filecmp
 import copy
+import json
 import shutil
-from generate_form import generate_form, sort_composite_property, assign_id, check_property, find_paired_properties
+from rdflib import RDF, Graph
+from rdflib.term import URIRef
+from generate_form import generate_form, generate_forms, build_forms, build_form, sort_composite_property, assign_id, \
+    find_paired_properties, write_chunks, main, FormArtifacts
+from shaclform.form2rdf import Form2RDFController
 
 
 def test_no_filename():
@@ -75,38 +80,6 @@ def test_assign_id_nested_property():
     assert prop == expected_result
 
 
-def test_check_property_match():
-    prop = {'path': 'http://schema.org/givenName', 'id': 0}
-    path = 'http://schema.org/givenName'
-    result = check_property(prop, path)
-    expected_result = 0
-    assert result == expected_result
-
-
-def test_check_property_no_match():
-    prop = {'path': 'http://schema.org/familyName', 'id': 0}
-    path = 'http://schema.org/givenName'
-    result = check_property(prop, path)
-    expected_result = None
-    assert result == expected_result
-
-
-def test_check_property_nested_property_match():
-    prop = {'path': 'http://schema.org/familyName', 'property': [{'path': 'http://schema.org/givenName', 'id': 0}]}
-    path = 'http://schema.org/givenName'
-    result = check_property(prop, path)
-    expected_result = 0
-    assert result == expected_result
-
-
-def test_check_property_nested_property_no_match():
-    prop = {'path': 'http://schema.org/familyName', 'property': [{'path': 'http://schema.org/familyName', 'id': 0}]}
-    path = 'http://schema.org/givenName'
-    result = check_property(prop, path)
-    expected_result = None
-    assert result == expected_result
-
-
 def test_find_paired_properties_ungrouped():
     shape = {'groups': [], 'properties': [{'path': 'A', 'equals': 'B', 'id': 0, 'property': [{'path': 'B', 'id': 1}]}]}
     prop = {'path': 'A', 'equals': 'B', 'id': 0, 'property': [{'path': 'B', 'id': 1}]}
@@ -135,6 +108,31 @@ def test_find_paired_properties_nested():
     assert prop == expected_result
 
 
+def test_find_paired_properties_path_index():
+    shape = {'groups': [], 'properties': [{'path': 'A', 'lessThan': 'B'}, {'path': 'B'}]}
+    path_index = dict()
+    for next_id, prop in enumerate(shape['properties']):
+        assign_id(prop, next_id, path_index=path_index)
+    assert path_index == {'A': [0], 'B': [1]}
+    find_paired_properties(shape, shape['properties'][0], 'lessThan', path_index)
+    assert shape['properties'][0]['lessThan'] == 1
+
+
+def test_find_paired_properties_unresolved():
+    shape = {'groups': [], 'properties': [{'path': 'A', 'equals': 'C', 'id': 0}]}
+    with pytest.warns(UserWarning):
+        find_paired_properties(shape, shape['properties'][0], 'equals')
+    assert shape['properties'][0]['equals'] == 'C'
+
+
+def test_find_paired_properties_ambiguous():
+    shape = {'groups': [], 'properties': [{'path': 'A', 'equals': 'B', 'id': 0},
+                                          {'path': 'B', 'id': 1, 'property': [{'path': 'B', 'id': '1:0'}]}]}
+    with pytest.warns(UserWarning):
+        find_paired_properties(shape, shape['properties'][0], 'equals')
+    assert shape['properties'][0]['equals'] == 1
+
+
 def test_shape():
     # Contents of result can't be verified due to RDF and therefore the HTML result being unordered
     if os.path.exists('results'):
@@ -142,3 +140,187 @@ def test_shape():
     with open('inputs/test_shape.ttl') as f:
         generate_form(f, form_destination='result.html', map_destination='result.ttl')
     assert os.path.exists('result.html')
+
+
+def test_generate_forms(tmp_path):
+    with open('inputs/multiple_shapes.ttl') as f:
+        results = generate_forms(f, str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == ['OrganizationShape.html', 'OrganizationShape.json',
+                                                 'OrganizationShape.ttl', 'PersonShape.html', 'PersonShape.json',
+                                                 'PersonShape.ttl']
+    assert len(results) == 2
+    with open(str(tmp_path / 'OrganizationShape.html')) as f:
+        assert 'Create New Organization' in f.read()
+
+
+def test_generate_forms_same_name(tmp_path):
+    # Shapes with the same name are always given the same file names, whichever order the graph holds them in
+    shapes = Graph()
+    for uri in ['http://example.org/b#PersonShape', 'http://example.org/a#PersonShape']:
+        shapes.add((URIRef(uri), RDF.type, URIRef('http://www.w3.org/ns/shacl#NodeShape')))
+        shapes.add((URIRef(uri), URIRef('http://www.w3.org/ns/shacl#targetClass'), URIRef('http://schema.org/Person')))
+    results = generate_forms(shapes, str(tmp_path))
+    assert results[URIRef('http://example.org/a#PersonShape')][0] == os.path.join(str(tmp_path), 'PersonShape.html')
+    assert results[URIRef('http://example.org/b#PersonShape')][0] == os.path.join(str(tmp_path), 'PersonShape-2.html')
+
+
+def test_build_forms(tmp_path):
+    shapes = tmp_path / 'shapes'
+    shapes.mkdir()
+    shutil.copy('inputs/multiple_shapes.ttl', str(shapes))
+    shutil.copy('inputs/no_target_class.ttl', str(shapes))
+    (shapes / 'bad.ttl').write_text('Not Turtle')
+    for jobs in [1, 2]:
+        destination = tmp_path / ('forms' + str(jobs))
+        results = build_forms(str(shapes), str(destination), jobs=jobs)
+        # The broken file and shape are reported without stopping the others
+        assert len([r for r in results if r.error]) == 2
+        assert len([r for r in results if not r.error]) == 2
+        assert os.path.exists(str(destination / 'PersonShape.html'))
+        assert os.path.exists(str(destination / 'OrganizationShape.ttl'))
+
+
+def test_build_forms_incremental(tmp_path):
+    shapes = tmp_path / 'shapes'
+    shutil.copytree('inputs/registry', str(shapes))
+    destination = str(tmp_path / 'forms')
+    results = build_forms(str(shapes), destination, jobs=1, incremental=True)
+    assert sorted(os.path.basename(r.form_destination) for r in results if not r.skipped) == ['PersonShape.html',
+                                                                                             'PlaceShape.html']
+    # Nothing changed
+    results = build_forms(str(shapes), destination, jobs=1, incremental=True)
+    assert all(r.skipped for r in results)
+    # PersonShape uses AddressShape through sh:node, so changing it only rebuilds PersonShape
+    address = shapes / 'address.ttl'
+    address.write_text(address.read_text().replace('schema:postalCode', 'schema:streetAddress'))
+    results = build_forms(str(shapes), destination, jobs=1, incremental=True)
+    assert [os.path.basename(r.form_destination) for r in results if not r.skipped] == ['PersonShape.html']
+
+
+def test_build_forms_incremental_options(tmp_path):
+    # Changing how sh:in lists are written rebuilds the forms
+    shapes = tmp_path / 'shapes'
+    shapes.mkdir()
+    shutil.copy('inputs/large_in.ttl', str(shapes))
+    destination = tmp_path / 'forms'
+    build_forms(str(shapes), str(destination), jobs=1, incremental=True)
+    results = build_forms(str(shapes), str(destination), jobs=1, incremental=True, option_threshold=10)
+    assert not any(r.skipped for r in results)
+    assert len(os.listdir(str(destination / 'options'))) == 1
+    results = build_forms(str(shapes), str(destination), jobs=1, incremental=True, option_threshold=10,
+                          options_url='/options')
+    assert not any(r.skipped for r in results)
+    with open(str(destination / 'ProductShape.html')) as f:
+        assert "data-options-url='/options/" in f.read()
+
+
+def test_build_forms_incremental_map_format(tmp_path):
+    # Maps compiled in an older format are rebuilt
+    shapes = tmp_path / 'shapes'
+    shutil.copytree('inputs/registry', str(shapes))
+    destination = tmp_path / 'forms'
+    build_forms(str(shapes), str(destination), jobs=1, incremental=True)
+    manifest_path = str(destination / '.shaclform-manifest.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    for record in manifest['shapes'].values():
+        del record['map_format']
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    results = build_forms(str(shapes), str(destination), jobs=1, incremental=True)
+    assert not any(r.skipped for r in results)
+
+
+def test_build_forms_incremental_load_error(tmp_path):
+    # A file which can't be loaded for a build doesn't lose the forms built from it before
+    shapes = tmp_path / 'shapes'
+    shutil.copytree('inputs/registry', str(shapes))
+    destination = tmp_path / 'forms'
+    build_forms(str(shapes), str(destination), jobs=1, incremental=True)
+    person = shapes / 'person.ttl'
+    contents = person.read_text()
+    person.write_text('Not Turtle')
+    results = build_forms(str(shapes), str(destination), jobs=1, incremental=True)
+    assert str(person) in [r.shape_uri for r in results if r.error]
+    assert os.path.isfile(str(destination / 'PersonShape.html'))
+    assert os.path.isfile(str(destination / 'PersonShape.ttl'))
+    # Once it can be loaded again, it is still up to date
+    person.write_text(contents)
+    results = build_forms(str(shapes), str(destination), jobs=1, incremental=True)
+    assert all(r.skipped for r in results)
+
+
+def test_main_directory_twice(tmp_path, monkeypatch, capsys):
+    # Forms generated into the directory of shapes aren't read as shapes on the next run
+    shutil.copy('inputs/multiple_shapes.ttl', str(tmp_path))
+    (tmp_path / 'notes.txt').write_text('Not a Shapes file')
+    monkeypatch.chdir(tmp_path)
+    for jobs in ['1', '2']:
+        assert main(['--jobs', jobs, '.']) == 0
+        assert capsys.readouterr().out.endswith('Generated 2 forms, 0 unchanged, 0 failed.\n')
+    assert sorted(os.listdir('forms')) == ['OrganizationShape.html', 'OrganizationShape.json', 'OrganizationShape.ttl',
+                                           'PersonShape.html', 'PersonShape.json', 'PersonShape.ttl']
+
+
+def test_build_form(tmp_path, monkeypatch):
+    # The form and map are generated in memory, and the compiled map can be used to convert submissions directly
+    shape_path = os.path.abspath('inputs/conversion/person_shape.ttl')
+    with open(shape_path) as f:
+        monkeypatch.chdir(tmp_path)
+        artifacts = build_form(f)
+    assert os.listdir(str(tmp_path)) == []
+    assert "name='0'" in artifacts.html
+    assert artifacts.compiled_map.root_node_class == URIRef('http://schema.org/Person')
+    assert len(artifacts.map_graph) > 0
+
+    class FormRequest:
+        form = {'0-0': 'Steve'}
+
+    result = Form2RDFController(root_node='http://example.org/ex#Steve').convert(FormRequest(),
+                                                                                 artifacts.compiled_map)
+    node = URIRef('http://example.org/ex#Steve')
+    assert (node, RDF.type, URIRef('http://schema.org/Person')) in result
+    assert str(result.value(node, URIRef('http://schema.org/givenName'))) == 'Steve'
+    # The form can also be streamed in chunks
+    with open(shape_path) as f:
+        streamed = build_form(f, stream=True)
+    assert not isinstance(streamed.html, str)
+    assert ''.join(streamed.html) == artifacts.html
+
+
+def test_write_chunks(tmp_path):
+    destination = str(tmp_path / 'form.html')
+    write_chunks(destination, iter(['<form>', '</form>']))
+
+    def failing_render():
+        yield '<form>'
+        raise Exception('Rendering failed')
+
+    # A form which fails to render doesn't replace the last one written
+    with pytest.raises(Exception, match='Rendering failed'):
+        write_chunks(destination, failing_render())
+    with open(destination) as f:
+        assert f.read() == '<form></form>'
+    assert os.listdir(str(tmp_path)) == ['form.html']
+
+
+def test_generate_forms_option_index(tmp_path):
+    # Large sh:in lists are written to an option index instead of the form
+    with open('inputs/large_in.ttl') as f:
+        generate_forms(f, str(tmp_path), option_threshold=10)
+    indexes = os.listdir(str(tmp_path / 'options'))
+    assert len(indexes) == 1
+    with open(str(tmp_path / 'ProductShape.html')) as f:
+        html = f.read()
+    assert "data-options-url='options/" + indexes[0][:-len('.json')] + "'" in html
+    assert 'Lavender' not in html
+    # Fields are given their own datalist by the script, so none are rendered with IDs that could repeat
+    assert '<datalist' not in html
+    assert "<option value='Wood'" in html
+    # Only if a threshold is given
+    with open('inputs/large_in.ttl') as f:
+        artifacts = build_form(f)
+    assert 'Lavender' in artifacts.html
+    assert artifacts.options == {}
+    # Artifacts built without options don't share a default
+    assert FormArtifacts(artifacts.html, artifacts.map_graph, artifacts.compiled_map).options is None
@@ -0,0 +1,60 @@
+import io
+import os
+import json
+import pytest
+from options import OptionIndex, create_app
+
+COLOURS = ['Blue', 'black', 'Beige', 'Green', 'Grey', 'Gold', 'Red']
+
+
+def test_search():
+    index = OptionIndex(COLOURS)
+    # Prefixes are matched regardless of case, and results are sorted
+    assert index.search('b') == {'options': ['Beige', 'black', 'Blue'], 'total': 3}
+    assert index.search('GR') == {'options': ['Green', 'Grey'], 'total': 2}
+    assert index.search('x') == {'options': [], 'total': 0}
+    # Results can be paged through
+    assert index.search('', offset=2, limit=2) == {'options': ['Blue', 'Gold'], 'total': 7}
+    assert index.search('g', offset=5) == {'options': [], 'total': 3}
+
+
+def test_save(tmp_path):
+    index = OptionIndex(COLOURS)
+    path = index.save(str(tmp_path))
+    with open(path) as f:
+        loaded = OptionIndex.from_json(f.read())
+    assert loaded.options == index.options
+    assert loaded.key == index.key
+    # The key only depends on the options
+    assert OptionIndex(reversed(COLOURS)).key == index.key
+
+
+def test_save_interrupted(tmp_path):
+    class FailingIndex(OptionIndex):
+        def to_json(self):
+            raise KeyboardInterrupt
+
+    # Nothing is left behind for the next build to trust
+    with pytest.raises(KeyboardInterrupt):
+        FailingIndex(COLOURS).save(str(tmp_path))
+    assert os.listdir(str(tmp_path)) == []
+    path = OptionIndex(COLOURS).save(str(tmp_path))
+    assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
+
+
+def test_app(tmp_path):
+    index = OptionIndex(COLOURS)
+    index.save(str(tmp_path))
+    app = create_app(str(tmp_path))
+    statuses = []
+
+    def request(path, query=''):
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'wsgi.input': io.BytesIO()}
+        body = b''.join(app(environ, lambda status, headers: statuses.append(status)))
+        return statuses[-1], body
+
+    status, body = request('/' + index.key, 'q=gr&limit=1')
+    assert status == '200 OK'
+    assert json.loads(body.decode('utf-8')) == {'options': ['Green'], 'total': 2}
+    assert request('/0123abcd')[0] == '404 Not Found'
+    assert request('/../secrets')[0] == '404 Not Found'
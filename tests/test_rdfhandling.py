@@ -589,3 +589,102 @@ def group_test(shape):
     for g in groups:
         if str(g['label']) == expected_label:
             assert any(p['path'] == 'http://schema.org/birthDate' for p in g['properties'])
+
+
+def test_get_shapes():
+    # Every root shape is read, with only the groups it uses
+    with open('inputs/multiple_shapes.ttl') as f:
+        shapes = dict(RDFHandler(f).get_shapes())
+    assert sorted(str(uri) for uri in shapes) == ['http://example.org/ex#OrganizationShape',
+                                                   'http://example.org/ex#PersonShape']
+    person = shapes[URIRef('http://example.org/ex#PersonShape')]
+    organization = shapes[URIRef('http://example.org/ex#OrganizationShape')]
+    assert [str(g['label']) for g in person['groups']] == ['Dates']
+    assert [str(g['label']) for g in organization['groups']] == ['Contact']
+    # Shared property shapes are copied into each shape
+    person_name = [p for p in person['properties'] if p['path'] == 'http://schema.org/name'][0]
+    organization_name = [p for p in organization['properties'] if p['path'] == 'http://schema.org/name'][0]
+    assert person_name == organization_name
+    assert person_name is not organization_name
+
+
+def test_get_shape_by_uri():
+    with open('inputs/multiple_shapes.ttl') as f:
+        rdf_handler = RDFHandler(f)
+    shape = rdf_handler.get_shape('http://example.org/ex#OrganizationShape')
+    assert str(shape['target_class']) == 'http://schema.org/Organization'
+    with pytest.raises(Exception):
+        rdf_handler.get_shape('http://example.org/ex#NameShape')
+
+
+def test_fingerprint():
+    # Fingerprints don't depend on blank node labels, so parsing the same file twice gives the same fingerprint
+    person = 'http://example.org/ex#PersonShape'
+    organization = 'http://example.org/ex#OrganizationShape'
+    with open('inputs/multiple_shapes.ttl') as f:
+        first = RDFHandler(f)
+    with open('inputs/multiple_shapes.ttl') as f:
+        second = RDFHandler(f)
+    assert first.get_fingerprint(person) == second.get_fingerprint(person)
+    assert first.get_fingerprint(person) != first.get_fingerprint(organization)
+    # Only shapes which depend on a changed subject get a new fingerprint
+    assert URIRef('http://example.org/ex#AddressShape') in first.get_dependencies(person)
+    before = first.get_fingerprint(organization)
+    first.g.add((URIRef('http://example.org/ex#AddressShape'), URIRef(SHACL + 'closed'), Literal(True)))
+    assert first.get_fingerprint(person) != second.get_fingerprint(person)
+    assert first.get_fingerprint(organization) == before
+
+
+def test_indexed():
+    # Reading from the index gives the same shape as reading from the graph
+    def sort_properties(properties):
+        properties.sort(key=lambda p: p['path'])
+        for p in properties:
+            if 'property' in p:
+                sort_properties(p['property'])
+        return properties
+
+    with open('inputs/test_shape.ttl') as f:
+        expected_result = RDFHandler(f).get_shape()
+    with open('inputs/test_shape.ttl') as f:
+        result = RDFHandler(f, indexed=True).get_shape()
+    for shape in [expected_result, result]:
+        sort_properties(shape['properties'])
+        for g in shape['groups']:
+            sort_properties(g['properties'])
+    assert result == expected_result
+
+
+def test_node_expansion_does_not_modify_graph():
+    # Nodes are expanded without adding triples to the graph, so reading a shape again gives the same result
+    with open('inputs/test_shape.ttl') as f:
+        rdf_handler = RDFHandler(f)
+    size = len(rdf_handler.g)
+    first = rdf_handler.get_shape()
+    assert len(rdf_handler.g) == size
+    assert rdf_handler.get_shape() == first
+    assert len(rdf_handler.g) == size
+
+
+def test_node_cycle():
+    # Nodes which link back to each other are caught, rather than expanded forever
+    with open('inputs/node_cycle.ttl') as f:
+        rdf_handler = RDFHandler(f)
+    with pytest.raises(Exception, match='Recursion not allowed: shape'):
+        rdf_handler.get_shape('http://example.org/ex#RootShape')
+    with open('inputs/recursion.ttl') as f:
+        rdf_handler = RDFHandler(f)
+    with pytest.raises(Exception, match='Recursion not allowed: property'):
+        rdf_handler.get_shape('http://example.org/ex#PersonShape2')
+
+
+def test_option_threshold():
+    # sh:in lists over the threshold are left in the graph, and only their head is given
+    for indexed in [False, True]:
+        with open('inputs/large_in.ttl') as f:
+            rdf_handler = RDFHandler(f, indexed=indexed, option_threshold=10)
+        properties = {p['path']: p for p in rdf_handler.get_shape()['properties']}
+        colour = properties['http://schema.org/color']
+        assert 'in' not in colour
+        assert len(rdf_handler.get_list(colour['optionSource'])) == 20
+        assert properties['http://schema.org/material']['in'] == ['Wood', 'Metal']
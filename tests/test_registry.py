@@ -0,0 +1,45 @@
+import os
+import shutil
+from rdflib.graph import Graph
+from rdflib.term import URIRef
+from rdfhandling.registry import ShapeRegistry
+
+
+def test_get_shape():
+    registry = ShapeRegistry('inputs/registry')
+    shape = registry.get_shape('http://example.org/ex#PersonShape')
+    assert str(shape['target_class']) == 'http://schema.org/Person'
+    # The nested property comes from a node shape in another file
+    address = [p for p in shape['properties'] if p['path'] == 'http://schema.org/address'][0]
+    assert [p['path'] for p in address['property']] == ['http://schema.org/postalCode']
+    shape = registry.get_shape('http://example.org/ex#PlaceShape')
+    assert str(shape['target_class']) == 'http://schema.org/Place'
+
+
+def test_unchanged_file_not_reloaded(tmp_path):
+    shutil.copy('inputs/registry/person.ttl', str(tmp_path))
+    registry = ShapeRegistry(str(tmp_path))
+    path = str(tmp_path / 'person.ttl')
+    assert not registry.load_file(path)
+    with open(path, 'a') as f:
+        f.write('\n<http://example.org/ex#PersonShape> <http://www.w3.org/ns/shacl#closed> true .\n')
+    assert registry.load_file(path)
+    assert registry.get_shape()['closed'] is True
+
+
+def test_cache_dir(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    ShapeRegistry('inputs/registry', cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    # A new registry reads the parsed files from the cache
+    monkeypatch.setattr(Graph, 'parse', None)
+    registry = ShapeRegistry('inputs/registry', cache_dir=cache_dir)
+    shape = registry.get_shape('http://example.org/ex#PlaceShape')
+    assert str(shape['target_class']) == 'http://schema.org/Place'
+
+
+def test_get_source_files():
+    registry = ShapeRegistry('inputs/registry')
+    subjects = [URIRef('http://example.org/ex#PersonShape'), URIRef('http://example.org/ex#AddressShape')]
+    assert registry.get_source_files(subjects) == {os.path.abspath('inputs/registry/person.ttl'),
+                                                   os.path.abspath('inputs/registry/address.ttl')}
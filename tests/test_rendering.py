@@ -0,0 +1,89 @@
+import os
+import types
+from concurrent.futures import ThreadPoolExecutor
+from rendering import render_template, stream_template, create_environment, get_environment, precompile_templates, \
+    URIs, TEMPLATE_DIR
+
+SHACL = 'http://www.w3.org/ns/shacl#'
+
+SHAPE = {
+    'target_class': 'http://schema.org/Person',
+    'closed': False,
+    'groups': [],
+    'properties': [{'path': 'http://schema.org/givenName', 'name': 'givenName', 'order': None, 'id': 0,
+                    'nodeKind': 'http://www.w3.org/ns/shacl#Literal'}]
+}
+
+
+def test_shared_environment():
+    assert get_environment() is get_environment()
+
+
+def test_bytecode_cache(tmp_path):
+    env = create_environment(bytecode_cache_dir=str(tmp_path))
+    env.get_template('base.html')
+    assert any(tmp_path.iterdir())
+
+
+def test_precompiled_templates(tmp_path):
+    precompile_templates(str(tmp_path))
+    # One module for each template, whatever else is in the templates directory
+    templates = [name for name in os.listdir(TEMPLATE_DIR) if name.endswith('.html')]
+    assert len(list(tmp_path.iterdir())) == len(templates)
+    env = create_environment(compiled_templates=str(tmp_path))
+    result = env.get_template('base.html').render(form_name='Person', shape=SHAPE, URIs=URIs)
+    assert result == render_template('Person', SHAPE)
+
+
+def address(prop_id):
+    # A composite property, as it would be given to the templates after IDs are assigned
+    return {'path': 'http://schema.org/address', 'name': 'address', 'order': None, 'id': prop_id,
+            'nodeKind': SHACL + 'BlankNode', 'property': [
+                {'path': 'http://schema.org/streetAddress', 'name': 'streetAddress', 'order': None,
+                 'id': str(prop_id) + ':0', 'nodeKind': SHACL + 'Literal', 'minCount': 1},
+                {'path': 'http://schema.org/postalCode', 'name': 'postalCode', 'order': None,
+                 'id': str(prop_id) + ':1', 'nodeKind': SHACL + 'Literal', 'lessThan': 0}]}
+
+
+def test_fragment_cache():
+    # Properties which only differ by ID are rendered once, and the result is the same as rendering each of them
+    shape = dict(SHAPE, properties=SHAPE['properties'] + [address(1), address(2)])
+    cached = create_environment()
+    uncached = create_environment(fragment_cache_size=0)
+    expected = uncached.get_template('base.html').render(form_name='Person', shape=shape, URIs=URIs)
+    result = cached.get_template('base.html').render(form_name='Person', shape=shape, URIs=URIs)
+    assert result == expected
+    assert "name='2:1-0'" not in result and "data-property-id='2:1'" in result
+    assert cached.fragment_cache.hits == 1
+    # Properties which differ by more than their ID are rendered separately
+    changed = address(3)
+    changed['property'][1]['lessThan'] = 1
+    shape['properties'].append(changed)
+    result = cached.get_template('base.html').render(form_name='Person', shape=shape, URIs=URIs)
+    assert result == uncached.get_template('base.html').render(form_name='Person', shape=shape, URIs=URIs)
+    assert "lessThan='1'" in result
+
+
+def test_fragment_cache_threads():
+    # Forms rendered at once from many threads share the cache, which is kept small so fragments are always evicted
+    shapes = list()
+    for i in range(8):
+        prop = address(1)
+        prop['property'][0]['minCount'] = i
+        shapes.append(dict(SHAPE, properties=SHAPE['properties'] + [prop]))
+    env = create_environment(fragment_cache_size=2)
+    uncached = create_environment(fragment_cache_size=0)
+    expected = [uncached.get_template('base.html').render(form_name='Person', shape=s, URIs=URIs) for s in shapes]
+
+    def render(i):
+        return env.get_template('base.html').render(form_name='Person', shape=shapes[i % 8], URIs=URIs)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(render, range(400)))
+    assert results == [expected[i % 8] for i in range(400)]
+
+
+def test_stream_template():
+    chunks = stream_template('Person', SHAPE)
+    assert isinstance(chunks, types.GeneratorType)
+    assert ''.join(chunks) == render_template('Person', SHAPE)
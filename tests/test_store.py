@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from rdflib import RDF
+from rdflib.term import URIRef
+from store import StoreSink, load_submissions, read_checkpoint
+from form2rdf import FormConverter
+from async_convert import AsyncFormConverter
+
+SCHEMA = 'http://schema.org/'
+EX = 'http://example.org/ex#'
+MAP = 'inputs/conversion/person_map.ttl'
+
+
+def name_node(form):
+    return EX + form['0-0']
+
+
+def forms(count, fail_at=None):
+    for i in range(count):
+        if i == fail_at:
+            raise RuntimeError('Interrupted')
+        yield {'0-0': 'Person' + str(i)}
+
+
+def test_load_submissions():
+    sink = StoreSink('default', commit_size=2)
+    assert load_submissions(FormConverter(MAP, node_factory=name_node), forms(5), sink) == 5
+    # Each submission is in its own named graph
+    assert len(list(sink.graph.contexts())) == 5
+    person = sink.graph.get_context(URIRef(EX + 'Person3'))
+    assert (URIRef(EX + 'Person3'), RDF.type, URIRef(SCHEMA + 'Person')) in person
+    assert len(person) == 2
+
+
+def test_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    converter = FormConverter(MAP, node_factory=name_node)
+    sink = StoreSink('default', commit_size=2, checkpoint=checkpoint)
+    with pytest.raises(RuntimeError):
+        with sink:
+            load_submissions(converter, forms(5, fail_at=3), sink)
+    # Only the committed batch is recorded
+    assert read_checkpoint(checkpoint) == 2
+    # Carries on from the checkpoint
+    sink = StoreSink('default', commit_size=2, checkpoint=checkpoint)
+    with sink:
+        assert load_submissions(converter, forms(5), sink) == 3
+    assert read_checkpoint(checkpoint) == 5
+    assert sorted(str(c.identifier) for c in sink.graph.contexts()) == [EX + 'Person' + str(i) for i in range(2, 5)]
+
+
+def test_async_store_sink():
+    sink = StoreSink('default', commit_size=3)
+
+    async def run():
+        async with AsyncFormConverter(MAP, node_factory=name_node, sink=sink) as converter:
+            await converter.convert_many(forms(4))
+
+    asyncio.run(run())
+    assert sink.position == 4
+    assert sink.pending == 0
+    assert len(list(sink.graph.contexts())) == 4
+
+
+def test_async_store_sink_checkpoint(tmp_path):
+    # Submissions finish out of order, so they can't be counted for a checkpoint
+    sink = StoreSink('default', checkpoint=str(tmp_path / 'checkpoint.json'))
+
+    async def run():
+        async with AsyncFormConverter(MAP, node_factory=name_node, sink=sink) as converter:
+            await converter.convert({'0-0': 'Person0'})
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_sqlite_store(tmp_path):
+    # A store kept on disk, resumed from its checkpoint and then from the submissions it contains
+    pytest.importorskip('rdflib_sqlalchemy')
+    database = 'sqlite:///' + str(tmp_path / 'store.db')
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    converter = FormConverter(MAP, node_factory=name_node)
+    with pytest.raises(RuntimeError):
+        with StoreSink('SQLAlchemy', database, identifier=URIRef(EX + 'store'), commit_size=2,
+                       checkpoint=checkpoint) as sink:
+            load_submissions(converter, forms(5, fail_at=3), sink)
+    with StoreSink('SQLAlchemy', database, identifier=URIRef(EX + 'store'), commit_size=2,
+                   checkpoint=checkpoint) as sink:
+        assert load_submissions(converter, forms(5), sink) == 3
+    sink = StoreSink('SQLAlchemy', database, identifier=URIRef(EX + 'store'), commit_size=2)
+    assert all(sink.contains(URIRef(EX + 'Person' + str(i))) for i in range(5))
+    remaining = [f for f in forms(8) if not sink.contains(name_node(f))]
+    assert remaining == [{'0-0': 'Person' + str(i)} for i in range(5, 8)]
+
+    async def run():
+        async with AsyncFormConverter(MAP, node_factory=name_node, sink=sink, workers=2) as converter:
+            await converter.convert_many(remaining)
+
+    asyncio.run(run())
+    sink = StoreSink('SQLAlchemy', database, identifier=URIRef(EX + 'store'))
+    assert len(list(sink.graph.contexts())) == 8
+    person = sink.graph.get_context(URIRef(EX + 'Person6'))
+    assert (URIRef(EX + 'Person6'), RDF.type, URIRef(SCHEMA + 'Person')) in person
+    sink.close()
+
+
+def test_missing_store():
+    with pytest.raises(ValueError):
+        StoreSink('NoSuchStore')
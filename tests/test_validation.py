@@ -0,0 +1,187 @@
+import io
+import pickle
+import pytest
+from rdflib import Graph, XSD
+from rdflib.term import Literal, URIRef
+from generate_form import build_form
+from shaclform.form2rdf import FormConverter, CompiledMap, load_map
+from shaclform.validation import ValidationError, PropertyCheck
+
+SCHEMA = 'http://schema.org/'
+EX = 'http://example.org/ex#'
+PREFIXES = '''
+@prefix schema: <http://schema.org/> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+@prefix : <http://example.org/ex#> .
+'''
+
+VALID = {'0-0': 'Launch', '1-0': 'Scheduled', '2-0': '5', '3-0': '10', '4-0:0-0': '4000', '4-0:1-0': 'QLD'}
+
+
+@pytest.fixture(scope='module')
+def compiled_map():
+    with open('inputs/conversion/constrained_shape.ttl') as f:
+        return build_form(f).compiled_map
+
+
+def constraints(violations):
+    return sorted((v.property_id, v.constraint) for v in violations)
+
+
+def test_validation_table(compiled_map):
+    rows = {row[0]: row for row in compiled_map.validation}
+    assert rows['0'][3] == {'minCount': 1, 'maxCount': 1, 'datatype': str(XSD.string), 'pattern': '^[A-Z]',
+                            'maxLength': 20}
+    # Pair constraints refer to properties by ID
+    assert rows['2'][3]['lessThan'] == '3'
+    # Nested properties record the property they are nested in
+    assert rows['4:0'][1] == '4'
+    # Properties with nothing to check are left out
+    assert '4:1' not in rows
+    # The table is kept in the compact map
+    assert CompiledMap.from_json(compiled_map.to_json()).validation == compiled_map.validation
+
+
+def test_validate(compiled_map):
+    converter = FormConverter(compiled_map, base_uri=EX)
+    assert converter.validate(VALID) == []
+    invalid = {'0-0': 'launch', '0-1': 'Again', '1-0': 'Postponed', '2-0': '150', '3-0': 'soon',
+               'NodeKind 4-0': 'BlankNode', '4-0:1-0': 'QLD'}
+    assert constraints(converter.validate(invalid)) == [('0', 'maxCount'), ('0', 'pattern'), ('1', 'in'),
+                                                        ('2', 'lessThan'), ('2', 'maxInclusive'), ('3', 'datatype'),
+                                                        ('4:0', 'minCount')]
+    assert constraints(converter.validate({'2-0': '7', '3-0': '7'})) == [('0', 'minCount'), ('2', 'lessThan')]
+
+
+def test_convert_validated(compiled_map):
+    converter = FormConverter(compiled_map, base_uri=EX, validate=True)
+    result = converter.convert(VALID, root_node=EX + 'launch')
+    assert (URIRef(EX + 'launch'), URIRef(SCHEMA + 'startDate'), Literal('5', datatype=XSD.integer)) in result
+    with pytest.raises(ValidationError) as e:
+        converter.convert(dict(VALID, **{'0-0': 'launch'}))
+    assert constraints(e.value.violations) == [('0', 'pattern')]
+    # Nothing is written for a submission which doesn't conform
+    stream = io.StringIO()
+    with pytest.raises(ValidationError):
+        converter.write_ntriples([{'1-0': 'Postponed'}], stream)
+    assert stream.getvalue() == ''
+
+
+def test_validate_many(compiled_map):
+    converter = FormConverter(compiled_map, base_uri=EX)
+    forms = [VALID, {}, dict(VALID, **{'2-0': '-1'})] * 100
+    results = list(converter.validate_many(forms))
+    assert len(results) == 300
+    assert [constraints(v) for v in results[:3]] == [[], [('0', 'minCount')], [('2', 'minInclusive')]]
+
+
+def test_no_validation_table():
+    # Maps compiled from the Turtle alone don't hold the shape's constraints
+    rdf_map = load_map('inputs/conversion/person_map.ttl')
+    with pytest.raises(ValueError):
+        FormConverter(rdf_map, base_uri=EX, validate=True)
+
+
+def build_map(turtle):
+    return build_form(Graph().parse(data=PREFIXES + turtle, format='turtle')).compiled_map
+
+
+def test_unconstrained_pair_target():
+    # The property a pair constraint refers to is in the table, even with nothing of its own to check
+    compiled_map = build_map('''
+        :PersonShape a sh:NodeShape ;
+            sh:targetClass schema:Person ;
+            sh:property [ sh:path schema:birthDate ; sh:datatype xsd:date ; sh:nodeKind sh:Literal ;
+                          sh:lessThan schema:deathDate ; sh:order 0 ] ;
+            sh:property [ sh:path schema:deathDate ; sh:name "Date of death" ; sh:nodeKind sh:Literal ;
+                          sh:order 1 ] .
+    ''')
+    assert {row[0]: row[2] for row in compiled_map.validation}['1'] == 'Date of death'
+    converter = FormConverter(compiled_map, base_uri=EX)
+    # Its values are read as dates too
+    assert converter.validate({'0-0': '1950-06-01', '1-0': '2001-01-01'}) == []
+    violations = converter.validate({'0-0': '2010-06-01', '1-0': '2001-01-01'})
+    assert constraints(violations) == [('0', 'lessThan')]
+    assert violations[0].message.endswith('is not less than "Date of death"')
+
+
+def test_nested_pairs():
+    # Each entry of a nested property is compared on its own, and with the top level property it refers to
+    compiled_map = build_map('''
+        :PersonShape a sh:NodeShape ;
+            sh:targetClass schema:Person ;
+            sh:property [ sh:path schema:hasOccupation ; sh:nodeKind sh:BlankNode ; sh:order 0 ;
+                sh:property [ sh:path schema:startDate ; sh:datatype xsd:integer ; sh:nodeKind sh:Literal ;
+                              sh:lessThan schema:endDate ; sh:order 0 ] ;
+                sh:property [ sh:path schema:endDate ; sh:datatype xsd:integer ; sh:nodeKind sh:Literal ;
+                              sh:lessThanOrEquals schema:deathDate ; sh:order 1 ] ] ;
+            sh:property [ sh:path schema:deathDate ; sh:datatype xsd:integer ; sh:nodeKind sh:Literal ;
+                          sh:order 1 ] .
+    ''')
+    converter = FormConverter(compiled_map, base_uri=EX)
+    roles = {'0-0:0-0': '2000', '0-0:1-0': '2005', '0-1:0-0': '2010', '0-1:1-0': '2015', '1-0': '2020'}
+    assert converter.validate(roles) == []
+    violations = converter.validate(dict(roles, **{'0-1:0-0': '2016', '1-0': '2012'}))
+    assert sorted((v.constraint, str(v.value)) for v in violations) == [('lessThan', '2016'),
+                                                                         ('lessThanOrEquals', '2015')]
+
+
+def test_option_index_checked():
+    # Options moved out of the form into an option index are still checked
+    with open('inputs/large_in.ttl') as f:
+        compiled_map = build_form(f, option_threshold=10).compiled_map
+    ids = {row[2]: row[0] for row in compiled_map.validation}
+    colour = ids['color']
+    converter = FormConverter(compiled_map, base_uri=EX)
+    # The properties have no sh:nodeKind, so the user picks Literal
+    node_kind = {'NodeKind ' + colour + '-0': 'Literal'}
+    assert converter.validate(dict(node_kind, **{colour + '-0': 'Lavender'})) == []
+    violations = converter.validate(dict(node_kind, **{colour + '-0': 'zzz-not-an-option'}))
+    assert constraints(violations) == [(colour, 'in')]
+
+
+def test_exclusive_bounds():
+    # Exclusive bounds on decimals are compared as they are given, not as the inclusive bounds shown in the form
+    compiled_map = build_map('''
+        :ScoreShape a sh:NodeShape ;
+            sh:targetClass :Score ;
+            sh:property [ sh:path :ratio ; sh:datatype xsd:decimal ; sh:nodeKind sh:Literal ;
+                          sh:minExclusive 0 ; sh:maxExclusive 1 ; sh:order 0 ] .
+    ''')
+    assert compiled_map.validation[0][3] == {'datatype': str(XSD.decimal), 'minExclusive': '0', 'maxExclusive': '1'}
+    converter = FormConverter(compiled_map, base_uri=EX)
+    assert converter.validate({'0-0': '0.5'}) == []
+    assert converter.validate({'0-0': '0.999'}) == []
+    assert constraints(converter.validate({'0-0': '0'})) == [('0', 'minExclusive')]
+    assert constraints(converter.validate({'0-0': '1.0'})) == [('0', 'maxExclusive')]
+    # Inclusive bounds allow the bound itself
+    inclusive = PropertyCheck('0', None, 'ratio', {'datatype': str(XSD.decimal), 'minInclusive': '0',
+                                                   'maxInclusive': '1'})
+    violations = list()
+    for value in ['0', '1', '0.25']:
+        inclusive.check_value(None, Literal(value, datatype=XSD.decimal), violations)
+    assert violations == []
+    inclusive.check_value(None, Literal('1.5', datatype=XSD.decimal), violations)
+    assert [v.constraint for v in violations] == ['maxInclusive']
+
+
+def test_typed_comparisons():
+    dates = PropertyCheck('0', None, 'date', {'datatype': str(XSD.date)})
+    assert dates.key(Literal('2020-01-31', datatype=XSD.date)) < dates.key(Literal('2020-02-01', datatype=XSD.date))
+    assert dates.key(Literal('31/01/2020', datatype=XSD.date)) is None
+    integers = PropertyCheck('0', None, 'n', {'datatype': str(XSD.integer)})
+    # Compared as numbers, not strings
+    assert integers.key(Literal('9')) < integers.key(Literal('10'))
+    assert integers.key(Literal('1_000')) is None
+    flags = PropertyCheck('0', None, 'n', {'pattern': '^abc$', 'flags': 'i'})
+    violations = list()
+    flags.check_value(None, Literal('ABC'), violations)
+    assert violations == []
+
+
+def test_validation_error_pickles(compiled_map):
+    violations = FormConverter(compiled_map, base_uri=EX).validate({})
+    error = pickle.loads(pickle.dumps(ValidationError(violations)))
+    assert error.violations == violations
+    assert str(error) == str(ValidationError(violations))